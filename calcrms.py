@@ -1,154 +1,192 @@
+from __future__ import print_function
 from netCDF4 import Dataset
 import numpy as np
-import sys, os
+import sys, os, argparse
 import dateutils
-import pygrib
+from verifstats import RegionMeans, scores, regions
+from verifstore import VerifStore
+from filecache import ResultCache
+from diagstore import openstores
 
 # compute rms and anomaly correlation using interpolated cubed-sphere pressure-level history files.
+# all requested (var, level, fhour) combinations are verified in one pass, each
+# forecast file is opened once per date.
 
-def getmean(diff,coslats):
-    meancoslats = coslats.mean()
-    return (coslats*diff).mean()/meancoslats
+parser = argparse.ArgumentParser(description='rms and anomaly correlation of forecasts vs EC analyses')
+parser.add_argument('expts', nargs='+', help='experiment names')
+parser.add_argument('date1', help='first date (yyyymmddhh)')
+parser.add_argument('date2', help='last date (yyyymmddhh)')
+parser.add_argument('--vars', default='z',
+    help='comma separated variables to verify (z,t,u,v,...) (default z)')
+parser.add_argument('--levels', default='500',
+    help='comma separated pressure levels (hPa) to verify (default 500)')
+parser.add_argument('--fhours', default='6',
+    help='comma separated forecast hours to verify (default 6)')
+parser.add_argument('--workers', type=int, default=1,
+    help='number of processes used to verify dates in parallel (default 1)')
+parser.add_argument('--cache', default='calcrms_cache.pickle',
+    help="file with cached scores per (expt,date,var,level,fhour), reused if input files are unchanged ('none' to disable)")
+parser.add_argument('--verifcache', default='verifcache',
+    help="directory caching decoded analysis and climo grib fields ('none' to disable)")
+parser.add_argument('--store', default=None,
+    help='diagnostics store to append scores to (%%s is replaced by the experiment name)')
+args = parser.parse_args()
 
-expt1 = sys.argv[1]
-expt2 = sys.argv[2]
-date1 = sys.argv[3]
-date2 = sys.argv[4]
+expts = args.expts
+date1 = args.date1
+date2 = args.date2
+nexps = len(expts)
 
-fhour = 6
-var = 'z'
-level = 500 
+varlist = args.vars.split(',')
+levels = [int(level) for level in args.levels.split(',')]
+fhours = [int(fhour) for fhour in args.fhours.split(',')]
+combos = [(var,level,fhour) for var in varlist for level in levels for fhour in fhours]
 
-vargrb = var
-varnc = '%s_plev' % var
-if var == 'z': 
-    vargrb = 'gh'
-    varnc = 'h_plev'
+def getvarnames(var):
+    # grib shortName, netcdf variable name.
+    if var == 'z':
+        return 'gh', 'h_plev'
+    else:
+        return var, '%s_plev' % var
 
-latbound = 20 # boundary between tropics and extra-tropics 
+latbound = 20 # boundary between tropics and extra-tropics
 analpath = '/scratch3/BMC/gsienkf/whitaker/ecanl'
-datapath1 = '/scratch3/BMC/gsienkf/whitaker/%s' % expt1
-datapath2 = '/scratch3/BMC/gsienkf/whitaker/%s' % expt2
+datapaths = ['/scratch3/BMC/gsienkf/whitaker/%s' % expt for expt in expts]
 climopath =  '/scratch4/NCEPDEV/global/save/Fanglin.Yang/VRFY/vsdb/nwprod/fix/'
 
-if fhour > 9:
-    dates = dateutils.daterange(date1,date2,24)
-else:
-    dates = dateutils.daterange(date1,date2,6)
+# dates verified for each forecast hour.
+datesfhr = {}
+for fhour in fhours:
+    if fhour > 9:
+        datesfhr[fhour] = dateutils.daterange(date1,date2,24)
+    else:
+        datesfhr[fhour] = dateutils.daterange(date1,date2,6)
 #dates.remove('2016011300')
 #dates.remove('2016010912')
-ntime = None; fcsterrspect1 = None; fcsterrspect2 = None
-rmsnhall1=[];rmsshall1=[];rmstrall1=[];rmsglall1=[]
-acnhall1=[];acshall1=[];actrall1=[];acglall1=[]
-rmsnhall2=[];rmsshall2=[];rmstrall2=[];rmsglall2=[]
-acnhall2=[];acshall2=[];actrall2=[];acglall2=[]
-for date in dates:
+dates = sorted(set(date for fhour in fhours for date in datesfhr[fhour]))
+
+cache = ResultCache(None if args.cache == 'none' else args.cache)
+verifstore = VerifStore(None if args.verifcache == 'none' else args.verifcache)
+
+def getfiles(date, datapath, fhour):
+    # forecast, verifying analysis and climo files scores depend on.
     datev = dateutils.dateshift(date,fhour)
-    # read analysis
-    analfile = os.path.join(analpath,'pgbanl.ecm.%s' % datev)
-    grbs = pygrib.open(analfile)
-    grb = grbs.select(shortName=vargrb,level=level)[0]
-    verif_data = grb.values[::-1,:]
-    grbs.close()
-    # read climo
-    grbsclimo = pygrib.open(os.path.join(climopath,'cmean_1d.1959%s'%datev[4:8]))
-    yyyy,mm,dd,hh = dateutils.splitdate(datev)
-    grbclimo = grbsclimo.select(shortName=vargrb,level=level,dataTime=100*hh)[0]
-    climo_data = grbclimo.values[::-1,:]
-    grbsclimo.close()
-    if fhour > 9:
-        fcstfile = '%s/%s/fv3longcontrol2_historyp_%s_latlon.nc'% (datapath1,date,date)
-    else:
-        fcstfile = '%s/%s/fv3control2_historyp_%s_latlon.nc'% (datapath1,date,date)
-    nc = Dataset(fcstfile)
-    if ntime is None:
-        lons = nc['longitude'][:]; lats = nc['latitude'][:]
-        latslist = lats.tolist()
-        latnh = latslist.index(latbound)
-        latsh = latslist.index(-latbound)
-        #print lats[:latsh]
-        #print lats[latsh:latnh+1]
-        #print lats[latnh+1:]
-        #raise SystemExit
-        lons2, lats2 = np.meshgrid(lons, lats)
-        coslats = np.cos(np.radians(lats2))
-        coslatssh = coslats[:latsh,:]
-        coslatsnh = coslats[latnh+1:,:]
-        coslatstr = coslats[latsh:latnh+1,:]
-        nlons = len(lons); nlats = len(lats)
-    times = nc['time'][:].tolist()
-    levels = nc['plev'][:].tolist()
-    ntime = times.index(fhour)
-    nlev = levels.index(level)
-    if int(nc['time'][ntime]) != fhour:
-       raise ValueError('incorrect forecast time')
-    fcst_data1 = nc[varnc][ntime,nlev,...]
-    pmask1 = nc['pmaskv2'][ntime,...]
-    #pmask1 = nc['pressfc'][ntime,...]/100.
-    nc.close()
     if fhour > 9:
-        fcstfile = '%s/%s/fv3longcontrol2_historyp_%s_latlon.nc'% (datapath2,date,date)
+        fcstfile = '%s/%s/fv3longcontrol2_historyp_%s_latlon.nc'% (datapath,date,date)
     else:
-        fcstfile = '%s/%s/fv3control2_historyp_%s_latlon.nc'% (datapath2,date,date)
-    nc = Dataset(fcstfile)
-    times = nc['time'][:].tolist()
-    levels = nc['plev'][:].tolist()
-    ntime = times.index(fhour)
-    nlev = levels.index(level)
-    if int(nc['time'][ntime]) != fhour:
-       raise ValueError('incorrect forecast time')
-    fcst_data2 = nc[varnc][ntime,nlev,...]
-    pmask2 = nc['pmaskv2'][ntime,...]
-    #pmask2 = nc['pressfc'][ntime,...]/100.
-    nc.close()
-    #print date,verif_data.shape,verif_data.min(),verif_data.max(),\
-    #           fcst_data1.shape,fcst_data1.min(),fcst_data1.max(),\
-    #           fcst_data2.shape,fcst_data2.min(),fcst_data2.max()
-    # mask all points that are underground in either forecast
-    fcsterr1 = np.ma.array(fcst_data1 - verif_data,mask=pmask1<level)
-    fcsterr2 = np.ma.array(fcst_data2 - verif_data,mask=pmask2<level)
-    fanom1 = np.ma.array(fcst_data1 - climo_data,mask=pmask1<level)
-    fanom2 = np.ma.array(fcst_data2 - climo_data,mask=pmask2<level)
-    vanom = verif_data - climo_data
+        fcstfile = '%s/%s/fv3control2_historyp_%s_latlon.nc'% (datapath,date,date)
+    analfile = os.path.join(analpath,'pgbanl.ecm.%s' % datev)
+    climofile = os.path.join(climopath,'cmean_1d.1959%s'%datev[4:8])
+    return fcstfile, analfile, climofile
+
+regionmeans = None
+def verify(date):
+    # compute scores for all experiments and all combos verified on this date.
+    # returns dict combo -> (rms, ac) (nexps,nregions) plus list of newly
+    # computed cache entries.
+    global regionmeans
+    results = {}; todo = []
+    for combo in combos:
+        var, level, fhour = combo
+        if date not in datesfhr[fhour]: continue
+        results[combo] = [None]*nexps
+        for nexp in range(nexps):
+            results[combo][nexp] = cache.get((expts[nexp],date)+combo,getfiles(date,datapaths[nexp],fhour))
+            if results[combo][nexp] is None: todo.append((nexp,combo))
+    newentries = []
+    if todo:
+        # read all needed slices, opening each forecast file once.
+        fcst_data = {}; pmask = {}
+        for nexp in sorted(set(nexp for nexp,combo in todo)):
+            fcstfiles = {}
+            for nexp2, (var, level, fhour) in todo:
+                if nexp2 != nexp: continue
+                fcstfile = getfiles(date,datapaths[nexp],fhour)[0]
+                fcstfiles.setdefault(fcstfile,[]).append((var,level,fhour))
+            for fcstfile in fcstfiles:
+                nc = Dataset(fcstfile)
+                if regionmeans is None:
+                    lons = nc['longitude'][:]; lats = nc['latitude'][:]
+                    # cos(lat) weights for each region, computed once.
+                    regionmeans = RegionMeans(lats,len(lons),latbound)
+                times = nc['time'][:].tolist()
+                plevs = nc['plev'][:].tolist()
+                for combo in fcstfiles[fcstfile]:
+                    var, level, fhour = combo
+                    ntime = times.index(fhour)
+                    nlev = plevs.index(level)
+                    if int(nc['time'][ntime]) != fhour:
+                       raise ValueError('incorrect forecast time')
+                    fcst_data[nexp,combo] = nc[getvarnames(var)[1]][ntime,nlev,...]
+                    pmask[nexp,combo] = nc['pmaskv2'][ntime,...]
+                    #pmask[nexp,combo] = nc['pressfc'][ntime,...]/100.
+                nc.close()
+        # read verifying analyses and climo (all levels/vars from one file at once).
+        verif_data = {}; climo_data = {}
+        for fhour in sorted(set(combo[2] for nexp,combo in todo)):
+            fcombos = sorted(set(combo for nexp,combo in todo if combo[2] == fhour))
+            datev = dateutils.dateshift(date,fhour)
+            yyyy,mm,dd,hh = dateutils.splitdate(datev)
+            fcstfile, analfile, climofile = getfiles(date,datapaths[0],fhour)
+            analdata = verifstore.get_many(analfile,[(getvarnames(var)[0],level,None) for var,level,fhour in fcombos])
+            climodata = verifstore.get_many(climofile,[(getvarnames(var)[0],level,100*hh) for var,level,fhour in fcombos])
+            for combo, anal, climo in zip(fcombos,analdata,climodata):
+                verif_data[combo] = anal[::-1,:]; climo_data[combo] = climo[::-1,:]
+        # mask all points that are underground in forecast, compute
+        # all regional statistics for all experiments at once.
+        for combo in verif_data:
+            nexps_todo = [nexp for nexp,combo2 in todo if combo2 == combo]
+            rms, ac = scores(np.array([fcst_data[nexp,combo] for nexp in nexps_todo]),
+                      verif_data[combo],climo_data[combo],
+                      valid=np.array([pmask[nexp,combo] for nexp in nexps_todo])>=combo[1],
+                      regionmeans=regionmeans)
+            for n, nexp in enumerate(nexps_todo):
+                results[combo][nexp] = (rms[n],ac[n])
+                newentries.append(((expts[nexp],date)+combo,getfiles(date,datapaths[nexp],combo[2]),(rms[n],ac[n])))
+    for combo in results:
+        results[combo] = (np.array([r[0] for r in results[combo]]),np.array([r[1] for r in results[combo]]))
+    return results, newentries
 
-    rmssh1 = np.sqrt(getmean(fcsterr1[:latsh,:]**2,coslatssh))
-    rmsnh1 = np.sqrt(getmean(fcsterr1[latnh+1:,:]**2,coslatsnh))
-    rmstr1 = np.sqrt(getmean(fcsterr1[latsh:latnh+1,:]**2,coslatstr))
-    rmsgl1 = np.sqrt(getmean(fcsterr1**2,coslats))
-    rmsshall1.append(rmssh1); rmsnhall1.append(rmsnh1)
-    rmstrall1.append(rmstr1); rmsglall1.append(rmsgl1)
-    rmssh2 = np.sqrt(getmean(fcsterr2[:latsh,:]**2,coslatssh))
-    rmsnh2 = np.sqrt(getmean(fcsterr2[latnh+1:,:]**2,coslatsnh))
-    rmstr2 = np.sqrt(getmean(fcsterr2[latsh:latnh+1,:]**2,coslatstr))
-    rmsgl2 = np.sqrt(getmean(fcsterr2**2,coslats))
-    rmsshall2.append(rmssh2); rmsnhall2.append(rmsnh2)
-    rmstrall2.append(rmstr2); rmsglall2.append(rmsgl2)
+if args.workers > 1:
+    from multiprocessing import Pool
+    pool = Pool(args.workers)
+    results = pool.imap(verify, dates)
+else:
+    results = (verify(date) for date in dates)
 
-    cov1 = fanom1*vanom; fvar1 = fanom1**2; vvar = vanom**2
-    acsh1 = getmean(cov1[:latsh:],coslatssh)/(np.sqrt(getmean(fvar1[:latsh:],coslatssh))*np.sqrt(getmean(vvar[:latsh:],coslatssh)))
-    acnh1 = getmean(cov1[latnh+1:,:],coslatsnh)/(np.sqrt(getmean(fvar1[latnh+1:,:],coslatsnh))*np.sqrt(getmean(vvar[latnh+1:,:],coslatsnh)))
-    actr1 = getmean(cov1[latsh:latnh+1,:],coslatstr)/(np.sqrt(getmean(fvar1[latsh:latnh+1,:],coslatstr))*np.sqrt(getmean(vvar[latsh:latnh+1,:],coslatstr)))
-    acgl1 = getmean(cov1,coslats)/(np.sqrt(getmean(fvar1,coslats))*np.sqrt(getmean(vvar,coslats)))
-    acshall1.append(acsh1); acnhall1.append(acnh1)
-    actrall1.append(actr1); acglall1.append(acgl1)
-    cov2 = fanom2*vanom; fvar2 = fanom2**2
-    acsh2 = getmean(cov2[:latsh:],coslatssh)/(np.sqrt(getmean(fvar2[:latsh:],coslatssh))*np.sqrt(getmean(vvar[:latsh:],coslatssh)))
-    acnh2 = getmean(cov2[latnh+1:,:],coslatsnh)/(np.sqrt(getmean(fvar2[latnh+1:,:],coslatsnh))*np.sqrt(getmean(vvar[latnh+1:,:],coslatsnh)))
-    actr2 = getmean(cov2[latsh:latnh+1,:],coslatstr)/(np.sqrt(getmean(fvar2[latsh:latnh+1,:],coslatstr))*np.sqrt(getmean(vvar[latsh:latnh+1,:],coslatstr)))
-    acgl2 = getmean(cov2,coslats)/(np.sqrt(getmean(fvar2,coslats))*np.sqrt(getmean(vvar,coslats)))
-    acshall2.append(acsh2); acnhall2.append(acnh2)
-    actrall2.append(actr2); acglall2.append(acgl2)
+scoresall = dict((combo,[]) for combo in combos)
+for date, (scoresdate, newentries) in zip(dates,results):
+    for key, files, value in newentries:
+        cache.put(key,files,value)
+    for combo in scoresdate:
+        scoresall[combo].append((date,)+scoresdate[combo])
+if args.workers > 1:
+    pool.close(); pool.join()
+cache.save()
 
-    print '%s %6.2f %6.2f %6.2f %6.2f %6.2f %6.2f %6.2f %6.2f %7.3f %7.3f %7.3f %7.3f %7.3f %7.3f %7.3f %7.3f' %\
-    (date,rmsnh1,rmsnh2,rmstr1,rmstr2,rmssh1,rmssh2,rmsgl1,rmsgl2,acnh1,acnh2,actr1,actr2,acsh1,acsh2,acgl1,acgl2)
+# append scores to each experiment's diagnostics store (one row per forecast initial date).
+if args.store is not None:
+    for nexp, store in enumerate(openstores(args.store,expts)):
+        rows = {}
+        for combo in combos:
+            var, level, fhour = combo
+            for date, rms, ac in scoresall[combo]:
+                records = rows.setdefault(date,[])
+                for nreg, region in enumerate(regions):
+                    attrs = dict(var=var,level=level,fhour=fhour,region=region)
+                    records.append(('rms_%s_%s_f%03i_%s' % (combo+(region,)),rms[nexp,nreg],dict(diag='rms',**attrs)))
+                    records.append(('ac_%s_%s_f%03i_%s' % (combo+(region,)),ac[nexp,nreg],dict(diag='ac',**attrs)))
+        store.extend(sorted(rows.items()))
 
-rmsnh1 = np.asarray(rmsnhall1).mean(); acnh1 = np.asarray(acnhall1).mean()
-rmssh1 = np.asarray(rmsshall1).mean(); acsh1 = np.asarray(acshall1).mean()
-rmstr1 = np.asarray(rmstrall1).mean(); actr1 = np.asarray(actrall1).mean()
-rmsgl1 = np.asarray(rmsglall1).mean(); acgl1 = np.asarray(acglall1).mean()
-rmsnh2 = np.asarray(rmsnhall2).mean(); acnh2 = np.asarray(acnhall2).mean()
-rmssh2 = np.asarray(rmsshall2).mean(); acsh2 = np.asarray(acshall2).mean()
-rmstr2 = np.asarray(rmstrall2).mean(); actr2 = np.asarray(actrall2).mean()
-rmsgl2 = np.asarray(rmsglall2).mean(); acgl2 = np.asarray(acglall2).mean()
-print '#%s-%s %6.2f %6.2f %6.2f %6.2f %6.2f %6.2f %6.2f %6.2f %7.3f %7.3f %7.3f %7.3f %7.3f %7.3f %7.3f %7.3f' %\
-(date1,date2,rmsnh1,rmsnh2,rmstr1,rmstr2,rmssh1,rmssh2,rmsgl1,rmsgl2,acnh1,acnh2,actr1,actr2,acsh1,acsh2,acgl1,acgl2)
+# print score table, one block per (var, level, fhour).
+# columns are region (nh,tr,sh,gl) then experiment.
+for combo in combos:
+    if len(combos) > 1:
+        print('# %s %s %sh' % combo)
+    if not scoresall[combo]:
+        print('no dates for %s %s %sh, skipping' % combo)
+        continue
+    for date, rms, ac in scoresall[combo]:
+        print(date+nexps*' %6.2f'*4 % tuple(rms.T.ravel())+nexps*' %7.3f'*4 % tuple(ac.T.ravel()))
+    rms = np.mean([s[1] for s in scoresall[combo]],axis=0); ac = np.mean([s[2] for s in scoresall[combo]],axis=0)
+    print('#%s-%s' % (date1,date2)+nexps*' %6.2f'*4 % tuple(rms.T.ravel())+nexps*' %7.3f'*4 % tuple(ac.T.ravel()))
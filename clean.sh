@@ -67,7 +67,7 @@ if [ $save_hpss_subset == "false" ] && [ $save_hpss_full == "false" ]; then
   /bin/rm -rf fgens fgens2
   /bin/rm -f diag*cris* diag*airs* diag*iasi*
   /bin/rm -f *fhr03* *fhr09* *chgres
-  /bin/rm -rf control ensmean
+  /bin/rm -rf control ensmean enssprd
   #if [ $hr != '00' ]; then
       /bin/rm -rf control2
   #fi
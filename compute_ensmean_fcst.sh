@@ -1,12 +1,7 @@
 #!/bin/sh
 
 source $MODULESHOME/init/sh
-if [ $machine == 'gaea' ]; then
-   nces=/ncrc/home2/Jeffrey.S.Whitaker/anaconda2/bin/nces
-else
-   module load nco
-   nces=`which nces`
-fi
+source ${enkfscripts}/timing.sh
 module list
 export OMP_STACKSIZE=1024M
 
@@ -16,6 +11,7 @@ fh=${FHMIN}
 while [ $fh -le $FHMAX ]; do
 
   charfhr="fhr`printf %02i $fh`"
+  timing_event ensmean_fhr start "" "" $fh
 
   if [ $cleanup_ensmean == 'true' ] || ([ $cleanup_ensmean == 'false' ]  && [ ! -s ${datapath}/${analdate}/bfg_${analdate}_${charfhr}_ensmean ]); then
       echo "running  ${execdir}/getsfcensmeanp.x ${datapath2}/ bfg_${analdate}_${charfhr}_ensmean bfg_${analdate}_${charfhr} ${nanals}"
@@ -34,6 +30,7 @@ while [ $fh -le $FHMAX ]; do
       ${enkfscripts}/runmpi
   fi
 
+  timing_event ensmean_fhr end "" "" $fh
   fh=$((fh+FHOUT))
 
 done
@@ -42,65 +39,54 @@ done
 if [ $ensmean_restart == 'true' ] && [ $fg_only == 'false' ] && [ $hr == '06' ]; then
 if [ $cleanup_ensmean == 'true' ] || ([ $cleanup_ensmean == 'false' ]  && [ ! -s ${datapath2}/ensmean/INPUT/fv_core.res.tile1.nc ]); then
    echo "compute ensemble mean restart files `date`"
+   timing_event ensmean_fcst/restart start
    export nprocs=1
    export mpitaskspernode=1
    export OMP_NUM_THREADS=$corespernode
    pathout=${datapath2}/ensmean/INPUT
    mkdir -p $pathout
-   ncount=1
+   files=""
    tiles="tile1 tile2 tile3 tile4 tile5 tile6"
    for tile in $tiles; do
-      files="fv_core.res.${tile}.nc fv_tracer.res.${tile}.nc fv_srf_wnd.res.${tile}.nc sfc_data.${tile}.nc phy_data.${tile}.nc"
-      for file in $files; do
-         export PGM="${nces} -O `ls -1 ${datapath2}/mem*/INPUT/${filename}` ${pathout}/${filename}"
-         echo "computing ens mean for $filename"
-         #${enkfscripts}/runmpi &
-         $PGM &
-         if [ $ncount == $NODES ]; then
-            echo "waiting for backgrounded jobs to finish..."
-            wait
-            ncount=1
-         else
-            ncount=$((ncount+1))
-         fi
-      done
+      files="$files fv_core.res.${tile}.nc fv_tracer.res.${tile}.nc fv_srf_wnd.res.${tile}.nc sfc_data.${tile}.nc phy_data.${tile}.nc"
    done
-   wait
-   /bin/rm -f ${datapath2}/hostfile_nces*
+   # all files and variables are read by one pool of $corespernode processes,
+   # member data held at once is limited by ensstats.py --maxmem (default 2000 MB).
+   # spread is computed in the same pass (in enssprd/INPUT).
+   echo "computing ens mean and spread for $files"
+   $python ${enkfscripts}/ensstats.py ${pathout} $files --members "${datapath2}/mem*/INPUT" --sprdpath ${datapath2}/enssprd/INPUT --workers $corespernode
+   if [ $? -ne 0 ]; then
+      echo "ensstats.py failed computing ensemble mean restart files"
+      exit 1
+   fi
    /bin/cp -f ${datapath2}/mem001/INPUT/fv_core.res.nc ${pathout}
+   timing_event ensmean_fcst/restart end 0
    echo "done computing ensemble mean restart files `date`"
 fi
 fi
 
 if [ $controlfcst == 'false' ] && [ $cleanup_ensmean == 'true' ] && [ ! -z $copy_history_files ];  then
    echo "compute ensemble mean history files `date`"
+   timing_event ensmean_fcst/history start
    export nprocs=1
    export mpitaskspernode=1
    export OMP_NUM_THREADS=$corespernode
-   pathout=${datapath2}/ensmean
-   mkdir -p $pathout
-   ncount=1
-   tiles="tile1 tile2 tile3 tile4 tile5 tile6"
-   for tile in $tiles; do
-      filename="fv3_historyp.${tile}.nc"
-      export PGM="${nces} -4 -L 5 -O `ls -1 ${datapath2}/mem*/${filename}` ${pathout}/${filename}"
-      echo "computing ens mean for $filename"
-      #${enkfscripts}/runmpi &
-      $PGM &
-      if [ $ncount == $NODES ]; then
-         echo "waiting for backgrounded jobs to finish..."
-         wait
-         ncount=1
-      else
-         ncount=$((ncount+1))
-      fi
-   done
-   wait
-   /bin/rm -f ${datapath2}/hostfile_nces*
-   echo "done computing ensemble mean history files `date`"
-   # interpolate to 1x1 grid
+   # ens mean of member history files is computed in memory and interpolated
+   # to 1x1 grid directly, native ens mean tiles only written if
+   # save_ensmean_history is true.  data held by all workers together is
+   # limited to about 4 GB (--maxmem) so memory does not grow with core count.
+   meanopts=""
+   if [ "$save_ensmean_history" == 'true' ]; then
+      meanopts="--meanpath ${datapath2}/ensmean"
+   fi
    cd ${enkfscripts}
-   $python ncinterp.py ${datapath2}/ensmean ${datapath2}/fv3ensmean_historyp_${analdatem1}_latlon.nc $RES $analdatem1
+   $python ncinterp.py ${datapath2} ${datapath2}/fv3ensmean_historyp_${analdatem1}_latlon.nc $RES $analdatem1 --members "mem*" $meanopts --weights --workers $corespernode --maxmem 4000
+   if [ $? -ne 0 ]; then
+      echo "ncinterp.py failed computing ensemble mean history files"
+      exit 1
+   fi
+   timing_event ensmean_fcst/history end 0
+   echo "done computing ensemble mean history files `date`"
 fi
 
 echo "all done `date`"
@@ -40,6 +40,12 @@ export rungfs='run_fv3.sh' # ensemble forecast
 
 export recenter_anal="true" # recenter enkf analysis around GSI hybrid 4DEnVar analysis
 export do_cleanup='true' # if true, create tar files, delete *mem* files.
+export run_cyclediag='false' # if true, append per-cycle diagnostics to ${datapath}/diagstore.nc (cyclediag.py)
+export cyclediag_opts="" # extra options for cyclediag.py (e.g. "--ecanl <EC analysis dir>")
+export save_ensmean_history='false' # if true, also save native ens mean history tiles in <analdate>/ensmean
+export use_cycledriver='false' # if true, run cycle stages concurrently where possible with cycledriver.py
+export cycledriver_opts="" # extra options for cycledriver.py (e.g. "--maxjobs 4")
+export cycledriver_nodes="" # nodes for individual cycledriver.py stages (e.g. "fg_control=8,fg_ens=12"), default sized from control_proc/fg_proc
 export controlanal='true' # use gsi hybrid (if false, pure enkf is used)
 export controlfcst='true' # if true, run dual-res setup with single high-res control
 export cleanup_fg='true'
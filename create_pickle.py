@@ -1,33 +1,56 @@
 from __future__ import print_function
 from netCDF4 import Dataset
 import numpy as np
-import sys, time
-from stripack import trmesh
-try:
-    import cPickle
-except:
-    import _pickle as cPickle
+import time, argparse
+from multiprocessing import Pool
+from fv3interp import lonlat_to_xyz, cubed_sphere_triangles, trmesh_triangles,\
+                      save_mesh, mesh_files
 
-# test fv3 interpolation from native history files to random points.
+# triangulate fv3 grid cell centers, save the mesh as plain arrays
+# (C<res>_grid_xyz.npy, C<res>_grid_triangles.npy) for ncinterp.py.
 
-res = int(sys.argv[1])
-fixfv3 = '/work/noaa/gsienkf/whitaker/fix/fix_fv3_gmted2010'
-# perform triangulation.
-lons = []; lats = []
-for ntile in range(1,7,1):
+parser = argparse.ArgumentParser(description='create fv3 cubed-sphere mesh cache for ncinterp.py')
+parser.add_argument('res', type=int, help='cubed-sphere resolution (RES)')
+parser.add_argument('--fixfv3', default='/work/noaa/gsienkf/whitaker/fix/fix_fv3_gmted2010',
+    help='directory containing C<RES>/C<RES>_grid.tile*.nc')
+parser.add_argument('--trmesh', action='store_true',
+    help='use general stripack delaunay triangulation instead of the cubed-sphere structure')
+args = parser.parse_args()
+
+res = args.res
+fixfv3 = args.fixfv3
+
+def read_tile(ntile):
+    # read cell centers (every other point of supergrid) for one tile.
     gridfile = '%s/C%s/C%s_grid.tile%s.nc'% (fixfv3,res,res,ntile)
     nc = Dataset(gridfile)
     lonsmid = nc['x'][1::2,1::2]
     latsmid = nc['y'][1::2,1::2]
-    lons.append(lonsmid); lats.append(latsmid)
     nc.close()
-lons = np.radians(np.array(lons,dtype=np.float64)).ravel()
-lats = np.radians(np.array(lats,dtype=np.float64)).ravel()
-t1 = time.clock()
-print('triangulation of', len(lons),' points')
-tri = trmesh(lons, lats)
-print('triangulation took',time.clock()-t1,' secs')
+    return np.radians(np.asarray(lonsmid,np.float64)), np.radians(np.asarray(latsmid,np.float64))
+
+# read the six tiles in parallel.
+t1 = time.time()
+pool = Pool(6)
+lonlats = pool.map(read_tile, range(1,7,1))
+pool.close(); pool.join()
+lons = np.array([lonlat[0] for lonlat in lonlats])
+lats = np.array([lonlat[1] for lonlat in lonlats])
+print('reading grid files took',time.time()-t1,' secs')
+
+# perform triangulation.
+t1 = time.time()
+xyz = lonlat_to_xyz(lons, lats)
+print('triangulation of', len(xyz),' points')
+if args.trmesh:
+    from stripack import trmesh
+    tri = trmesh(lons.ravel(), lats.ravel())
+    triangles = trmesh_triangles(tri)
+else:
+    triangles = cubed_sphere_triangles(xyz.reshape(6,res,res,3))
+print('triangulation took',time.time()-t1,' secs')
 
-# pickle it.
-picklefile = 'C%s_grid.pickle' % res
-cPickle.dump(tri,open(picklefile,'wb'),-1)
+# save node coordinates and triangle list.
+t1 = time.time()
+save_mesh(res, xyz, triangles)
+print('writing',' '.join(mesh_files(res)),'took',time.time()-t1,' secs')
@@ -0,0 +1,151 @@
+from __future__ import print_function
+import numpy as np
+import sys, os, argparse
+import dateutils
+from netCDF4 import Dataset
+from verifstats import RegionMeans, regions
+from diagstore import DiagStore
+
+# post-cycle diagnostics, run by main.sh once per analysis time while the
+# cycle's files are still on disk.  appends global/regional mean surface
+# pressure, regional ensemble spread profiles, increment spectra and
+# (optionally) ens mean forecast rms errors vs EC analyses for this cycle
+# to the experiment's diagnostics store, so plots over long periods only
+# need to read the (small) store.
+
+parser = argparse.ArgumentParser(description='append diagnostics for one cycle to the experiment diagnostics store')
+parser.add_argument('datapath', help='experiment data directory (contains <analdate> directories)')
+parser.add_argument('analdate', help='analysis time (yyyymmddhh)')
+parser.add_argument('--store', default=None,
+    help='diagnostics store (default <datapath>/diagstore.nc)')
+parser.add_argument('--fhr', type=int, default=6,
+    help='forecast hour of first guess valid at analdate (default 6)')
+parser.add_argument('--spreadvars', default='ugrd,vgrd,tmp,spfh',
+    help='comma separated variables for spread profiles (default ugrd,vgrd,tmp,spfh)')
+parser.add_argument('--incvars', default='tmp',
+    help='comma separated variables for increment spectra (default tmp)')
+parser.add_argument('--inclevs', default='39',
+    help='comma separated model level indices for increment spectra (default 39)')
+parser.add_argument('--ecanl', default=None,
+    help='directory with EC analyses (pgbanl.ecm.<date>), if given compute ens mean forecast rms errors')
+parser.add_argument('--rmsvars', default='z,t',
+    help='comma separated variables for rms errors (default z,t)')
+parser.add_argument('--rmslevels', default='500,850',
+    help='comma separated pressure levels for rms errors (default 500,850)')
+args = parser.parse_args()
+
+analdate = args.analdate
+datapath2 = os.path.join(args.datapath,analdate)
+store = DiagStore(args.store if args.store is not None else os.path.join(args.datapath,'diagstore.nc'))
+fgfile = os.path.join(datapath2,'sfg_%s_fhr%02i_ensmean' % (analdate,args.fhr))
+sprdfile = os.path.join(datapath2,'sfg_%s_fhr%02i_enssprd' % (analdate,args.fhr))
+# analyses and the first guess each increment is computed from.
+anlfiles = [('ensmean','sanl_%s_fhr%02i_ensmean','sfg_%s_fhr%02i_ensmean'),
+            ('enkf','sanl_%s_fhr%02i_ensmean.orig','sfg_%s_fhr%02i_ensmean'),
+            ('control','sanl_%s_fhr%02i_control','sfg_%s_fhr%02i_control')]
+anlfiles = [(name,os.path.join(datapath2,anlfile % (analdate,args.fhr)),os.path.join(datapath2,fgfile2 % (analdate,args.fhr)))\
+            for name,anlfile,fgfile2 in anlfiles]
+anlfiles = [(name,anlfile,fgfile2) for name,anlfile,fgfile2 in anlfiles if os.path.exists(anlfile) and os.path.exists(fgfile2)]
+
+def getregionmeans(nc):
+    lats = nc['lat'][:]
+    if lats.ndim == 2: lats = lats[:,0]
+    return RegionMeans(lats,nc['lon'].shape[-1])
+
+records = []; rmsrecords = []
+regionmeans = None
+
+# mean surface pressure of first guess and analysis.
+for diag, name, filename in [('meanps_fg','meanps_fg_f%03i' % args.fhr,fgfile)]+\
+    [('meanps_anl','meanps_anl_f%03i' % args.fhr,anlfile) for anlname,anlfile,fgfile2 in anlfiles if anlname == 'ensmean']:
+    if not os.path.exists(filename): continue
+    nc = Dataset(filename)
+    if regionmeans is None: regionmeans = getregionmeans(nc)
+    meanps = regionmeans(nc['pressfc'][0,...])
+    nc.close()
+    for nreg, region in enumerate(regions):
+        records.append(('%s_%s' % (name,region),meanps[nreg],dict(diag=diag,var='pressfc',fhour=args.fhr,region=region)))
+    print(name,' '.join('%s %s' % (region,meanps[nreg]) for nreg,region in enumerate(regions)))
+
+# regional mean spread profiles (all model levels) from ens spread file.
+if os.path.exists(sprdfile):
+    nc = Dataset(sprdfile)
+    if regionmeans is None: regionmeans = getregionmeans(nc)
+    for var in args.spreadvars.split(','):
+        if var not in nc.variables: continue
+        spread = regionmeans(nc[var][0,...]) # (nlevs,nregions)
+        for nreg, region in enumerate(regions):
+            records.append(('spread_%s_%s' % (var,region),spread[:,nreg],dict(diag='spread',var=var,region=region)))
+        print('spread',var,'global mean',spread[:,-1].mean())
+    nc.close()
+
+# increment spectra (analysis minus first guess) for each available analysis,
+# all from one batched transform.
+if anlfiles and args.incvars:
+    incvars = args.incvars.split(','); inclevs = [int(lev) for lev in args.inclevs.split(',')]
+    incs = []; keys = []
+    for anlname, anlfile, fgfile2 in anlfiles:
+        ncanl = Dataset(anlfile); ncfg = Dataset(fgfile2)
+        for var in incvars:
+            if var == 'pressfc':
+                incs.append(ncanl[var][0,::-1,...] - ncfg[var][0,::-1,...])
+                keys.append((anlname,var,None))
+                continue
+            for lev in inclevs:
+                incs.append(ncanl[var][0,lev,::-1,...] - ncfg[var][0,lev,::-1,...])
+                keys.append((anlname,var,lev))
+        ncanl.close(); ncfg.close()
+    incs = np.array(incs)
+    try:
+        from spectutils import getgridspectra
+        gridspectra = getgridspectra(incs.shape[-1],incs.shape[-2])
+    except ImportError:
+        print('spharm not available, skipping increment spectra')
+        gridspectra = None
+    if gridspectra is not None:
+        incspecs = gridspectra(incs)
+        for (anlname,var,lev), incspec in zip(keys,incspecs):
+            if lev is None:
+                name = 'incspec_%s_%s' % (anlname,var)
+                attrs = dict(diag='incspec_%s' % anlname,var=var,region='gl')
+            else:
+                # lev is a model level index, level is kept for pressure levels.
+                name = 'incspec_%s_%s_k%s' % (anlname,var,lev)
+                attrs = dict(diag='incspec_%s' % anlname,var=var,modellev=lev,region='gl')
+            records.append((name,incspec,attrs))
+            print(name,'global rms',np.sqrt(incspec.sum()))
+
+# rms error of ens mean first guess (interpolated to latlon grid) vs EC analyses,
+# stored in the row of the forecast initial time (as in calcrms.py).
+if args.ecanl is not None:
+    from verifstore import VerifStore
+    analdatem1 = dateutils.dateshift(analdate,-args.fhr)
+    fcstfile = os.path.join(datapath2,'fv3ensmean_historyp_%s_latlon.nc' % analdatem1)
+    analfile = os.path.join(args.ecanl,'pgbanl.ecm.%s' % analdate)
+    if os.path.exists(fcstfile) and os.path.exists(analfile):
+        combos = [(var,int(level)) for var in args.rmsvars.split(',') for level in args.rmslevels.split(',')]
+        nc = Dataset(fcstfile)
+        lats = nc['latitude'][:]
+        rmsregionmeans = RegionMeans(lats,len(nc['longitude']))
+        ntime = nc['time'][:].tolist().index(args.fhr)
+        plevs = nc['plev'][:].tolist()
+        verif_data = VerifStore(None).get_many(analfile,[('gh' if var == 'z' else var,level,None) for var,level in combos])
+        for (var,level), verif in zip(combos,verif_data):
+            varnc = 'h_plev' if var == 'z' else '%s_plev' % var
+            fcst = nc[varnc][ntime,plevs.index(level),...]
+            valid = nc['pmaskv2'][ntime,...] >= level if 'pmaskv2' in nc.variables else None
+            rms = np.sqrt(rmsregionmeans((fcst-verif[::-1,:])**2,valid))
+            for nreg, region in enumerate(regions):
+                rmsrecords.append(('rms_%s_%s_f%03i_%s' % (var,level,args.fhr,region),rms[nreg],\
+                                   dict(diag='rms',var=var,level=level,fhour=args.fhr,region=region)))
+            print('rms',var,level,' '.join('%s %s' % (region,rms[nreg]) for nreg,region in enumerate(regions)))
+        nc.close()
+
+if not records and not rmsrecords:
+    print('no diagnostics computed for %s (files not found in %s)' % (analdate,datapath2))
+    sys.exit(1)
+rows = []
+if rmsrecords: rows.append((analdatem1,rmsrecords))
+if records: rows.append((analdate,records))
+store.extend(rows)
+print('%s diagnostics for %s appended to %s' % (len(records)+len(rmsrecords),analdate,store.filename))
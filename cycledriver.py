@@ -0,0 +1,346 @@
+from __future__ import print_function
+import sys, os, time, math, json, argparse, subprocess
+from cycletiming import record
+
+# run the stages of one analysis cycle (the part of main.sh after the cycle
+# environment is set up) as a dependency graph instead of a fixed sequence.
+# each stage runs one of the existing scripts, and declares the stages it
+# depends on, the files it needs (inputs, checked before it starts) and the
+# files it makes (outputs, checked after it finishes).  stages whose
+# dependencies are done run concurrently as long as the nodes they need
+# are free.  by default the control forecasts get the nodes control_proc
+# needs, the ensemble forecast the rest (see cyclestages), and the scripts
+# run with runmpi on one node (chgres.sh, calcanl.sh) overlap gsi observer
+# and enkf, which leave one node free for them.  cycledriver_nodes in
+# config.sh (or --nodes) sets the nodes of individual stages.  a stage
+# given less than NODES sees only its share (NODES, cores, mpitaskspernode).
+# a finished stage leaves a marker in <current_logdir>/cycledriver,
+# so rerunning the cycle (e.g. after a failure or a timed out job) resumes
+# after the last completed stages.  start/end events go to timing.jsonl
+# (see cycletiming.py).  all settings come from the environment exported by
+# config.sh and main.sh.
+
+class Stage(object):
+    """
+ stage = Stage(name, command, deps=(), inputs=(), outputs=(), logcheck=None,
+               nodes=0, env=None, critical=True, cwd=None)
+
+ command is run with sh -c, output goes to <current_logdir>/<name>.out.
+ the stage fails if the command exits with non-zero status, if logcheck
+ (a file the script writes 'yes' or 'no' to) does not contain 'yes' or if
+ an output file is missing or empty.  if a non-critical stage fails, the
+ stages that depend on it still run (as main.sh does for cyclediag.py).
+    """
+    def __init__(self, name, command, deps=(), inputs=(), outputs=(), logcheck=None,
+                 nodes=0, env=None, critical=True, cwd=None):
+        self.name = name; self.command = command
+        self.deps = list(deps); self.inputs = list(inputs); self.outputs = list(outputs)
+        self.logcheck = logcheck; self.nodes = nodes
+        self.env = env or {}; self.critical = critical; self.cwd = cwd
+
+def cyclestages(env):
+    """
+ stages = cyclestages(env)
+
+ return list of stages for the cycle described by env (os.environ as
+ set up by main.sh), in the order main.sh runs them.  stages that are
+ turned off by the configuration are left out.
+    """
+    scripts = env['enkfscripts']; logdir = env['current_logdir']
+    datapath2 = env['datapath2']; analdate = env['analdate']
+    nodes = int(env['NODES']); corespernode = int(env.get('corespernode','1'))
+    # nodes runmpi uses for a job with ncores cores.
+    nodesfor = lambda ncores: min(nodes,int(math.ceil(float(ncores)/corespernode)))
+    true = lambda name: env.get(name,'') == 'true'
+    # skip_to_fcst skips the analysis, after which main.sh resets fg_only to false.
+    fg_only = true('fg_only') and not true('skip_to_fcst')
+    fhrs = ['%02i' % fh for fh in range(int(env['FHMIN']),int(env['FHMAX'])+1,int(env['FHOUT']))]
+    sfg = lambda fhr, member: os.path.join(datapath2,'sfg_%s_fhr%s_%s' % (analdate,fhr,member))
+    log = lambda name: os.path.join(logdir,name)
+    stages = []
+
+    if not fg_only and not true('skip_to_fcst'):
+        stages.append(Stage('ensmean_fcst','sh %s/compute_ensmean_fcst.sh' % scripts,
+                            outputs=[sfg(fhr,'ensmean') for fhr in fhrs],nodes=nodes))
+        # control forecast orography/ps adjusted to ens grid, one stage per fhr.
+        adjustps = []
+        if true('controlfcst') and true('replay_controlfcst'):
+            for fhr in fhrs:
+                adjustps.append('adjustps_%s' % fhr)
+                stages.append(Stage(adjustps[-1],'sh %s/chgres.sh %s %s %s.chgres' %\
+                                    (scripts,sfg(fhr,'control2'),sfg(fhr,'ensmean'),sfg(fhr,'control2')),
+                                    deps=['ensmean_fcst'],inputs=[sfg(fhr,'control2')],outputs=[sfg(fhr,'control2')+'.chgres'],nodes=1))
+        if not true('controlfcst') or true('replay_controlfcst'):
+            # no separate control forecast, control is ens mean.
+            stages.append(Stage('link_control',' && '.join('ln -fs %s %s && ln -fs %s %s' %\
+                                (sfg(fhr,'ensmean'),sfg(fhr,'control'),sfg(fhr,'ensmean').replace('sfg_','bfg_'),
+                                 sfg(fhr,'control').replace('sfg_','bfg_')) for fhr in fhrs),deps=['ensmean_fcst']))
+        gsienv = dict(cold_start_bias='true' if os.path.exists(os.path.join(env['datapathm1'],'cold_start_bias')) else 'false')
+        analysis = []
+        if true('controlanal'):
+            if true('hybgain') or true('replay_controlfcst') or not true('controlfcst'):
+                hybenv = dict(charnanal='control',charnanal2='ensmean',lobsdiag_forenkf='.true.',skipcat='false')
+            else:
+                hybenv = dict(charnanal='control',charnanal2='control',lobsdiag_forenkf='.false.',skipcat='false')
+            hybenv.update(gsienv)
+            stages.append(Stage('gsi_hybrid','sh %s/run_hybridanal.sh' % scripts,
+                                deps=['ensmean_fcst','link_control']+adjustps,logcheck=log('run_gsi_hybrid.log'),
+                                nodes=nodes,env=hybenv))
+            analysis.append('gsi_hybrid')
+            if env.get('DO_CALC_INCREMENT') == 'NO':
+                # control analysis at ens resolution, chgres and calcanl pipelined per fhr
+                # (runmpi with one threaded task, so one node each).
+                for fhr in fhrs:
+                    deps = ['gsi_hybrid']
+                    if not true('hybgain'):
+                        stages.append(Stage('chgres_%s' % fhr,'sh %s/chgres.sh %s %s %s.chgres' %\
+                                            (scripts,sfg(fhr,'control'),sfg(fhr,'ensmean'),sfg(fhr,'control')),
+                                            deps=deps,outputs=[sfg(fhr,'control')+'.chgres'],nodes=1))
+                        deps = ['chgres_%s' % fhr]
+                    stages.append(Stage('calcanl_%s' % fhr,'sh %s/calcanl.sh sfg_%s_fhr%s_control.chgres incr_%s_fhr%s_control sanl_%s_fhr%s_control.chgres' %\
+                                        (scripts,analdate,fhr,analdate,fhr,analdate,fhr),deps=deps,
+                                        outputs=[os.path.join(datapath2,'sanl_%s_fhr%s_control.chgres' % (analdate,fhr))],nodes=1))
+                    analysis.append('calcanl_%s' % fhr)
+        # gsi observer and enkf leave a node for the chgres/calcanl pipeline.
+        pipelined = [name for name in analysis if name.startswith('calcanl_')]
+        obsnodes = nodes-1 if pipelined and nodes > 1 else nodes
+        observer = []
+        if true('controlanal') and not true('replay_controlfcst') and true('controlfcst'):
+            obsenv = dict(charnanal='ensmean',charnanal2='ensmean',lobsdiag_forenkf='.true.',skipcat='false')
+            obsenv.update(gsienv)
+            # after gsi_hybrid, as in main.sh (both run gsi in the same directories).
+            stages.append(Stage('gsi_observer','sh %s/run_gsiobserver.sh' % scripts,deps=['ensmean_fcst','gsi_hybrid'],
+                                logcheck=log('run_gsi_observer.log'),nodes=obsnodes,env=obsenv))
+            observer.append('gsi_observer')
+        # main.sh sets skipcat=false before running gsi for the control analysis.
+        if not true('controlanal') and env.get('skipcat') == 'true':
+            npefiles = '%s' % (int(env['cores'])//int(env['gsi_control_threads']))
+        else:
+            npefiles = '0'
+        stages.append(Stage('enkf','sh %s/runenkf.sh' % scripts,deps=['ensmean_fcst','gsi_hybrid']+observer,
+                            logcheck=log('run_enkf.log'),nodes=obsnodes,env=dict(npefiles=npefiles)))
+        analysis.append('enkf')
+        if env.get('write_ensmean') == '.false.':
+            stages.append(Stage('ensmean_anal','sh %s/compute_ensmean_enkf.sh' % scripts,deps=['enkf'],nodes=nodes))
+            analysis.append('ensmean_anal')
+        if true('controlanal') and true('recenter_anal'):
+            if true('hybgain'):
+                if int(env.get('alpha','0')) > 0:
+                    stages.append(Stage('blendinc','sh %s/blendinc.sh' % scripts,deps=list(analysis),
+                                        logcheck=log('blendinc.log'),nodes=nodes))
+                    analysis.append('blendinc')
+            else:
+                stages.append(Stage('recenter','sh %s/recenter_ens_anal.sh' % scripts,deps=list(analysis),
+                                    logcheck=log('recenter_ens.log'),nodes=nodes))
+                analysis.append('recenter')
+        if true('controlfcst') and true('replay_controlfcst') and env.get('replay_run_observer') == 'true':
+            obsenv = dict(charnanal='control2',charnanal2='control2',lobsdiag_forenkf='.false.',skipcat='false')
+            obsenv.update(gsienv)
+            stages.append(Stage('gsi_observer2','sh %s/run_gsiobserver.sh' % scripts,deps=adjustps+analysis,
+                                logcheck=log('run_gsi_observer.log'),nodes=nodes,env=obsenv))
+        if true('run_cyclediag'):
+            stages.append(Stage('cyclediag','%s %s/cyclediag.py %s %s --fhr %s %s' %\
+                                (env.get('python','python'),scripts,env['datapath'],analdate,env['ANALINC'],env.get('cyclediag_opts','')),
+                                deps=list(analysis),critical=False))
+    else:
+        analysis = []
+
+    # first guess forecasts (run in fg_only mode too).  the control forecasts
+    # use the nodes control_proc cores need.  the ensemble forecast runs
+    # alongside the control forecast on the remaining nodes if that is at
+    # least half of NODES and one member (fg_proc cores) fits, otherwise it
+    # uses all nodes after it.  the long forecast is not needed by the next
+    # cycle, so it comes after fg_ens (and starts when nodes are free).
+    ctlnodes = nodesfor(env['control_proc']) if 'control_proc' in env else nodes
+    ensnodes = nodes
+    if true('controlfcst') and 2*(nodes-ctlnodes) >= nodes and\
+       nodes-ctlnodes >= nodesfor(env.get('fg_proc',corespernode)):
+        ensnodes = nodes-ctlnodes
+    if true('controlfcst'):
+        stages.append(Stage('fg_control','sh %s/run_fg_control.sh' % scripts,deps=list(analysis),
+                            logcheck=log('run_fg_control.log'),nodes=ctlnodes))
+    stages.append(Stage('fg_ens','sh %s/run_fg_ens.sh' % scripts,deps=list(analysis),
+                        logcheck=log('run_fg_ens.log'),nodes=ensnodes))
+    if true('controlfcst') and not fg_only and env.get('hr') == '00' and true('run_long_fcst'):
+        stages.append(Stage('long_fcst','sh %s/run_long_fcst.sh' % scripts,deps=list(analysis),
+                            logcheck=log('run_long_fcst.log'),nodes=ctlnodes,critical=False))
+
+    if not fg_only:
+        after = [stage.name for stage in stages]
+        if true('do_cleanup'):
+            stages.append(Stage('clean','sh %s/clean.sh' % scripts,deps=after))
+            after = ['clean']
+        # hpss job, full ensemble saved only if checkdate.py returns 0.
+        stages.append(Stage('hpss','date_check=`${python} %s/checkdate.py %s`; '
+                            'if [ $date_check -eq 0 ]; then export save_hpss_full="true"; else export save_hpss_full="false"; fi; '
+                            'if [ "$save_hpss" == "true" ]; then cat ${machine}_preamble_hpss hpss.sh > job_hpss.sh; fi; '
+                            'sbatch --export=machine=${machine},analdate=${analdate},datapath2=${datapath2},hsidir=${hsidir},'
+                            'save_hpss_full=${save_hpss_full},save_hpss_subset=${save_hpss_subset} job_hpss.sh' %\
+                            (env['homedir'],analdate),deps=after,cwd=env['homedir']))
+
+    # drop dependencies on stages that are not run in this configuration.
+    names = set(stage.name for stage in stages)
+    for stage in stages:
+        stage.deps = [dep for dep in stage.deps if dep in names]
+    # per-stage nodes from config.sh.
+    setnodes(stages,env.get('cycledriver_nodes',''))
+    return stages
+
+def setnodes(stages, nodelist):
+    """set nodes of stages from 'stage=n,...' string"""
+    stagenodes = dict((item.split('=')[0].strip(),int(item.split('=')[1])) for item in nodelist.split(',') if item.strip())
+    for stage in stages:
+        if stage.name in stagenodes: stage.nodes = stagenodes[stage.name]
+
+def allocation(env, nodes):
+    """
+ stageenv = allocation(env, nodes)
+
+ environment for a stage running on nodes of the job's NODES: NODES and
+ cores (used by the gsi, enkf and ensemble forecast scripts to size their
+ mpi jobs), and mpitaskspernode and OMP_NUM_THREADS for the nanals tasks
+ of the ens mean and recentering programs, set as main.sh does.
+    """
+    corespernode = int(env['corespernode'])
+    mpitaskspernode = max(1,int(math.ceil(float(env['nanals'])/nodes)))
+    return dict(NODES='%s' % nodes,cores='%s' % (nodes*corespernode),mpitaskspernode='%s' % mpitaskspernode,
+                OMP_NUM_THREADS='%s' % max(1,corespernode//mpitaskspernode))
+
+def markerfile(markerdir, stage):
+    return os.path.join(markerdir,'%s.done' % stage.name)
+
+def missing(files):
+    return [f for f in files if not os.path.exists(f) or os.path.getsize(f) == 0]
+
+def completed(stage, markerdir):
+    # done in an earlier run (marker present and outputs still there).
+    return os.path.exists(markerfile(markerdir,stage)) and not missing(stage.outputs)
+
+def check(stage, status):
+    # reason the stage failed, or None.
+    if status != 0:
+        return 'exit status %s' % status
+    if stage.logcheck is not None:
+        done = open(stage.logcheck).read().strip() if os.path.exists(stage.logcheck) else ''
+        if done != 'yes':
+            return '%s is %r' % (stage.logcheck,done)
+    outputs = missing(stage.outputs)
+    if outputs:
+        return '%s outputs missing, e.g. %s' % (len(outputs),outputs[0])
+    return None
+
+def run(stages, env, logdir, maxnodes, maxjobs, force=False, dryrun=False, poll=5.):
+    """
+ ok = run(stages, env, logdir, maxnodes, maxjobs, force=False, dryrun=False)
+
+ run stages (list of Stage instances) respecting dependencies, using at
+ most maxnodes nodes and maxjobs concurrent stages.  returns True if all
+ critical stages succeeded.
+    """
+    analdate = env['analdate']
+    markerdir = os.path.join(logdir,'cycledriver')
+    if not os.path.isdir(markerdir): os.makedirs(markerdir)
+    timingfile = os.path.join(logdir,'timing.jsonl')
+    state = {}
+    for stage in stages:
+        if not force and completed(stage,markerdir):
+            state[stage.name] = 'done'
+            print('%s %s already completed, skipping' % (analdate,stage.name))
+        else:
+            state[stage.name] = 'waiting'
+    byname = dict((stage.name,stage) for stage in stages)
+    running = {}; failed = False
+    while True:
+        # start the stages that are ready and fit, largest first so that a
+        # stage that needs most of the nodes (gsi observer, enkf) is not held
+        # up by the one node stages meant to run beside it (chgres/calcanl),
+        # in main.sh order for stages of the same size.  repeated until no
+        # more stages start (a dryrun or missing inputs can make others ready).
+        started = True
+        while started and not failed:
+            started = False
+            ready = [stage for stage in stages if state[stage.name] == 'waiting' and\
+                     all(state[dep] in ['done','failed_ok'] for dep in stage.deps)]
+            for stage in sorted(ready,key=lambda stage: -min(stage.nodes,maxnodes)):
+                nodesused = sum(byname[name].nodes for name in running)
+                if len(running) >= maxjobs or nodesused + min(stage.nodes,maxnodes) > maxnodes: continue
+                inputs = [] if dryrun else missing(stage.inputs)
+                if inputs:
+                    print('%s %s inputs missing, e.g. %s %s' % (analdate,stage.name,inputs[0],time.ctime()))
+                    state[stage.name] = 'failed'; started = True
+                    failed = failed or stage.critical
+                    if not stage.critical: state[stage.name] = 'failed_ok'
+                    continue
+                print('%s run %s %s' % (analdate,stage.name,time.ctime()))
+                if dryrun:
+                    print('   %s' % stage.command)
+                    state[stage.name] = 'done'; started = True
+                    continue
+                stageenv = dict(env)
+                if 0 < stage.nodes < maxnodes and 'corespernode' in env and 'nanals' in env:
+                    stageenv.update(allocation(env,stage.nodes))
+                stageenv.update(stage.env)
+                out = open(os.path.join(logdir,'%s.out' % stage.name),'w')
+                record(timingfile,analdate,stage.name,'start')
+                running[stage.name] = (subprocess.Popen(['sh','-c',stage.command],stdout=out,stderr=subprocess.STDOUT,
+                                       env=stageenv,cwd=stage.cwd),out)
+                state[stage.name] = 'running'; started = True
+        if not running:
+            break
+        time.sleep(poll)
+        for name in list(running):
+            process, out = running[name]
+            status = process.poll()
+            if status is None: continue
+            out.close(); del running[name]
+            stage = byname[name]
+            reason = check(stage,status)
+            record(timingfile,analdate,name,'end',status if reason is None else 1)
+            if reason is None:
+                state[name] = 'done'
+                with open(markerfile(markerdir,stage),'w') as f:
+                    f.write(json.dumps(dict(time=time.time(),outputs=stage.outputs))+'\n')
+                print('%s %s completed successfully %s' % (analdate,name,time.ctime()))
+            elif stage.critical:
+                state[name] = 'failed'; failed = True
+                print('%s %s did not complete successfully (%s) %s' % (analdate,name,reason,time.ctime()))
+            else:
+                state[name] = 'failed_ok'
+                print('%s %s did not complete successfully (%s), continuing %s' % (analdate,name,reason,time.ctime()))
+        if not running and not failed and not [name for name in state if state[name] == 'waiting' and\
+           all(state[dep] in ['done','failed_ok'] for dep in byname[name].deps)]:
+            break
+    notrun = [stage.name for stage in stages if state[stage.name] == 'waiting']
+    if notrun:
+        print('%s stages not run: %s' % (analdate,' '.join(notrun)))
+    return not failed and not notrun
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run the stages of one analysis cycle as a dependency graph')
+    parser.add_argument('--maxjobs', type=int, default=8,
+        help='maximum number of stages running at once (default 8)')
+    parser.add_argument('--nodes', default=None,
+        help="nodes used by individual stages, e.g. 'fg_control=4,long_fcst=4' (overrides cycledriver_nodes in config.sh)")
+    parser.add_argument('--force', action='store_true',
+        help='ignore markers of stages completed in an earlier run')
+    parser.add_argument('--rerun', default=None,
+        help='comma separated stages to run again even if completed')
+    parser.add_argument('--dryrun', action='store_true',
+        help='print stages and commands in the order they would start, without running them')
+    parser.add_argument('--poll', type=float, default=5.,
+        help='seconds between checks for finished stages (default 5)')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    stages = cyclestages(env)
+    if args.nodes is not None:
+        setnodes(stages,args.nodes)
+    logdir = env['current_logdir']
+    if args.rerun is not None:
+        for name in args.rerun.split(','):
+            marker = os.path.join(logdir,'cycledriver','%s.done' % name)
+            if os.path.exists(marker): os.remove(marker)
+    for stage in stages:
+        print('stage %-14s nodes %3s deps %s' % (stage.name,stage.nodes,' '.join(stage.deps)))
+    ok = run(stages,env,logdir,int(env['NODES']),args.maxjobs,args.force,args.dryrun,args.poll)
+    sys.exit(0 if ok else 1)
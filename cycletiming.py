@@ -0,0 +1,412 @@
+from __future__ import print_function
+import numpy as np
+import re, json, time, calendar, argparse
+
+# stage timing of the cycling scripts.  main.sh and the scripts it runs
+# append one json object per line to <analdate>/logs/timing.jsonl for the
+# start and end of each stage (timing_event in timing.sh), e.g.
+#  {"analdate": "2020010100", "stage": "enkf", "event": "start", "time": 1577840000,
+#   "status": null, "member": null, "fhour": null}
+# member and fhour are set for per-member / per-forecast-hour events, stages
+# named <parent>/<name> run inside stage <parent> (e.g. ensmean_fcst/restart
+# in compute_ensmean_fcst.sh, run as stage ensmean_fcst).  for
+# cycles run before this was added, the same events are recovered from the
+# '$analdate run enkf `date`' lines main.sh writes to its output (parse_log).
+# the report shows the chain of stages that sets the wall clock time of a
+# cycle (the critical path, which matters once stages overlap, e.g. with
+# cycledriver.py), the slowest members and how stage times change over many
+# cycles.
+
+def record(filename, analdate, stage, event, status=None, member=None, fhour=None, t=None):
+    """append a start/end event for stage to json lines file filename"""
+    event = dict(analdate='%s' % analdate, stage=stage, event=event,
+                 time=time.time() if t is None else t,
+                 status=status, member=member, fhour=fhour)
+    with open(filename,'a') as f:
+        f.write(json.dumps(event,sort_keys=True)+'\n')
+
+# sub-stages recorded under their own name in older timing files.
+substagenames = {'ensmean_restart': 'ensmean_fcst/restart', 'ensmean_history': 'ensmean_fcst/history'}
+
+def read_events(filename):
+    """
+ events = read_events(filename)
+
+ return list of event dicts from json lines file (lines that cannot be
+ decoded, e.g. a partial line from a killed job, are skipped).
+    """
+    events = []
+    with open(filename) as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            event['analdate'] = '%s' % event['analdate']
+            event['stage'] = substagenames.get(event['stage'],event['stage'])
+            events.append(event)
+    return events
+
+# main.sh progress messages ('$analdate <message> `date`') as
+# (regex, stage, event, status).  the first matching regex is used.
+logmessages = [
+    (r'starting ens mean computation$', 'ensmean_fcst', 'start', None),
+    (r'done computing ensemble mean$', 'ensmean_fcst', 'end', 0),
+    (r'adjust orog/ps of control forecast on ens grid$', 'adjustps', 'start', None),
+    (r'done adjusting orog/ps of control forecast on ens grid$', 'adjustps', 'end', 0),
+    (r'chgres control forecast to ens resolution$', 'chgres', 'start', None),
+    (r'chgres control forecast to ens resolution completed$', 'chgres', 'end', 0),
+    (r'calculate analysis from background \+ anal incr$', 'calcanl', 'start', None),
+    (r'done calculating analysis from background \+ anal incr$', 'calcanl', 'end', 0),
+    (r'run gsi observer with (.* )?charnanal=control2( .*)?$', 'gsi_observer2', 'start', None),
+    (r'run gsi observer with .*$', 'gsi_observer', 'start', None),
+    (r'gsi observer completed successfully$', 'gsi_observer', 'end', 0),
+    (r'gsi observer did not complete successfully, exiting$', 'gsi_observer', 'end', 1),
+    (r'run enkf$', 'enkf', 'start', None),
+    (r'enkf analysis completed successfully$', 'enkf', 'end', 0),
+    (r'enkf analysis did not complete successfully, exiting$', 'enkf', 'end', 1),
+    (r'starting ens mean analysis computation$', 'ensmean_anal', 'start', None),
+    (r'done computing ensemble mean analyses$', 'ensmean_anal', 'end', 0),
+    (r'blend enkf and 3dvar increments$', 'blendinc', 'start', None),
+    (r'increment blending/recentering completed successfully$', 'blendinc', 'end', 0),
+    (r'increment blending/recentering did not complete successfully, exiting$', 'blendinc', 'end', 1),
+    (r'recenter enkf analysis ensemble around control analysis$', 'recenter', 'start', None),
+    (r'recentering enkf analysis completed successfully$', 'recenter', 'end', 0),
+    (r'recentering enkf analysis did not complete successfully, exiting$', 'recenter', 'end', 1),
+    (r'compute cycle diagnostics$', 'cyclediag', 'start', None),
+    (r'done computing cycle diagnostics$', 'cyclediag', 'end', 0),
+    (r'cycle diagnostics failed \(continuing\)$', 'cyclediag', 'end', 1),
+    (r'run high-res control first guess$', 'fg_control', 'start', None),
+    (r'high-res control first-guess completed successfully$', 'fg_control', 'end', 0),
+    (r'high-res control did not complete successfully, exiting$', 'fg_control', 'end', 1),
+    (r'run high-res control long forecast$', 'long_fcst', 'start', None),
+    (r'high-res control long forecast completed successfully$', 'long_fcst', 'end', 0),
+    (r'high-res control long forecast did not complete successfully$', 'long_fcst', 'end', 1),
+    (r'run enkf ens first guess$', 'fg_ens', 'start', None),
+    (r'enkf first-guess completed successfully$', 'fg_ens', 'end', 0),
+    (r'enkf first-guess did not complete successfully, exiting$', 'fg_ens', 'end', 1),
+    (r'run (3DVar|hybrid 4DEnVar)$', 'gsi_hybrid', 'start', None),
+    (r'(3DVar|hybrid 4DEnVar) analysis completed successfully$', 'gsi_hybrid', 'end', 0),
+    (r'(3DVar|hybrid 4DEnVar) analysis did not complete successfully, exiting$', 'gsi_hybrid', 'end', 1),
+]
+logmessages = [(re.compile(regex),stage,event,status) for regex,stage,event,status in logmessages]
+# '2020010100 <message> Wed Jan  1 01:02:03 UTC 2020'
+analdateline = re.compile(r'^\d{10} ')
+logline = re.compile(r'^(\d{10}) (.*) (\w{3} \w{3} +\d+ \d\d:\d\d:\d\d) (?:\S+ )?(\d{4})\s*$')
+
+def parse_log(filename):
+    """
+ events = parse_log(filename)
+
+ return list of event dicts recovered from main.sh output (see parse_lines).
+    """
+    with open(filename) as f:
+        return parse_lines(f)
+
+def parse_lines(lines):
+    """
+ events = parse_lines(lines)
+
+ return list of event dicts recovered from lines of main.sh output (times
+ are taken as UTC, lines that are not stage messages are ignored).  a line
+ that does not start with an analysis time continues the previous line
+ until the message is complete (a message with multi-line command output in
+ it, e.g. the gsi observer start message has one line per charnanal
+ variable):
+
+ >>> events = parse_lines(['2020010100 run gsi observer with charnanal=control\\n',
+ ...                       'charnanal2=ensmean Wed Jan  1 01:02:03 UTC 2020\\n',
+ ...                       '2020010100 gsi observer completed successfully Wed Jan  1 01:12:03 UTC 2020\\n'])
+ >>> [(event['stage'],event['event'],event['time']) for event in events]
+ [('gsi_observer', 'start', 1577840523), ('gsi_observer', 'end', 1577841123)]
+    """
+    # gsi observer end messages are the same for both observer runs, they
+    # end the last one started.
+    events = []; partial = None; observer = 'gsi_observer'
+    for line in lines:
+        if analdateline.match(line):
+            partial = line
+        elif partial is not None:
+            partial = partial.rstrip('\n') + ' ' + line
+        else:
+            continue
+        match = logline.match(partial)
+        if match is None: continue
+        partial = None
+        analdate, message, datestr, year = match.groups()
+        t = calendar.timegm(time.strptime('%s %s' % (' '.join(datestr.split()),year),'%a %b %d %H:%M:%S %Y'))
+        for regex, stage, event, status in logmessages:
+            if regex.match(message):
+                if stage.startswith('gsi_observer'):
+                    if event == 'start': observer = stage
+                    stage = observer
+                events.append(dict(analdate=analdate,stage=stage,event=event,time=t,
+                                   status=status,member=None,fhour=None))
+                break
+    return events
+
+def getintervals(events):
+    """
+ intervals = getintervals(events)
+
+ pair start and end events of each (analdate, stage, member, fhour), in
+ time order.  returns list of dicts with keys analdate, stage, member,
+ fhour, start, end, duration, status (end and duration are None if the
+ stage did not finish).
+    """
+    intervals = []; pending = {}
+    # (stable sort, events with the same time stay in the order they were written)
+    for event in sorted(events,key=lambda event: event['time']):
+        key = (event['analdate'],event['stage'],event.get('member'),event.get('fhour'))
+        if event['event'] == 'start':
+            interval = dict(analdate=key[0],stage=key[1],member=key[2],fhour=key[3],
+                            start=event['time'],end=None,duration=None,status=None)
+            pending.setdefault(key,[]).append(interval)
+            intervals.append(interval)
+        elif pending.get(key):
+            interval = pending[key].pop(0)
+            interval['end'] = event['time']
+            interval['duration'] = event['time'] - interval['start']
+            interval['status'] = event.get('status')
+    return sorted(intervals,key=lambda interval: (interval['analdate'],interval['start']))
+
+def write_csv(filename, intervals):
+    """write intervals to csv file"""
+    keys = ['analdate','stage','member','fhour','start','end','duration','status']
+    with open(filename,'w') as f:
+        f.write(','.join(keys)+'\n')
+        for interval in intervals:
+            f.write(','.join('' if interval[key] is None else '%s' % interval[key] for key in keys)+'\n')
+
+def groupby(intervals, key='analdate'):
+    groups = {}
+    for interval in intervals:
+        groups.setdefault(interval[key],[]).append(interval)
+    return groups
+
+def parent(stage):
+    # stage a sub-stage ('<parent>/<name>', e.g. ensmean_fcst/restart) runs
+    # inside of, None for other stages.
+    return stage.split('/')[0] if '/' in stage else None
+
+def toplevel(interval):
+    return interval['member'] is None and interval['fhour'] is None and interval['stage'] != 'cycle' and\
+           parent(interval['stage']) is None
+
+def cycletimes(intervals):
+    """
+ cycles = cycletimes(intervals)
+
+ return dict analdate -> (start, wall clock seconds) for each cycle (from
+ the 'cycle' stage if recorded, otherwise from the first start to the last
+ end of the top level stages).
+    """
+    cycles = {}
+    for analdate, cycleintervals in groupby(intervals).items():
+        cycle = [interval for interval in cycleintervals if interval['stage'] == 'cycle' and interval['duration'] is not None]
+        if cycle:
+            cycles[analdate] = (cycle[0]['start'],cycle[0]['duration'])
+            continue
+        stages = [interval for interval in cycleintervals if toplevel(interval) and interval['end'] is not None]
+        if stages:
+            start = min(interval['start'] for interval in stages)
+            cycles[analdate] = (start,max(interval['end'] for interval in stages)-start)
+    return cycles
+
+def wallshares(intervals, start, end):
+    """
+ shares, busy = wallshares(intervals, start, end)
+
+ split the wall clock time from start to end between the (finished)
+ intervals: every stretch of time is shared equally by the stages running
+ during it.  returns dict stage -> seconds, and the seconds during which
+ at least one stage was running (the union of the intervals).
+    """
+    intervals = [(max(start,interval['start']),min(end,interval['end']),interval['stage'])\
+                 for interval in intervals if interval['end'] is not None]
+    times = sorted(set([start,end]+[t for t1,t2,stage in intervals for t in (t1,t2) if start < t < end]))
+    shares = {}; busy = 0.
+    for t1, t2 in zip(times[:-1],times[1:]):
+        running = [stage for tstart,tend,stage in intervals if tstart <= t1 and tend >= t2]
+        if not running: continue
+        busy += t2-t1
+        for stage in running:
+            shares[stage] = shares.get(stage,0.) + (t2-t1)/len(running)
+    return shares, busy
+
+def criticalpath(intervals):
+    """
+ path = criticalpath(intervals)
+
+ return the chain of (finished) intervals that sets the length of a cycle,
+ in time order: starting from the interval that ends last, step back each
+ time to the interval that ends last at or before the current one starts.
+    """
+    intervals = [interval for interval in intervals if interval['end'] is not None]
+    if not intervals: return []
+    current = max(intervals,key=lambda interval: interval['end'])
+    path = [current]
+    while True:
+        before = [interval for interval in intervals if interval['end'] <= current['start'] and interval is not current]
+        if not before: break
+        current = max(before,key=lambda interval: interval['end'])
+        path.append(current)
+    return path[::-1]
+
+def report_wall_time(intervals, cycles):
+    # time per top level stage, ordered by when it runs in the cycle, and its
+    # mean share of the cycle wall clock time on the critical path (%path,
+    # zero in cycles where the stage is not on the path).  %wall is the share
+    # of the wall clock time when every stretch of time is split equally
+    # between the stages running during it.  sub-stages are listed (with
+    # times only) under the stage they run in.
+    substages = {}
+    for interval in intervals:
+        if interval['member'] is None and interval['fhour'] is None and parent(interval['stage']) is not None:
+            substages.setdefault(interval['stage'],[]).append(interval)
+    stages = {}; pathshares = {}; shares = {}; busy = 0.; running = 0.; gaps = 0.
+    for analdate, cycleintervals in groupby(intervals).items():
+        if analdate not in cycles: continue
+        cycleintervals = [interval for interval in cycleintervals if toplevel(interval)]
+        for interval in cycleintervals:
+            stages.setdefault(interval['stage'],[]).append(interval)
+        start, wall = cycles[analdate]
+        if wall > 0:
+            path = criticalpath(cycleintervals)
+            for interval in path:
+                pathshares[interval['stage']] = pathshares.get(interval['stage'],0.) + interval['duration']/wall
+            gaps += 1. - sum(interval['duration'] for interval in path)/wall
+        cycleshares, cyclebusy = wallshares(cycleintervals,start,start+wall)
+        for stage in cycleshares:
+            shares[stage] = shares.get(stage,0.) + cycleshares[stage]
+        busy += cyclebusy
+        running += sum(interval['duration'] for interval in cycleintervals if interval['duration'] is not None)
+    totalwall = np.sum([wall for start,wall in cycles.values()])
+    ncycles = len(cycles)
+    print('wall clock time (%s cycles, mean wall clock %.1f min, mean stages running %.2f)' %\
+          (ncycles,totalwall/ncycles/60. if cycles else 0.,running/busy if busy > 0 else 0.))
+    print('%-14s %7s %9s %9s %9s %7s %7s %6s' % ('stage','count','mean(s)','median(s)','max(s)','%path','%wall','failed'))
+    order = sorted(stages,key=lambda stage: np.mean([interval['start']-cycles[interval['analdate']][0] for interval in stages[stage]]))
+    for stage in order:
+        durations = [interval['duration'] for interval in stages[stage] if interval['duration'] is not None]
+        failed = len([interval for interval in stages[stage] if interval['status'] not in [None,0]])
+        if not durations: continue
+        print('%-14s %7s %9.1f %9.1f %9.1f %7.1f %7.1f %6s' %\
+              (stage,len(durations),np.mean(durations),np.median(durations),np.max(durations),
+               100.*pathshares.get(stage,0.)/ncycles,100.*shares.get(stage,0.)/totalwall,failed))
+        for substage in sorted(name for name in substages if parent(name) == stage):
+            durations = [interval['duration'] for interval in substages[substage] if interval['duration'] is not None]
+            failed = len([interval for interval in substages[substage] if interval['status'] not in [None,0]])
+            if not durations: continue
+            print('%-14s %7s %9.1f %9.1f %9.1f %7s %7s %6s' %\
+                  ('  '+substage[len(stage):],len(durations),np.mean(durations),np.median(durations),np.max(durations),
+                   '','',failed))
+    # time on the critical path between stages (not in any stage on the path),
+    # and time when no stage was running.
+    print('%-14s %7s %9s %9s %9s %7.1f %7.1f' % ('(untracked)','','','','',100.*gaps/ncycles if ncycles else 0.,
+          100.*(totalwall-busy)/totalwall if totalwall > 0 else 0.))
+
+def report_members(intervals, top):
+    # members (per-member stages, e.g. fg_member) that are slowest on average,
+    # and how often each was the last to finish in a cycle.
+    members = [interval for interval in intervals if interval['member'] is not None and interval['duration'] is not None]
+    for stage in sorted(set(interval['stage'] for interval in members)):
+        durations = {}; last = {}
+        stageintervals = [interval for interval in members if interval['stage'] == stage]
+        for interval in stageintervals:
+            durations.setdefault(interval['member'],[]).append(interval['duration'])
+        for cycle in groupby(stageintervals).values():
+            slowest = max(cycle,key=lambda interval: interval['end'])['member']
+            last[slowest] = last.get(slowest,0) + 1
+        print('slowest members for %s (%s members)' % (stage,len(durations)))
+        print('%-10s %7s %9s %9s %6s' % ('member','ncycles','mean(s)','max(s)','last'))
+        alldurations = [duration for member in durations for duration in durations[member]]
+        for member in sorted(durations,key=lambda member: -np.mean(durations[member]))[:top]:
+            print('%-10s %7s %9.1f %9.1f %6s' % (member,len(durations[member]),np.mean(durations[member]),\
+                  np.max(durations[member]),last.get(member,0)))
+        print('%-10s %7s %9.1f %9.1f' % ('(all)',len(alldurations),np.mean(alldurations),np.max(alldurations)))
+
+def report_trends(intervals, cycles, window, top):
+    # median wall clock and top level stage times in windows of cycles, and
+    # the linear trend over all cycles (seconds per 100 cycles).
+    analdates = sorted(cycles)
+    stagetimes = {}
+    for interval in intervals:
+        if toplevel(interval) and interval['duration'] is not None and interval['analdate'] in cycles:
+            stagetimes.setdefault(interval['stage'],{})
+            stagetimes[interval['stage']][interval['analdate']] = \
+                stagetimes[interval['stage']].get(interval['analdate'],0.) + interval['duration']
+    stages = sorted(stagetimes,key=lambda stage: -np.mean(list(stagetimes[stage].values())))[:top]
+    columns = [('wall',dict((analdate,cycles[analdate][1]) for analdate in analdates))] +\
+              [(stage,stagetimes[stage]) for stage in stages]
+    print('trends (median seconds per %s cycles)' % window)
+    print('%-10s %5s ' % ('from','n') + ' '.join('%12s' % name[:12] for name,times in columns))
+    for n1 in range(0,len(analdates),window):
+        dates = analdates[n1:n1+window]
+        values = []
+        for name, times in columns:
+            windowtimes = [times[analdate] for analdate in dates if analdate in times]
+            values.append('%12.1f' % np.median(windowtimes) if windowtimes else '%12s' % '-')
+        print('%-10s %5s ' % (dates[0],len(dates)) + ' '.join(values))
+    slopes = []
+    for name, times in columns:
+        x = [analdates.index(analdate) for analdate in sorted(times)]
+        slopes.append('%12.1f' % (100.*np.polyfit(x,[times[analdate] for analdate in sorted(times)],1)[0])\
+                      if len(x) > 1 else '%12s' % '-')
+    print('%-16s ' % 'trend/100cycles' + ' '.join(slopes))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='record, collect and report cycle stage timing')
+    subparsers = parser.add_subparsers(dest='command')
+    parser_event = subparsers.add_parser('event', help='append a stage start/end event to a timing file')
+    parser_event.add_argument('filename', help='timing file (<analdate>/logs/timing.jsonl)')
+    parser_event.add_argument('analdate'); parser_event.add_argument('stage')
+    parser_event.add_argument('event', choices=['start','end'])
+    parser_event.add_argument('--status', type=int, default=None, help='exit status (end events)')
+    parser_event.add_argument('--member', default=None); parser_event.add_argument('--fhour', type=int, default=None)
+    parser_log = subparsers.add_parser('parselog', help='convert main.sh output to timing events')
+    parser_log.add_argument('logfiles', nargs='+', help='main.sh output files')
+    parser_log.add_argument('--out', default=None, help='timing file to write (default: print)')
+    parser_report = subparsers.add_parser('report', help='summarize timing files')
+    parser_report.add_argument('filenames', nargs='*', help='timing files (e.g. <datapath>/*/logs/timing.jsonl)')
+    parser_report.add_argument('--log', action='append', default=[], help='also read events from main.sh output (repeatable)')
+    parser_report.add_argument('--date1', default=None, help='first analysis time to include')
+    parser_report.add_argument('--date2', default=None, help='last analysis time to include')
+    parser_report.add_argument('--top', type=int, default=10, help='number of members/stages to show (default 10)')
+    parser_report.add_argument('--window', type=int, default=20, help='cycles per row in trends table (default 20)')
+    parser_report.add_argument('--csv', default=None, help='also write all stage intervals to this csv file')
+    args = parser.parse_args()
+
+    if args.command == 'event':
+        record(args.filename,args.analdate,args.stage,args.event,args.status,args.member,args.fhour)
+    elif args.command == 'parselog':
+        events = []
+        for logfile in args.logfiles:
+            events += parse_log(logfile)
+        lines = [json.dumps(event,sort_keys=True) for event in events]
+        if args.out is None:
+            print('\n'.join(lines))
+        else:
+            with open(args.out,'a') as f:
+                f.write(''.join(line+'\n' for line in lines))
+    elif args.command == 'report':
+        events = []
+        for filename in args.filenames:
+            events += read_events(filename)
+        for logfile in args.log:
+            events += parse_log(logfile)
+        events = [event for event in events if (args.date1 is None or event['analdate'] >= args.date1) and\
+                  (args.date2 is None or event['analdate'] <= args.date2)]
+        if not events:
+            raise SystemExit('no timing events found')
+        intervals = getintervals(events)
+        if args.csv is not None:
+            write_csv(args.csv,intervals)
+        cycles = cycletimes(intervals)
+        report_wall_time(intervals,cycles)
+        print()
+        report_members(intervals,args.top)
+        print()
+        report_trends(intervals,cycles,args.window,args.top)
+    else:
+        parser.print_help()
@@ -1,5 +1,6 @@
 from __future__ import print_function
 import datetime, calendar
+import numpy as np
 """
 utilities for working with dates using datetime module (Python 2.3 or later)
 
@@ -20,7 +21,7 @@ def dateto_hrs_since_day1CE(curdate,mixedcal=True):
     if mixedcal:
         if curdate < gregstart:
             msg = 'date must be after start of gregorian calendar (15821015)!'
-            raise ValueErrorr(msg)
+            raise ValueError(msg)
         difftime = curdate-gregstart
         hrsdiff = 24*difftime.days + difftime.seconds/3600
         return hrsdiff+hrsgregstart
@@ -41,18 +42,22 @@ def hrs_since_day1CE_todate(hrs,mixedcal=True):
         curdate = hrs*delta
     return curdate
 
+_dateshifts = {} # cache of dateshift results
 def dateshift(analdate,fcsthr):
     """
  verifdate = incdate(analdate, fcsthr)
 
  compute verification date given analysis date string (yyyymmddhh) and
- fcst hour.
+ fcst hour.  results are cached, so repeated calls (e.g. once per
+ forecast hour in a loop over dates) do not re-parse the date.
     """
-    yyyy,mm,dd,hh = splitdate(analdate)
-    analdate = datetime.datetime(yyyy,mm,dd,hh)
-    verifdate = analdate + fcsthr*datetime.timedelta(hours=1)
-    verifdate = makedate(verifdate.year,verifdate.month,verifdate.day,verifdate.hour)
-    return verifdate
+    key = (analdate,fcsthr)
+    if key not in _dateshifts:
+        if len(_dateshifts) > 100000: _dateshifts.clear()
+        yyyy,mm,dd,hh = splitdate(analdate)
+        verifdate = datetime.datetime(yyyy,mm,dd,hh) + fcsthr*datetime.timedelta(hours=1)
+        _dateshifts[key] = makedate(verifdate.year,verifdate.month,verifdate.day,verifdate.hour)
+    return _dateshifts[key]
 
 
 def splitdate(yyyymmddhh):
@@ -99,19 +104,80 @@ def daterange(date1,date2,hrinc):
 
  return of list of date strings of the form yyyymmddhh given
  a starting date, ending date and an increment in hours.
+ if date2 is not reached exactly, the last date is the first one after date2.
     """
-    date = date1
-    delta = datetime.timedelta(hours=1)
-    yyyy,mm,dd,hh = splitdate(date)
-    d = datetime.datetime(yyyy,mm,dd,hh)
-    n = 0
-    dates = [date]
-    while date < date2:
-       d = d + hrinc*delta
-       date = makedate(d.year,d.month,d.day,d.hour)
-       dates.append(date)
-       n = n + 1
-    return dates
+    return dt64todates(daterange64(date1,date2,hrinc))
+
+# array versions, using numpy datetime64 (hour resolution, proleptic
+# Gregorian calendar) instead of one datetime instance per date.
+
+def datestodt64(dates):
+    """
+ dt64 = datestodt64(dates)
+
+ return datetime64[h] array given a date string (yyyymmddhh) or a
+ list/array of date strings.
+    """
+    ints = np.asarray(dates).astype(np.int64)
+    yyyy = ints//1000000; mm = (ints//10000)%100
+    dd = (ints//100)%100; hh = ints%100
+    return (yyyy-1970).astype('M8[Y]') + (mm-1).astype('m8[M]') +\
+           (dd-1).astype('m8[D]') + hh.astype('m8[h]')
+
+def dt64todates(dt64):
+    """
+ dates = dt64todates(dt64)
+
+ return list of date strings (yyyymmddhh) given datetime64 array.
+    """
+    dt64 = np.atleast_1d(np.asarray(dt64,'M8[h]'))
+    years = dt64.astype('M8[Y]'); months = dt64.astype('M8[M]'); days = dt64.astype('M8[D]')
+    ints = 1000000*(years.astype(np.int64)+1970) +\
+           10000*((months-years).astype(np.int64)+1) +\
+           100*((days-months).astype(np.int64)+1) + (dt64-days).astype(np.int64)
+    return [str(date) for date in np.char.zfill(ints.astype(str),10)]
+
+def daterange64(date1,date2,hrinc):
+    """
+ dt64 = daterange64(date1,date2,hrinc)
+
+ same as daterange, but returns a datetime64[h] array.
+    """
+    d1 = datestodt64(date1); d2 = datestodt64(date2)
+    nhrs = (d2-d1).astype(np.int64)
+    ndates = 1 if nhrs <= 0 else -(-nhrs//hrinc)+1
+    return d1 + (hrinc*np.arange(ndates)).astype('m8[h]')
+
+# hours since 1-Jan-0001 of 1970010100 (datetime64 epoch), mixedcal=True/False.
+hrs1970 = {True: datetohrs('1970010100',mixedcal=True),
+           False: datetohrs('1970010100',mixedcal=False)}
+
+def datestohrs(dates,mixedcal=True):
+    """
+ hrs = datestohrs(dates)
+
+ return array of hrs since day 1 CE given a list/array of date strings
+ (yyyymmddhh) or a datetime64 array (same as datetohrs for each date).
+    """
+    dt64 = np.asarray(dates)
+    if dt64.dtype.kind != 'M': dt64 = datestodt64(dt64)
+    hrs = dt64.astype('M8[h]').astype(np.int64)
+    if mixedcal and np.any(hrs < (np.datetime64('1582-10-15T00','h')).astype(np.int64)):
+        raise ValueError('date must be after start of gregorian calendar (15821015)!')
+    return hrs + hrs1970[mixedcal]
+
+def hrstodates(hrs,mixedcal=True):
+    """
+ dates = hrstodates(hrs)
+
+ return list of date strings (yyyymmddhh) given array of hrs since
+ day 1 CE (same as hrstodate for each value).
+    """
+    hrs = np.asarray(hrs)
+    if np.any(hrs < 0):
+        raise ValueError('hrs must be positive!')
+    hrsepoch = np.rint(hrs - hrs1970[mixedcal]).astype(np.int64)
+    return dt64todates(hrsepoch.astype('M8[h]'))
 
 def dayofyear(yyyy,mm,dd):
     """
@@ -0,0 +1,148 @@
+from __future__ import print_function
+import numpy as np
+import os
+from netCDF4 import Dataset
+
+# per-experiment time series of diagnostics in a single (columnar) netcdf
+# file.  the file has an unlimited 'analdate' dimension (analdate variable
+# holds yyyymmddhh as an integer), and one variable (column) per series with
+# dimensions (analdate,<series>_d1,...).  each series carries attributes
+# describing it (diag, var, level, fhour, region) that can be queried with
+# find().  rows for an analdate that is already in the file are overwritten,
+# so rerunning a cycle does not duplicate it.  while rows are appended in
+# date order (the usual case) range queries read only the requested rows.
+
+class DiagStore(object):
+    """
+ store = DiagStore(filename)
+
+ store.append(analdate, [(name, values, attrs), ...])
+ store.extend([(analdate, [(name, values, attrs), ...]), ...])
+
+ dates, values = store.get(name, date1=None, date2=None)
+ dates, data = store.get_many(names, date1=None, date2=None)
+
+ names = store.find(diag=None, var=None, level=None, fhour=None, region=None)
+
+ store.names(), store.attrs(name), store.dates()
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._index = None
+    def append(self, analdate, records):
+        """write (name, values, attrs) records for analdate (yyyymmddhh)"""
+        self.extend([(analdate, records)])
+    def extend(self, rows):
+        """write records for several analdates, opening the file once"""
+        if not rows: return
+        if os.path.exists(self.filename):
+            nc = Dataset(self.filename,'a')
+        else:
+            nc = Dataset(self.filename,'w')
+            nc.createDimension('analdate',None)
+            nc.createVariable('analdate',np.int64,('analdate',))
+        analdates = nc['analdate'][:].tolist()
+        for analdate, records in rows:
+            if int(analdate) in analdates:
+                nrow = analdates.index(int(analdate))
+            else:
+                nrow = len(analdates)
+                nc['analdate'][nrow] = int(analdate)
+                analdates.append(int(analdate))
+            for name, values, attrs in records:
+                values = np.asarray(values)
+                if name not in nc.variables:
+                    dims = []
+                    for n, size in enumerate(values.shape):
+                        dims.append('%s_d%s' % (name,n+1))
+                        nc.createDimension(dims[-1],size)
+                    var = nc.createVariable(name,np.float64,['analdate']+dims,zlib=True)
+                    for key in attrs:
+                        var.setncattr(key,attrs[key])
+                nc[name][nrow] = values
+        nc.close()
+        self._index = None
+    def _getindex(self):
+        # series attributes (read once, metadata only).
+        if self._index is None:
+            self._index = {}
+            if os.path.exists(self.filename):
+                nc = Dataset(self.filename)
+                for name in nc.variables:
+                    if name == 'analdate': continue
+                    var = nc[name]
+                    self._index[name] = dict((key,var.getncattr(key)) for key in var.ncattrs() if key != '_FillValue')
+                nc.close()
+        return self._index
+    def names(self):
+        """return sorted list of series in the store"""
+        return sorted(self._getindex().keys())
+    def attrs(self, name):
+        """return dict of attributes of series name"""
+        return self._getindex()[name]
+    def find(self, **attrs):
+        """return sorted list of series whose attributes match all given (not None) values"""
+        attrs = dict((key,'%s' % value) for key,value in attrs.items() if value is not None)
+        index = self._getindex()
+        return sorted(name for name in index if\
+               all(key in index[name] and '%s' % index[name][key] == attrs[key] for key in attrs))
+    def dates(self):
+        """return sorted analdates (strings) in the store"""
+        nc = Dataset(self.filename)
+        analdates = np.sort(nc['analdate'][:])
+        nc.close()
+        return ['%s' % date for date in analdates]
+    def get(self, name, date1=None, date2=None):
+        """return sorted analdates (strings) and values of series between date1 and date2"""
+        dates, data = self.get_many([name], date1, date2)
+        return dates, data[name]
+    def get_many(self, names, date1=None, date2=None):
+        """return sorted analdates (strings) and dict name -> values for several series"""
+        nc = Dataset(self.filename)
+        analdates = nc['analdate'][:]
+        if len(analdates) and np.all(np.diff(analdates) > 0):
+            # rows in date order, read only the rows in range.
+            n1 = 0 if date1 is None else np.searchsorted(analdates,int(date1),side='left')
+            n2 = len(analdates) if date2 is None else np.searchsorted(analdates,int(date2),side='right')
+            data = dict((name,nc[name][n1:n2]) for name in names)
+            dates = analdates[n1:n2]
+        else:
+            keep = np.ones(len(analdates),np.bool_)
+            if date1 is not None: keep &= analdates >= int(date1)
+            if date2 is not None: keep &= analdates <= int(date2)
+            rows = np.nonzero(keep)[0]
+            rows = rows[np.argsort(analdates[rows])]
+            data = dict((name,nc[name][:][rows]) for name in names)
+            dates = analdates[rows]
+        nc.close()
+        return ['%s' % date for date in dates], data
+
+def openstores(pattern, expts):
+    """
+ stores = openstores(pattern, expts)
+
+ return list of DiagStore instances, one for each experiment.  %s in
+ pattern is replaced by the experiment name (required if there is more
+ than one experiment).
+    """
+    if '%s' not in pattern:
+        if len(expts) > 1:
+            raise ValueError('store name must contain %s when writing more than one experiment')
+        return [DiagStore(pattern)]
+    return [DiagStore(pattern % expt) for expt in expts]
+
+def join(stores, name, date1=None, date2=None):
+    """
+ dates, values = join(stores, name, date1=None, date2=None)
+
+ return analdates present in all stores (e.g. one per experiment) and
+ array of values of series name with shape (nstores,ndates,...).
+    """
+    results = [store.get(name, date1, date2) for store in stores]
+    dates = sorted(set.intersection(*[set(dates) for dates, values in results]))
+    values = []
+    for storedates, storevalues in results:
+        row = dict((date,n) for n,date in enumerate(storedates))
+        rows = [row[date] for date in dates]
+        values.append(storevalues[rows])
+    return dates, np.ma.array(values)
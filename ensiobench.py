@@ -0,0 +1,174 @@
+from __future__ import print_function
+from netCDF4 import Dataset
+import numpy as np
+import time, os, shutil, argparse
+from ncutils import varencoding
+
+# benchmark file system throughput for the ways the cycle reads and writes
+# ensemble member files, using synthetic fv3-shaped members:
+#  write       write one sfg member file (all variables) per task
+#  writetiles  write one restart tile (fv_core.res.tile?.nc) per task
+#  allmembers  read one variable from all members per task (ens mean/spread)
+#  onemember   read all variables of one member per task (recentering, blending)
+#  tiles       read one member restart tile per task (restart ens mean)
+#  rawread     read one sfg member file as bytes per task (htar, cp)
+# each pattern is timed for every compression level and number of
+# concurrent workers.  the hdf5 library is not thread safe, so netcdf
+# patterns always use processes, --pool thread only applies to rawread.
+# GB are uncompressed data (bytes on disk for rawread).
+# note that reads of files just written may be served from the page cache,
+# use --reuse to read files written by an earlier run (with --keep).
+
+parser = argparse.ArgumentParser(description='benchmark ensemble member file i/o patterns')
+parser.add_argument('workdir', help='directory for synthetic member files (on the file system to test)')
+parser.add_argument('--res', type=int, default=96,
+    help='cubed-sphere resolution, sfg files are on the 4*res x 2*res gaussian grid (default 96)')
+parser.add_argument('--nlevs', type=int, default=64, help='number of model levels (default 64)')
+parser.add_argument('--nanals', type=int, default=10, help='number of members (default 10)')
+parser.add_argument('--complevels', default='0,4',
+    help='comma separated zlib compression levels to test (default 0,4)')
+parser.add_argument('--workers', default='1,2,4,8',
+    help='comma separated numbers of concurrent workers (default 1,2,4,8)')
+parser.add_argument('--pool', default='process', choices=['process','thread','both'],
+    help='run concurrent rawread tasks in processes, threads or both (default process)')
+parser.add_argument('--patterns', default='write,writetiles,allmembers,onemember,tiles,rawread',
+    help='comma separated access patterns to time (default all)')
+parser.add_argument('--reuse', action='store_true',
+    help='use member files left in workdir by an earlier run (with --keep) instead of creating them')
+parser.add_argument('--keep', action='store_true', help='do not delete member files at the end')
+args = parser.parse_args()
+
+nlons = 4*args.res; nlats = 2*args.res; nlevs = args.nlevs
+sfgvars = ['ugrd','vgrd','tmp','spfh','o3mr','clwmr','dpres','delz']
+sfgvars2d = ['pressfc','hgtsfc']
+tilevars = ['u','v','W','DZ','T','delp']
+complevels = [int(complevel) for complevel in args.complevels.split(',')]
+workers = [int(nworkers) for nworkers in args.workers.split(',')]
+pools = ['process','thread'] if args.pool == 'both' else [args.pool]
+patterns = args.patterns.split(',')
+
+def sfgfile(complevel, nanal):
+    return os.path.join(args.workdir,'c%s' % complevel,'sfg_fhr06_mem%03i' % nanal)
+def tilefile(complevel, nanal, ntile):
+    return os.path.join(args.workdir,'c%s' % complevel,'mem%03i' % nanal,'INPUT','fv_core.res.tile%s.nc' % ntile)
+
+_fields = {}
+def field(shape):
+    # smooth field plus noise (compresses roughly like model output).
+    if shape not in _fields:
+        ny, nx = shape[-2:]
+        y = np.linspace(0,np.pi,ny)[:,np.newaxis]; x = np.linspace(0,2.*np.pi,nx)[np.newaxis,:]
+        data = np.empty(shape,np.float32)
+        data[...] = np.sin(y)*np.cos(3.*x) + 0.01*np.random.standard_normal((ny,nx))
+        _fields[shape] = data
+    return _fields[shape]
+
+def write_file(task):
+    # write one synthetic sfg member or restart tile, return bytes written.
+    kind, filename, complevel = task
+    if not os.path.isdir(os.path.dirname(filename)):
+        try:
+            os.makedirs(os.path.dirname(filename))
+        except OSError: # created by another worker
+            pass
+    nc = Dataset(filename,'w',format='NETCDF4_CLASSIC')
+    if kind == 'sfg':
+        dims = ('time','pfull','grid_yt','grid_xt')
+        sizes = (1,nlevs,nlats,nlons)
+        varnames = [(varname,dims) for varname in sfgvars] + [(varname,dims[:1]+dims[2:]) for varname in sfgvars2d]
+    else:
+        dims = ('Time','zaxis_1','yaxis_1','xaxis_1')
+        sizes = (1,nlevs,args.res,args.res)
+        varnames = [(varname,dims) for varname in tilevars]
+    for dimname, size in zip(dims,sizes):
+        nc.createDimension(dimname,None if size == 1 else size)
+    nbytes = 0
+    for varname, vardims in varnames:
+        shape = tuple(sizes[dims.index(dimname)] for dimname in vardims)
+        var = nc.createVariable(varname,np.float32,vardims,**varencoding(varname,shape,complevel))
+        var[:] = field(shape)
+        nbytes += field(shape).nbytes
+    nc.close()
+    return nbytes
+
+def read_vars(task):
+    # read variables from each of a list of files, return bytes read.
+    filenames, varnames = task
+    nbytes = 0
+    for filename in filenames:
+        nc = Dataset(filename)
+        for varname in varnames:
+            nbytes += nc[varname][:].nbytes
+        nc.close()
+    return nbytes
+
+def read_bytes(filename):
+    # read file in 4 MB blocks without decoding it, return bytes read.
+    nbytes = 0
+    with open(filename,'rb') as f:
+        while True:
+            block = f.read(4194304)
+            if not block: break
+            nbytes += len(block)
+    return nbytes
+
+def gettasks(pattern, complevel):
+    members = range(1,args.nanals+1)
+    if pattern == 'write':
+        return write_file, [('sfg',sfgfile(complevel,nanal),complevel) for nanal in members]
+    elif pattern == 'writetiles':
+        return write_file, [('tile',tilefile(complevel,nanal,ntile),complevel) for nanal in members for ntile in range(1,7)]
+    elif pattern == 'allmembers':
+        return read_vars, [([sfgfile(complevel,nanal) for nanal in members],[varname]) for varname in sfgvars+sfgvars2d]
+    elif pattern == 'onemember':
+        return read_vars, [([sfgfile(complevel,nanal)],sfgvars+sfgvars2d) for nanal in members]
+    elif pattern == 'tiles':
+        return read_vars, [([tilefile(complevel,nanal,ntile)],tilevars) for nanal in members for ntile in range(1,7)]
+    elif pattern == 'rawread':
+        return read_bytes, [sfgfile(complevel,nanal) for nanal in members]
+    raise ValueError('unknown pattern %s' % pattern)
+
+def run(func, tasks, pool, nworkers):
+    # run tasks, return total bytes and wall clock time (including pool startup).
+    t1 = time.time()
+    if nworkers == 1:
+        nbytes = sum(func(task) for task in tasks)
+    else:
+        if pool == 'thread':
+            from multiprocessing.pool import ThreadPool as Pool
+        else:
+            from multiprocessing import Pool
+        workerpool = Pool(nworkers)
+        nbytes = sum(workerpool.imap_unordered(func,tasks))
+        workerpool.close(); workerpool.join()
+    return nbytes, time.time()-t1
+
+print('res C%s (sfg %sx%s), %s levels, %s members' % (args.res,nlons,nlats,nlevs,args.nanals))
+print('%-11s %9s %7s %7s %8s %10s %10s %8s' %\
+      ('pattern','complevel','pool','workers','tasks','GB','time(s)','GB/s'))
+# write pattern that creates the files each read pattern needs.
+needs = {'allmembers':'write','onemember':'write','tiles':'writetiles','rawread':'write'}
+created = []
+for complevel in complevels:
+    if not args.reuse: created.append(os.path.join(args.workdir,'c%s' % complevel))
+    done = set()
+    for pattern in patterns:
+        if not args.reuse and pattern in needs and needs[pattern] not in done:
+            # create files to read (not timed).
+            func, tasks = gettasks(needs[pattern],complevel)
+            run(func,tasks,'process',max(workers))
+            done.add(needs[pattern])
+        done.add(pattern)
+        func, tasks = gettasks(pattern,complevel)
+        for pool in pools:
+            if pool == 'thread' and pattern != 'rawread': continue
+            for nworkers in workers:
+                nbytes, t = run(func,tasks,pool,nworkers)
+                print('%-11s %9s %7s %7s %8s %10.2f %10.2f %8.2f' %\
+                      (pattern,complevel,pool,nworkers,len(tasks),1.e-9*nbytes,t,1.e-9*nbytes/t))
+    if os.path.exists(sfgfile(complevel,1)):
+        print('complevel %s: %.1f MB per sfg member on disk' % (complevel,1.e-6*os.path.getsize(sfgfile(complevel,1))))
+
+if not args.keep:
+    for path in created:
+        shutil.rmtree(path)
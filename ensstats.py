@@ -0,0 +1,142 @@
+from __future__ import print_function
+from netCDF4 import Dataset
+import numpy as np
+import os, glob, argparse
+from runningstats import RunningStats
+from ncutils import varencoding
+
+# ensemble mean (and spread) of netcdf files (fv3 restart or history tiles)
+# that have the same name in every member directory.  each floating point
+# variable is read one chunk (of levels or times) at a time from all members,
+# and mean and spread are accumulated in one pass over the members, so memory
+# use does not depend on ensemble size.  chunks of all files and variables
+# are processed by a pool of workers, the main process writes the output.
+# other variables (coordinates, integers) are copied from the first member.
+
+parser = argparse.ArgumentParser(description='compute ensemble mean and spread of member netcdf files')
+parser.add_argument('pathout', help='directory for ensemble mean files')
+parser.add_argument('filenames', nargs='+', help='file names (same in every member directory)')
+parser.add_argument('--members', required=True,
+    help="glob pattern matching member directories, e.g. '<datapath2>/mem*/INPUT'")
+parser.add_argument('--sprdpath', default=None,
+    help='if given, also write ensemble spread (standard deviation, nanals-1 denominator) files to this directory')
+parser.add_argument('--workers', type=int, default=1,
+    help='number of processes reading member files (default 1)')
+parser.add_argument('--maxmem', type=float, default=2000.,
+    help='approximate MB of member data held in memory at once (default 2000)')
+parser.add_argument('--complevel', type=int, default=0,
+    help='zlib compression level for output variables, 0 for no compression (default 0)')
+args = parser.parse_args()
+
+memberdirs = sorted(glob.glob(args.members))
+if not memberdirs:
+    raise SystemExit('no member directories match %s' % args.members)
+nanals = len(memberdirs)
+outpaths = [args.pathout] if args.sprdpath is None else [args.pathout,args.sprdpath]
+
+def memberfiles(filename):
+    files = [os.path.join(memberdir,filename) for memberdir in memberdirs]
+    missing = [f for f in files if not os.path.exists(f)]
+    if missing:
+        raise SystemExit('%s member files missing, e.g. %s' % (len(missing),missing[0]))
+    return files
+
+def averaged(var):
+    # floating point variables that are not coordinate variables.
+    return var.dtype.kind == 'f' and var.ndim > 0 and var.name not in var.dimensions
+
+# read metadata of each file from the first member.
+filevars = {}
+for filename in args.filenames:
+    nc = Dataset(memberfiles(filename)[0])
+    filevars[filename] = [(varname,nc[varname].shape) for varname in nc.variables if averaged(nc[varname])]
+    nc.close()
+
+# split variables into chunks along their first (non-singleton) dimension,
+# sized so that the member data in flight (up to 2 chunks per worker, each
+# chunk held as float64 mean, m2 and one member) stays below maxmem.
+nworkers = max(1,args.workers)
+maxvalues = max(1,int(1.e6*args.maxmem/(2*nworkers*3*8)))
+tasks = []
+for filename in args.filenames:
+    for varname, shape in filevars[filename]:
+        axis = 0
+        while axis < len(shape)-1 and shape[axis] == 1: axis += 1
+        chunksize = max(1,maxvalues//max(1,int(np.prod(shape[axis+1:]))))
+        for n1 in range(0,shape[axis],chunksize):
+            index = (0,)*axis + (slice(n1,min(n1+chunksize,shape[axis])),)
+            tasks.append((filename,varname,index))
+
+ncfiles = None; ncfilename = None
+def read_stats(task):
+    # mean and spread of one chunk of a variable.  tasks come in file order,
+    # so each process keeps the member files of the last file it read open.
+    global ncfiles, ncfilename
+    filename, varname, index = task
+    if filename != ncfilename:
+        if ncfiles is not None:
+            for nc in ncfiles: nc.close()
+        ncfiles = [Dataset(f) for f in memberfiles(filename)]
+        for nc in ncfiles: nc.set_auto_mask(False)
+        ncfilename = filename
+    stats = RunningStats()
+    for nc in ncfiles:
+        stats.add(nc[varname][index])
+    sprd = None if args.sprdpath is None else stats.std(ddof=1)
+    return task, stats.mean, sprd
+
+# start worker processes before any output file is opened.
+if nworkers > 1 and len(tasks) > 1:
+    from multiprocessing import Pool
+    from collections import deque
+    pool = Pool(nworkers)
+    def run_tasks(tasks):
+        # keep at most 2 tasks per worker in flight (as in ncinterp.py).
+        pending = deque()
+        for task in tasks:
+            if len(pending) >= 2*nworkers:
+                yield pending.popleft().get()
+            pending.append(pool.apply_async(read_stats,(task,)))
+        while pending:
+            yield pending.popleft().get()
+    results = run_tasks(tasks)
+else:
+    results = (read_stats(task) for task in tasks)
+
+# create output files, copying dimensions, attributes and non-averaged variables.
+ncouts = {}
+for filename in args.filenames:
+    ncin = Dataset(memberfiles(filename)[0])
+    fileformat = ncin.data_model
+    if args.complevel > 0 and fileformat.startswith('NETCDF3'): fileformat = 'NETCDF4_CLASSIC'
+    for outpath in outpaths:
+        if not os.path.isdir(outpath): os.makedirs(outpath)
+        ncout = Dataset(os.path.join(outpath,filename),'w',format=fileformat)
+        ncout.setncatts(dict((key,ncin.getncattr(key)) for key in ncin.ncattrs()))
+        for dimname, dim in ncin.dimensions.items():
+            ncout.createDimension(dimname,None if dim.isunlimited() else len(dim))
+        for varname, varin in ncin.variables.items():
+            kwargs = {}
+            if args.complevel > 0 and varin.ndim >= 2:
+                kwargs = varencoding(varname,varin.shape,args.complevel)
+            fill_value = varin.getncattr('_FillValue') if '_FillValue' in varin.ncattrs() else None
+            varout = ncout.createVariable(varname,varin.dtype,varin.dimensions,fill_value=fill_value,**kwargs)
+            varout.setncatts(dict((key,varin.getncattr(key)) for key in varin.ncattrs() if key != '_FillValue'))
+            if not averaged(varin):
+                varout[...] = varin[...]
+        ncouts[(outpath,filename)] = ncout
+    ncin.close()
+    print('computing ens mean for %s (%s members)' % (filename,nanals))
+
+# write chunks as they are finished.
+for (filename,varname,index), mean, sprd in results:
+    ncouts[(args.pathout,filename)][varname][index] = mean
+    if sprd is not None:
+        ncouts[(args.sprdpath,filename)][varname][index] = sprd
+
+if nworkers > 1 and len(tasks) > 1:
+    pool.close(); pool.join()
+elif ncfiles is not None:
+    for nc in ncfiles: nc.close()
+for ncout in ncouts.values():
+    ncout.close()
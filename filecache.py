@@ -0,0 +1,47 @@
+from __future__ import print_function
+import os
+try:
+    import cPickle
+except ImportError:
+    import _pickle as cPickle
+
+# persistent cache of results computed from files.  each entry is stored
+# with the modification times of the files it was computed from, and is
+# only returned if none of those files has changed (or appeared/disappeared).
+
+def mtimes(files):
+    """return tuple of modification times for files (None if missing)"""
+    return tuple(os.path.getmtime(f) if os.path.exists(f) else None for f in files)
+
+class ResultCache(object):
+    """
+ cache = ResultCache(filename)
+
+ dict-like cache of results keyed by any hashable key, saved to filename
+ (a pickle) by cache.save().
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        if filename is not None and os.path.exists(filename):
+            try:
+                with open(filename,'rb') as f:
+                    self.entries = cPickle.load(f)
+            except Exception:
+                print('warning: could not read cache file %s, starting new cache' % filename)
+    def get(self, key, files):
+        """return cached value for key if files are unchanged, otherwise None"""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == mtimes(files):
+            return entry[1]
+        return None
+    def put(self, key, files, value):
+        """store value for key, computed from files"""
+        self.entries[key] = (mtimes(files), value)
+    def save(self):
+        """write cache to disk (via temporary file and rename)"""
+        if self.filename is None: return
+        tmpfile = '%s.%s.tmp' % (self.filename, os.getpid())
+        with open(tmpfile,'wb') as f:
+            cPickle.dump(self.entries,f,-1)
+        os.rename(tmpfile,self.filename)
@@ -0,0 +1,261 @@
+from __future__ import print_function
+import numpy as np
+import os
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+
+# sparse linear interpolation operators from the fv3 cubed-sphere grid
+# (cell centers, all 6 tiles raveled) to arbitrary lat/lon points.
+# each output point is a barycentric combination of the three nodes of the
+# spherical triangle that contains it (same weights as trmesh.interp_linear),
+# so interpolating a field is a single sparse matrix-vector product.
+
+def trmesh_triangles(tri):
+    """
+ triangles = trmesh_triangles(tri)
+
+ return (ntri,3) array of (zero based) node indices for the triangles
+ in stripack trmesh instance tri (decoded from the lst,lptr,lend
+ adjacency lists).
+    """
+    lst = np.abs(np.asarray(tri.lst)) - 1
+    lptr = np.asarray(tri.lptr) - 1
+    lend = np.asarray(tri.lend) - 1
+    npts = len(lend)
+    # walk the (circular) adjacency lists of all nodes together.  each pair
+    # of consecutive neighbors (n1,n2) of node n bounds triangle (n,n1,n2).
+    node = np.arange(npts)
+    p = lend.copy()
+    active = np.ones(npts, np.bool_)
+    tris = []
+    while active.any():
+        n = node[active]; pa = p[active]
+        pnext = lptr[pa]
+        tris.append(np.column_stack((n, lst[pa], lst[pnext])))
+        p[active] = pnext
+        active[active] = pnext != lend[n]
+    tris = np.concatenate(tris)
+    # each triangle was found three times, keep the one listed from its
+    # smallest node.
+    tris = tris[(tris[:,0] < tris[:,1]) & (tris[:,0] < tris[:,2])]
+    return tris.astype(np.int32)
+
+def _split_quads(a, b, c, d, xyz):
+    # split quadrilaterals (a,b,c,d - corners in order) into two triangles
+    # each, along the shorter diagonal.
+    diag_ac = ((xyz[a]-xyz[c])**2).sum(axis=-1) <= ((xyz[b]-xyz[d])**2).sum(axis=-1)
+    tri1 = np.where(diag_ac[:,np.newaxis], np.column_stack((a,b,c)), np.column_stack((a,b,d)))
+    tri2 = np.where(diag_ac[:,np.newaxis], np.column_stack((a,c,d)), np.column_stack((b,c,d)))
+    return np.concatenate((tri1,tri2))
+
+def cubed_sphere_triangles(xyz):
+    """
+ triangles = cubed_sphere_triangles(xyz)
+
+ triangulate cubed-sphere cell centers directly from the grid structure
+ (no general delaunay triangulation), given (6,res,res,3) cartesian node
+ coordinates.  returns (ntri,3) array of node indices into xyz.reshape(-1,3).
+ each grid cell quad (within tiles, and across the 12 tile edges) is split
+ into two triangles, plus one triangle at each of the 8 cube corners.
+    """
+    xyz = np.asarray(xyz, np.float64)
+    ntiles, res = xyz.shape[0], xyz.shape[1]
+    nodes = np.arange(ntiles*res*res).reshape(ntiles,res,res)
+    xyz = xyz.reshape(-1,3)
+    # quads within tiles.
+    a = nodes[:,:-1,:-1].ravel(); b = nodes[:,:-1,1:].ravel()
+    c = nodes[:,1:,1:].ravel(); d = nodes[:,1:,:-1].ravel()
+    tris = [_split_quads(a,b,c,d,xyz)]
+    # quads straddling tile edges. match each tile edge with the nearest
+    # edge on another tile, and its orientation.
+    edges = []
+    for ntile in range(ntiles):
+        edges += [nodes[ntile,0,:],nodes[ntile,-1,:],nodes[ntile,:,0],nodes[ntile,:,-1]]
+    edgetiles = np.repeat(np.arange(ntiles),4)
+    mids = np.array([xyz[edge].mean(axis=0) for edge in edges])
+    done = set()
+    for n, edge in enumerate(edges):
+        dist = ((mids-mids[n])**2).sum(axis=-1)
+        dist[edgetiles == edgetiles[n]] = np.inf
+        npartner = int(np.argmin(dist))
+        if (npartner,n) in done: continue
+        done.add((n,npartner))
+        partner = edges[npartner]
+        if ((xyz[edge[0]]-xyz[partner[0]])**2).sum() > ((xyz[edge[0]]-xyz[partner[-1]])**2).sum():
+            partner = partner[::-1]
+        tris.append(_split_quads(edge[:-1],edge[1:],partner[1:],partner[:-1],xyz))
+    # triangles at cube corners, where corner cells of three tiles meet.
+    corners = nodes[:,[0,0,-1,-1],[0,-1,0,-1]].ravel()
+    cornertiles = np.repeat(np.arange(ntiles),4)
+    cornertris = set()
+    for n, corner in enumerate(corners):
+        dist = ((xyz[corners]-xyz[corner])**2).sum(axis=-1)
+        dist[cornertiles == cornertiles[n]] = np.inf
+        cornertris.add(tuple(sorted([corner]+corners[np.argsort(dist)[:2]].tolist())))
+    tris.append(np.array(sorted(cornertris)))
+    return np.concatenate(tris).astype(np.int32)
+
+def lonlat_to_xyz(lons, lats):
+    """return (npts,3) cartesian coordinates on unit sphere given lons,lats (radians)"""
+    lons = np.asarray(lons, np.float64).ravel()
+    lats = np.asarray(lats, np.float64).ravel()
+    coslats = np.cos(lats)
+    return np.column_stack((coslats*np.cos(lons), coslats*np.sin(lons), np.sin(lats)))
+
+def barycentric_weights(xyz, triangles, olons, olats, nnear=12, chunksize=65536):
+    """
+ weights = barycentric_weights(xyz, triangles, olons, olats)
+
+ compute sparse (csr) interpolation matrix with shape (len(olons.ravel()), npts)
+ given (npts,3) node cartesian coordinates, (ntri,3) triangle node indices and
+ output lons,lats (radians, any shape - flattened in C order).
+    """
+    xyz = np.asarray(xyz, np.float64)
+    triangles = np.asarray(triangles)
+    pts = lonlat_to_xyz(olons, olats)
+    npts = len(xyz); nout = len(pts)
+    centroids = xyz[triangles].sum(axis=1)
+    centroids /= np.sqrt((centroids**2).sum(axis=1))[:,np.newaxis]
+    tree = cKDTree(centroids)
+    nnear = min(nnear, len(triangles))
+    indices = np.empty((nout,3), np.int32)
+    weights = np.empty((nout,3), np.float64)
+    for n1 in range(0, nout, chunksize):
+        n2 = min(n1+chunksize, nout)
+        p = pts[n1:n2]
+        dist, cand = tree.query(p, k=nnear)
+        # solve for the coefficients of p in the basis of the triangle
+        # vertices; p lies in the triangle iff they are all non-negative.
+        verts = xyz[triangles[cand]] # (n,nnear,3 vertices,3 coords)
+        coeffs = np.linalg.solve(np.swapaxes(verts,-1,-2),
+                 np.broadcast_to(p[:,np.newaxis,:],cand.shape+(3,))[...,np.newaxis])[...,0]
+        # first candidate containing the point (or, failing that, the closest
+        # to containing it).
+        ibest = np.argmax(coeffs.min(axis=-1) >= -1.e-12, axis=1)
+        notfound = coeffs[np.arange(n2-n1),ibest].min(axis=-1) < -1.e-12
+        ibest[notfound] = np.argmax(coeffs[notfound].min(axis=-1), axis=1)
+        coeffs = coeffs[np.arange(n2-n1),ibest]
+        indices[n1:n2] = triangles[cand[np.arange(n2-n1),ibest]]
+        weights[n1:n2] = coeffs/coeffs.sum(axis=-1)[:,np.newaxis]
+    indptr = 3*np.arange(nout+1)
+    return csr_matrix((weights.ravel(),indices.ravel(),indptr),shape=(nout,npts))
+
+def mesh_files(res, path='.'):
+    """return names of node coordinate and triangle list files for C<res> mesh cache"""
+    return os.path.join(path,'C%s_grid_xyz.npy' % res), os.path.join(path,'C%s_grid_triangles.npy' % res)
+
+def save_mesh(res, xyz, triangles, path='.'):
+    """
+ save_mesh(res, xyz, triangles)
+
+ save C<res> triangulation as plain arrays: (npts,3) float64 node cartesian
+ coordinates and (ntri,3) int32 triangle node indices (the adjacency is
+ implied by the triangle list).
+    """
+    for filename, data in zip(mesh_files(res,path),(np.asarray(xyz,np.float64),np.asarray(triangles,np.int32))):
+        tmpfile = '%s.%s.tmp.npy' % (filename, os.getpid())
+        np.save(tmpfile, data)
+        os.rename(tmpfile, filename)
+
+def load_mesh(res, path='.'):
+    """
+ xyz, triangles = load_mesh(res)
+
+ load C<res> triangulation saved by save_mesh.  arrays are memory-mapped
+ read-only, so loading is immediate and concurrent processes on a node
+ share the same pages.
+    """
+    xyzfile, trifile = mesh_files(res,path)
+    return np.load(xyzfile,mmap_mode='r'), np.load(trifile,mmap_mode='r')
+
+def parse_grid(spec):
+    """
+ gridname, lons, lats = parse_grid(spec)
+
+ return a name (used for cache files) and 1d arrays of output grid longitudes
+ and latitudes (degrees, latitudes south to north) given a grid spec string:
+
+ latlon:<dlon>[x<dlat>]   global regular grid including poles (latlon:1 is
+                          the 360x181 grid ncinterp.py has always used).
+ gaussian:<nlats>         global gaussian grid with 2*nlats longitudes.
+ regional:<lon1>,<lon2>,<lat1>,<lat2>,<dlon>[x<dlat>]
+                          regular grid over a lat/lon box (end points
+                          included, lon1 > lon2 wraps across 0 east).
+    """
+    try:
+        gridtype, params = spec.split(':')
+        if gridtype == 'latlon':
+            dlon, dlat = _spacing(params)
+            nlons = int(round(360./dlon)); nlats = int(round(180./dlat))+1
+            lons = (360./nlons)*np.arange(nlons)
+            lats = -90 + (180./(nlats-1))*np.arange(nlats)
+            gridname = 'latlon%sx%s' % (nlons,nlats)
+        elif gridtype == 'gaussian':
+            nlats = int(params); nlons = 2*nlats
+            lons = (360./nlons)*np.arange(nlons)
+            lats = np.degrees(np.arcsin(np.polynomial.legendre.leggauss(nlats)[0]))
+            gridname = 'gaussian%sx%s' % (nlons,nlats)
+        elif gridtype == 'regional':
+            lon1, lon2, lat1, lat2, spacing = params.split(',')
+            lon1, lon2, lat1, lat2 = float(lon1), float(lon2), float(lat1), float(lat2)
+            dlon, dlat = _spacing(spacing)
+            if lon2 < lon1: lon2 += 360.
+            nlons = int(round((lon2-lon1)/dlon))+1; nlats = int(round((lat2-lat1)/dlat))+1
+            lons = lon1 + dlon*np.arange(nlons)
+            lats = lat1 + dlat*np.arange(nlats)
+            gridname = 'regional%sx%s_%g_%g_%g_%g' % (nlons,nlats,lon1,lon2,lat1,lat2)
+        else:
+            raise ValueError
+    except ValueError:
+        raise ValueError('invalid grid spec %s' % spec)
+    return gridname, lons, lats
+
+def _spacing(spacing):
+    # parse '<dlon>' or '<dlon>x<dlat>' grid spacing.
+    spacing = [float(s) for s in spacing.split('x')]
+    return spacing[0], spacing[-1]
+
+def weights_file(res, gridname, path='.'):
+    """return name of cached interpolation weights file for C<res> to gridname"""
+    return os.path.join(path,'C%s_grid_%s.npz' % (res,gridname))
+
+def save_weights(filename, weights):
+    """save csr interpolation matrix to npz file (indptr, indices, data, shape)"""
+    # write to a temporary file and rename, so concurrent readers
+    # never see a partial file.
+    tmpfile = '%s.%s.tmp.npz' % (filename, os.getpid())
+    np.savez(tmpfile, indptr=weights.indptr, indices=weights.indices,
+             data=weights.data, shape=np.asarray(weights.shape))
+    os.rename(tmpfile, filename)
+
+def load_weights(filename):
+    """load csr interpolation matrix saved by save_weights"""
+    f = np.load(filename)
+    weights = csr_matrix((f['data'],f['indices'],f['indptr']),shape=tuple(f['shape']))
+    f.close()
+    return weights
+
+def interp_fields(weights, data, maxbytes=2**26):
+    """
+ latlon_data = interp_fields(weights, data)
+
+ interpolate a stack of fields in one vectorized operation, given csr
+ interpolation matrix from barycentric_weights and data with shape (...,npts).
+ returns array with shape (...,nout).  every output point uses exactly three
+ nodes, so the stencil is gathered with np.take for all fields at once
+ (in chunks of fields using at most maxbytes of temporary storage).
+    """
+    nout, npts = weights.shape
+    shape = data.shape[:-1]
+    data = np.ascontiguousarray(data).reshape(-1,npts)
+    nfields = data.shape[0]
+    dtype = np.result_type(data.dtype, np.float32)
+    indices = weights.indices.reshape(nout,3)
+    wts = weights.data.reshape(nout,3).astype(dtype)
+    out = np.empty((nfields,nout),dtype)
+    nchunk = max(1, maxbytes//(3*nout*out.itemsize))
+    for n1 in range(0, nfields, nchunk):
+        n2 = min(n1+nchunk, nfields)
+        stencil = np.take(data[n1:n2], indices, axis=1) # (nchunk,nout,3)
+        out[n1:n2] = np.einsum('fij,ij->fi', stencil, wts)
+    return out.reshape(shape+(nout,))
@@ -6,6 +6,9 @@
 # allow this script to submit other scripts with LSF
 unset LSB_SUB_RES_REQ 
 
+# stage start/end events for cycletiming.py
+source ${enkfscripts}/timing.sh
+
 echo "nodes = $NODES"
 
 idate_job=1
@@ -142,6 +145,7 @@ echo "analdate plus 1: $analdatep1"
 export current_logdir="${datapath2}/logs"
 echo "Current LogDir: ${current_logdir}"
 mkdir -p ${current_logdir}
+timing_event cycle start
 
 if [ $fg_only == 'false' ]; then
 /bin/rm -f $datapath2/hybens_info
@@ -158,6 +162,18 @@ export PREINP="${RUN}.t${hr}z."
 export PREINP1="${RUN}.t${hrp1}z."
 export PREINPm1="${RUN}.t${hrm1}z."
 
+if [ "$use_cycledriver" == 'true' ]; then
+
+# run the rest of the cycle as a dependency graph (see cycledriver.py).
+echo "$analdate run cycle stages with cycledriver.py `date`"
+$python ${enkfscripts}/cycledriver.py ${cycledriver_opts} > ${current_logdir}/cycledriver.out 2>&1
+if [ $? -ne 0 ]; then
+  echo "$analdate cycledriver.py did not complete successfully, exiting `date`"
+  exit 1
+fi
+
+else
+
 if [ $skip_to_fcst == "true" ]; then
    fg_only="true"
 fi
@@ -165,7 +181,9 @@ fi
 if [ $fg_only ==  'false' ]; then
 
 echo "$analdate starting ens mean computation `date`"
+timing_event ensmean_fcst start
 sh ${enkfscripts}/compute_ensmean_fcst.sh >  ${current_logdir}/compute_ensmean_fcst.out 2>&1
+timing_event ensmean_fcst end $?
 echo "$analdate done computing ensemble mean `date`"
 
 # change orography in high-res control forecast nemsio file so it matches enkf ensemble,
@@ -174,6 +192,7 @@ echo "$analdate done computing ensemble mean `date`"
 if [ $controlfcst == 'true' ] && [ $replay_controlfcst == 'true' ]; then
    charnanal='control2'
    echo "$analdate adjust orog/ps of control forecast on ens grid `date`"
+   timing_event adjustps start
    fh=$FHMIN
    while [ $fh -le $FHMAX ]; do
      fhr=`printf %02i $fh`
@@ -186,6 +205,7 @@ if [ $controlfcst == 'true' ] && [ $replay_controlfcst == 'true' ]; then
       echo "adjustps/chgres step failed, exiting...."
       exit 1
    fi
+   timing_event adjustps end 0
    echo "$analdate done adjusting orog/ps of control forecast on ens grid `date`"
 fi
 
@@ -238,7 +258,9 @@ if [ $controlanal == 'true' ]; then
    fi
    # run Var analysis
    echo "$analdate run $type `date`"
+   timing_event gsi_hybrid start
    sh ${enkfscripts}/run_hybridanal.sh > ${current_logdir}/run_gsi_hybrid.out 2>&1
+   timing_event gsi_hybrid end $?
    # once hybrid has completed, check log files.
    hybrid_done=`cat ${current_logdir}/run_gsi_hybrid.log`
    if [ $hybrid_done == 'yes' ]; then
@@ -250,6 +272,7 @@ if [ $controlanal == 'true' ]; then
    if [ $DO_CALC_INCREMENT = "NO" ]; then
     if [ $hybgain == "false" ]; then # change resolution of control fcst to ens resolution
     echo "$analdate chgres control forecast to ens resolution `date`"
+    timing_event chgres start
     fh=$FHMIN
     while [ $fh -le $FHMAX ]; do
       fhr=`printf %02i $fh`
@@ -262,11 +285,13 @@ if [ $controlanal == 'true' ]; then
        echo "chgres control forecast to ens resolution failed, exiting...."
        exit 1
     fi
+    timing_event chgres end 0
     echo "$analdate chgres control forecast to ens resolution completed `date`"
     fi
 #  add the increment to the control forecast at ens resolution to create analysis at ens resolution
 #  (needed for ens recentering step)
     echo "$analdate calculate analysis from background + anal incr `date`"
+    timing_event calcanl start
     fh=$FHMIN
     while [ $fh -le $FHMAX ]; do
       fhr=`printf %02i $fh`
@@ -279,6 +304,7 @@ if [ $controlanal == 'true' ]; then
        echo "calculate analysis step failed, exiting...."
        exit 1
     fi
+    timing_event calcanl end 0
     echo "$analdate done calculating analysis from background + anal incr `date`"
     fi
 fi 
@@ -291,7 +317,9 @@ if [ $controlanal == 'true' ] && [ $replay_controlfcst == 'false' ] && [ $contro
    export lobsdiag_forenkf='.true.'
    export skipcat="false"
    echo "$analdate run gsi observer with `printenv | grep charnanal` `date`"
+   timing_event gsi_observer start
    sh ${enkfscripts}/run_gsiobserver.sh > ${current_logdir}/run_gsi_observer.out 2>&1
+   timing_event gsi_observer end $?
    # once observer has completed, check log files.
    hybrid_done=`cat ${current_logdir}/run_gsi_observer.log`
    if [ $hybrid_done == 'yes' ]; then
@@ -329,7 +357,9 @@ if [ $skipcat == "true" ]; then
 else
   export npefiles=0
 fi
+timing_event enkf start
 sh ${enkfscripts}/runenkf.sh > ${current_logdir}/run_enkf.out 2>&1
+timing_event enkf end $?
 # once enkf has completed, check log files.
 enkf_done=`cat ${current_logdir}/run_enkf.log`
 if [ $enkf_done == 'yes' ]; then
@@ -342,7 +372,9 @@ fi
 # compute ensemble mean analyses.
 if [ $write_ensmean == ".false." ]; then
    echo "$analdate starting ens mean analysis computation `date`"
+   timing_event ensmean_anal start
    sh ${enkfscripts}/compute_ensmean_enkf.sh > ${current_logdir}/compute_ensmean_anal.out 2>&1
+   timing_event ensmean_anal end $?
    echo "$analdate done computing ensemble mean analyses `date`"
 fi
 
@@ -351,7 +383,9 @@ if [ $controlanal == 'true' ] && [ $recenter_anal == 'true' ]; then
    if [ $hybgain == 'true' ]; then
       if [ $alpha -gt 0 ]; then
          echo "$analdate blend enkf and 3dvar increments `date`"
+         timing_event blendinc start
          sh ${enkfscripts}/blendinc.sh > ${current_logdir}/blendinc.out 2>&1
+         timing_event blendinc end $?
          blendinc_done=`cat ${current_logdir}/blendinc.log`
          if [ $blendinc_done == 'yes' ]; then
            echo "$analdate increment blending/recentering completed successfully `date`"
@@ -362,7 +396,9 @@ if [ $controlanal == 'true' ] && [ $recenter_anal == 'true' ]; then
       fi
    else
       echo "$analdate recenter enkf analysis ensemble around control analysis `date`"
+      timing_event recenter start
       sh ${enkfscripts}/recenter_ens_anal.sh > ${current_logdir}/recenter_ens_anal.out 2>&1
+      timing_event recenter end $?
       recenter_done=`cat ${current_logdir}/recenter_ens.log`
       if [ $recenter_done == 'yes' ]; then
         echo "$analdate recentering enkf analysis completed successfully `date`"
@@ -381,7 +417,9 @@ if [ $controlfcst == 'true' ] && [ $replay_controlfcst == 'true' ] && [ $replay_
    export lobsdiag_forenkf='.false.'
    export skipcat="false"
    echo "$analdate run gsi observer with `printenv | grep charnanal` `date`"
+   timing_event gsi_observer2 start
    sh ${enkfscripts}/run_gsiobserver.sh > ${current_logdir}/run_gsi_observer2.out 2>&1
+   timing_event gsi_observer2 end $?
    # once observer has completed, check log files.
    hybrid_done=`cat ${current_logdir}/run_gsi_observer.log`
    if [ $hybrid_done == 'yes' ]; then
@@ -392,6 +430,21 @@ if [ $controlfcst == 'true' ] && [ $replay_controlfcst == 'true' ] && [ $replay_
    fi
 fi
 
+# append this cycle's diagnostics (mean ps, spread profiles, increment
+# spectra) to the experiment's time-series store while files are on disk.
+if [ "$run_cyclediag" == 'true' ]; then
+   echo "$analdate compute cycle diagnostics `date`"
+   timing_event cyclediag start
+   $python ${enkfscripts}/cyclediag.py ${datapath} ${analdate} --fhr ${ANALINC} ${cyclediag_opts} > ${current_logdir}/cyclediag.out 2>&1
+   cyclediag_status=$?
+   timing_event cyclediag end $cyclediag_status
+   if [ $cyclediag_status -ne 0 ]; then
+      echo "$analdate cycle diagnostics failed (continuing) `date`"
+   else
+      echo "$analdate done computing cycle diagnostics `date`"
+   fi
+fi
+
 fi # skip to here if fg_only = true
 if [ $skip_to_fcst == "true" ]; then
    export fg_only="false"
@@ -399,7 +452,9 @@ fi
 
 if [ $controlfcst == 'true' ]; then
     echo "$analdate run high-res control first guess `date`"
+    timing_event fg_control start
     sh ${enkfscripts}/run_fg_control.sh  > ${current_logdir}/run_fg_control.out  2>&1
+    timing_event fg_control end $?
     control_done=`cat ${current_logdir}/run_fg_control.log`
     if [ $control_done == 'yes' ]; then
       echo "$analdate high-res control first-guess completed successfully `date`"
@@ -410,7 +465,9 @@ if [ $controlfcst == 'true' ]; then
     # run longer forecast at 00UTC
     if [ $fg_only != "true" ] && [ $hr == '00' ] && [ $run_long_fcst == "true" ]; then
        echo "$analdate run high-res control long forecast `date`"
+       timing_event long_fcst start
        sh ${enkfscripts}/run_long_fcst.sh > ${current_logdir}/run_long_fcst.out  2>&1
+       timing_event long_fcst end $?
        control_done=`cat ${current_logdir}/run_long_fcst.log`
        if [ $control_done == 'yes' ]; then
          echo "$analdate high-res control long forecast completed successfully `date`"
@@ -420,7 +477,9 @@ if [ $controlfcst == 'true' ]; then
     fi
 fi
 echo "$analdate run enkf ens first guess `date`"
+timing_event fg_ens start
 sh ${enkfscripts}/run_fg_ens.sh > ${current_logdir}/run_fg_ens.out  2>&1
+timing_event fg_ens end $?
 ens_done=`cat ${current_logdir}/run_fg_ens.log`
 if [ $ens_done == 'yes' ]; then
   echo "$analdate enkf first-guess completed successfully `date`"
@@ -433,7 +492,9 @@ if [ $fg_only == 'false' ]; then
 
 # cleanup
 if [ $do_cleanup == 'true' ]; then
+   timing_event clean start
    sh ${enkfscripts}/clean.sh > ${current_logdir}/clean.out 2>&1
+   timing_event clean end $?
 fi # do_cleanup = true
 
 wait # wait for backgrounded processes to finish
@@ -455,6 +516,9 @@ sbatch --export=machine=${machine},analdate=${analdate},datapath2=${datapath2},h
 
 fi # skip to here if fg_only = true
 
+fi # use_cycledriver
+
+timing_event cycle end 0
 echo "$analdate all done"
 
 # next analdate: increment by $ANALINC
@@ -1,52 +1,107 @@
 from __future__ import print_function
 from netCDF4 import Dataset
 import numpy as np
-import time, sys, os
-try:
-   import cPickle
-except ImportError:
-   import _pickle as cPickle
+import time, sys, os, glob, argparse
+from fv3interp import trmesh_triangles, barycentric_weights, save_weights, load_weights,\
+                      interp_fields, mesh_files, save_mesh, load_mesh, parse_grid,\
+                      weights_file
+from ncutils import parse_lsd, varencoding
 
 python3 = sys.version_info[0] > 2
 
 # interpolate fv3 history files to lat/lon grid.
 # assumes all variables are 3d with dimensions time, grid_yt, grid_xt
 
-if len(sys.argv) < 5:
-    print('incorrect number of arguments: python ncinterp.py datapath fileout RES refdate')
-    raise SystemExit
+parser = argparse.ArgumentParser(description='interpolate fv3 history files to lat/lon grid')
+parser.add_argument('datapath', help='directory containing fv3_historyp.tile*.nc (or member directories, see --members)')
+parser.add_argument('fileout', help='output netcdf file')
+parser.add_argument('res', type=int, help='cubed-sphere resolution (RES)')
+parser.add_argument('refdate', help='reference date (yyyymmddhh) for time units')
+parser.add_argument('--grid', default='latlon:1',
+    help='output grid: latlon:<dlon>[x<dlat>], gaussian:<nlats> or regional:<lon1>,<lon2>,<lat1>,<lat2>,<dlon>[x<dlat>] (default latlon:1)')
+parser.add_argument('--weights', action='store_true',
+    help='cache sparse interpolation weights in C<RES>_grid_<gridname>.npz (created if missing)')
+parser.add_argument('--workers', type=int, default=1,
+    help='number of processes used to read and interpolate variables (default 1)')
+parser.add_argument('--maxmem', type=float, default=None,
+    help='stream variables in time/level chunks, holding at most about this many MB of data at once (default: whole variables)')
+parser.add_argument('--complevel', type=int, default=4,
+    help='zlib compression level for output variables, 0 for no compression (default 4)')
+parser.add_argument('--noshuffle', action='store_true',
+    help='turn off hdf5 shuffle filter')
+parser.add_argument('--chunking', default='field', choices=['field','auto'],
+    help='output chunks: field (one time and level per chunk) or auto (netcdf library default)')
+parser.add_argument('--lsd', default=None,
+    help="lossy compression, least significant digits per variable family e.g. 'h=0,t=2,u=2,v=2,q=7' (default lossless)")
+parser.add_argument('--members', default=None,
+    help="interpolate ensemble mean of member history files in datapath/<members> (glob, e.g. 'mem*'), computed in memory")
+parser.add_argument('--meanpath', default=None,
+    help='with --members, also write ensemble mean history tiles (interpolated times only) to this directory')
+args = parser.parse_args()
 
-nlons = 360; nlats = 181
-zlib = True; lsd = None # lossy compression, lsd significant digits
+lsd = parse_lsd(args.lsd) # lossy compression, lsd significant digits
 
-datapath = sys.argv[1]
-fileout = sys.argv[2]
-res = int(sys.argv[3])
-refdate = sys.argv[4]
-
-# read in triangulation.
-if python3:
-   picklefile = 'C%s_grid.pickle.py3' % res
-else:
-   picklefile = 'C%s_grid.pickle' % res
-tri = cPickle.load(open(picklefile,'rb'))
+datapath = args.datapath
+fileout = args.fileout
+res = args.res
+refdate = args.refdate
 
 # define output grid.
-olons_deg = (360./nlons)*np.arange(nlons)
-olats_deg = -90 + (360./nlons)*np.arange(nlats)
+gridname, olons_deg, olats_deg = parse_grid(args.grid)
+nlons = len(olons_deg); nlats = len(olats_deg)
 olons = np.radians(olons_deg); olats = np.radians(olats_deg)
 olons, olats = np.meshgrid(olons, olats)
 
-# open all history files.
-ncfiles = []
-for ntile in range(1,7,1):
-    datafile = '%s/fv3_historyp.tile%s.nc'% (datapath,ntile)
-    ncfiles.append(Dataset(datafile))
-# get times and variable names.
-nc = ncfiles[0]
-varnames = nc.variables.keys()
+# interpolation weights are cached per (resolution, output grid).
+weightsfile = weights_file(res,gridname)
+if args.weights and os.path.exists(weightsfile):
+   weights = load_weights(weightsfile)
+else:
+   # read in triangulation (C<RES>_grid_xyz.npy, C<RES>_grid_triangles.npy
+   # created by create_pickle.py).
+   if not all(os.path.exists(meshfile) for meshfile in mesh_files(res)):
+      # convert old-style pickled stripack trmesh to array cache.
+      try:
+         import cPickle
+      except ImportError:
+         import _pickle as cPickle
+      if python3:
+         picklefile = 'C%s_grid.pickle.py3' % res
+      else:
+         picklefile = 'C%s_grid.pickle' % res
+      tri = cPickle.load(open(picklefile,'rb'))
+      save_mesh(res,np.column_stack((tri.x,tri.y,tri.z)),trmesh_triangles(tri))
+      del tri
+   xyz, triangles = load_mesh(res)
+   # compute barycentric weights (once for this resolution if --weights set).
+   weights = barycentric_weights(xyz,triangles,olons,olats)
+   if args.weights: save_weights(weightsfile,weights)
+
+# directories with history files to read (averaged if more than one).
+if args.members is not None:
+    # (plain files matching the pattern are ignored, member directories
+    # without all six history tiles are an error since the mean would be
+    # over the wrong number of members).
+    tiledirs = [tiledir for tiledir in sorted(glob.glob(os.path.join(datapath,args.members))) if os.path.isdir(tiledir)]
+    if not tiledirs:
+        raise SystemExit('no member directories match %s' % os.path.join(datapath,args.members))
+    missing = [tiledir for tiledir in tiledirs if not all(os.path.exists('%s/fv3_historyp.tile%s.nc' % (tiledir,ntile)) for ntile in range(1,7,1))]
+    if missing:
+        raise SystemExit('history files fv3_historyp.tile[1-6].nc missing for %s of %s members: %s' %\
+                         (len(missing),len(tiledirs),' '.join(missing)))
+else:
+    tiledirs = [datapath]
+nmembers = len(tiledirs)
+if args.meanpath is not None and args.members is None:
+    raise SystemExit('--meanpath requires --members')
+
+# get times and variable names from first history file.
+nc = Dataset('%s/fv3_historyp.tile1.nc' % tiledirs[0])
+varnames = [varname for varname in nc.variables.keys() if varname not in ['plev','grid_xt','grid_yt','time']]
+ndims = dict((varname,nc[varname].ndim) for varname in varnames)
 timesin = nc['time'][:]
 plevs = nc['plev'][:]; nlevs = len(plevs)
+nc.close()
 # IAU/replay forecasts, shift time origin it is relative to middle of analysis window
 if timesin[0] == 6: 
    timesin = timesin - 6
@@ -58,6 +113,92 @@ for i,time in enumerate(timesin):
         itimes.append(i)
 times = np.asarray(times); ntimes = len(times)
 
+ncfiles = None
+def open_tiles():
+    # open all history files (once per process), ncfiles[member][tile].
+    global ncfiles
+    ncfiles = []
+    for tiledir in tiledirs:
+        ncfiles.append([])
+        for ntile in range(1,7,1):
+            datafile = '%s/fv3_historyp.tile%s.nc'% (tiledir,ntile)
+            ncfiles[-1].append(Dataset(datafile))
+
+def read_interp(task):
+    # read cube data for a chunk (times j1:j2, levels k1:k2) of a variable
+    # (ensemble mean if there are several members), interpolate to lat/lon grid.
+    varname,j1,j2,k1,k2 = task
+    if ndims[varname] == 3:
+        # 3d variables (time, grid_yt, grid_xt)
+        shape = (j2-j1,); index = (itimes[j1:j2],)
+    else:
+        # 4d variables (time, plev, grid_yt, grid_xt)
+        shape = (j2-j1,k2-k1); index = (itimes[j1:j2],slice(k1,k2))
+    if nmembers == 1:
+        cube_data = np.empty(shape+(6,res,res),np.float32)
+        for ntile in range(6):
+            cube_data[...,ntile,:,:] = ncfiles[0][ntile][varname][index]
+    else:
+        # accumulate members one at a time (in double precision).
+        cube_data = np.zeros(shape+(6,res,res),np.float64)
+        for tiles in ncfiles:
+            for ntile in range(6):
+                cube_data[...,ntile,:,:] += tiles[ntile][varname][index]
+        cube_data = (cube_data/nmembers).astype(np.float32)
+    # interpolate all times and levels in chunk at once.
+    latlon_data = interp_fields(weights,cube_data.reshape(-1,6*res*res))
+    if args.meanpath is None: cube_data = None
+    return task, latlon_data.reshape(shape+(nlats,nlons)), cube_data
+
+# split variables into tasks (chunks of times/levels).  by default a task is
+# a whole variable, if --maxmem is set chunks are sized so that all the data
+# in flight (at most 2 chunks per worker) stays below maxmem.
+nworkers = max(1,args.workers)
+if args.maxmem is None:
+    nfieldsmax = ntimes*nlevs
+else:
+    fieldbytes = 4*(6*res*res + nlats*nlons)
+    if nmembers > 1: fieldbytes += 8*6*res*res # double precision sum
+    nfieldsmax = max(1,int(1.e6*args.maxmem/(2*nworkers*fieldbytes)))
+tasks = []
+for varname in varnames:
+    nk = 1 if ndims[varname] == 3 else nlevs
+    if nfieldsmax >= nk:
+        # chunks of times, all levels.
+        ntchunk = nfieldsmax//nk
+        for j1 in range(0,ntimes,ntchunk):
+            tasks.append((varname,j1,min(j1+ntchunk,ntimes),0,nk))
+    else:
+        # one time, chunks of levels.
+        for j1 in range(ntimes):
+            for k1 in range(0,nk,nfieldsmax):
+                tasks.append((varname,j1,j1+1,k1,min(k1+nfieldsmax,nk)))
+# no more workers than tasks.
+nworkers = min(nworkers,len(tasks))
+
+# start worker processes (before any netcdf file is opened in this process).
+# workers inherit the interpolation weights read-only, each opens its own
+# history file handles, and returns interpolated chunks to this process,
+# which is the only one writing to the output file.
+if nworkers > 1:
+    from multiprocessing import Pool
+    from collections import deque
+    pool = Pool(nworkers, initializer=open_tiles)
+    def run_tasks(tasks):
+        # keep at most 2 tasks per worker in flight, so finished chunks
+        # waiting to be written cannot pile up.
+        pending = deque()
+        for task in tasks:
+            if len(pending) >= 2*nworkers:
+                yield pending.popleft().get()
+            pending.append(pool.apply_async(read_interp,(task,)))
+        while pending:
+            yield pending.popleft().get()
+    results = run_tasks(tasks)
+else:
+    open_tiles()
+    results = (read_interp(task) for task in tasks)
+
 ncout = Dataset(fileout ,'w',format='NETCDF4_CLASSIC')
 # define dimensions, coordinate vars in output file
 latd = ncout.createDimension('latitude',nlats)
@@ -78,12 +219,10 @@ p.units = 'hPa'
 p[:] = plevs
 
 for varname in varnames:
-    # skip coordinate variables.
-    if varname in ['plev','grid_xt','grid_yt','time']: continue
     # define variable in output file.
-    if nc[varname].ndim == 3:
-        varout = ncout.createVariable(varname, np.float32, ('time','latitude','longitude'),zlib=zlib,least_significant_digit=lsd)
-        print('processing ',varname)
+    if ndims[varname] == 3:
+        varout = ncout.createVariable(varname, np.float32, ('time','latitude','longitude'),
+                 **varencoding(varname,(ntimes,nlats,nlons),args.complevel,not args.noshuffle,args.chunking,lsd))
         if varname.startswith('u') or varname.startswith('v'):
             varout.units = 'm/sec'
         if varname == 'tmp2m': varout.units = 'K'
@@ -91,45 +230,58 @@ for varname in varnames:
         if varname.startswith('prate'): varout.units = 'mm/sec'
         if varname == 'pressfc': varout.units = 'Pa'
         if varname in ['slp','pmaskv2']: varout.units = 'hPa'
-        # read cube data for this variable.
-        cube_data = np.empty((ntimes,6,res,res),np.float32)
-        for ntile in range(6):
-            # assume all variables are 3d (time, grid_yt, grid_xt)
-            nc = ncfiles[ntile]
-            var = nc[varname]
-            cube_data[:,ntile,:,:] = var[itimes]
-        cube_data = cube_data.reshape(ntimes,6*res*res)
-        latlon_data = np.empty((ntimes,nlats,nlons),np.float32)
-        # interpolate tiles to lat/lon grid for each time for this variable.
-        for ntime in range(ntimes):
-            latlon_data[ntime] = tri.interp_linear(olons,olats,cube_data[ntime])
-            #print(ntime, varout[ntime].min(), varout[ntime].max())
-        varout[:] = latlon_data
     else:
-        varout = ncout.createVariable(varname, np.float32, ('time','plev','latitude','longitude'),zlib=zlib,least_significant_digit=lsd)
-        print('processing ',varname)
+        varout = ncout.createVariable(varname, np.float32, ('time','plev','latitude','longitude'),
+                 **varencoding(varname,(ntimes,nlevs,nlats,nlons),args.complevel,not args.noshuffle,args.chunking,lsd))
         if varname.startswith('u') or varname.startswith('v'):
             varout.units = 'm/sec'
         if varname == 'h_plev': varout.units = 'gpm'
         if varname == 't_plev': varout.units = 'K'
         if varname == 'q_plev': varout.units = 'kg/kg'
-        # read cube data for this variable.
-        cube_data = np.empty((ntimes,nlevs,6,res,res),np.float32)
-        for ntile in range(6):
-           # assume all variables are 3d (time, grid_yt, grid_xt)
-            nc = ncfiles[ntile]
-            var = nc[varname]
-            cube_data[:,:,ntile,:,:] = var[itimes]
-        cube_data = cube_data.reshape(ntimes,nlevs,6*res*res)
-        latlon_data = np.empty((ntimes,nlevs,nlats,nlons),np.float32)
-        # interpolate tiles to lat/lon grid for each time for this variable.
-        for ntime in range(ntimes):
-            for nlev in range(nlevs):
-                    latlon_data[ntime,nlev] = tri.interp_linear(olons,olats,cube_data[ntime,nlev])
-                    #print(ntime, nlev, varout[ntime,nlev].min(), varout[ntime,nlev].max())
-        varout[:] = latlon_data
+
+# ensemble mean history tiles (same layout as member files, interpolated times only).
+ncmeans = []
+if args.meanpath is not None:
+    if not os.path.isdir(args.meanpath): os.makedirs(args.meanpath)
+    for ntile in range(1,7,1):
+        ncin = Dataset('%s/fv3_historyp.tile%s.nc' % (tiledirs[0],ntile))
+        ncmean = Dataset('%s/fv3_historyp.tile%s.nc' % (args.meanpath,ntile),'w',format='NETCDF4_CLASSIC')
+        ncmean.setncatts(dict((key,ncin.getncattr(key)) for key in ncin.ncattrs()))
+        for dimname, dim in ncin.dimensions.items():
+            size = ntimes if dimname == 'time' else len(dim)
+            ncmean.createDimension(dimname,None if dim.isunlimited() else size)
+        for varname, varin in ncin.variables.items():
+            kwargs = {}
+            if varname in varnames:
+                kwargs = varencoding(varname,varin.shape,args.complevel,not args.noshuffle,args.chunking,lsd)
+            varout = ncmean.createVariable(varname,varin.dtype,varin.dimensions,**kwargs)
+            varout.setncatts(dict((key,varin.getncattr(key)) for key in varin.ncattrs() if key != '_FillValue'))
+            if varname == 'time':
+                varout[:] = varin[itimes]
+            elif varname not in varnames:
+                varout[...] = varin[...]
+        ncin.close()
+        ncmeans.append(ncmean)
+
+# write interpolated chunks as they are finished.
+for (varname,j1,j2,k1,k2), latlon_data, cube_data in results:
+    if j1 == 0 and k1 == 0: print('processing ',varname)
+    if ndims[varname] == 3:
+        ncout[varname][j1:j2] = latlon_data
+    else:
+        ncout[varname][j1:j2,k1:k2] = latlon_data
+    for ntile, ncmean in enumerate(ncmeans):
+        if ndims[varname] == 3:
+            ncmean[varname][j1:j2] = cube_data[...,ntile,:,:]
+        else:
+            ncmean[varname][j1:j2,k1:k2] = cube_data[...,ntile,:,:]
 
 # close all files.
-for nc in ncfiles:
+if nworkers > 1:
+    pool.close(); pool.join()
+else:
+    for tiles in ncfiles:
+        for nc in tiles:
+            nc.close()
+for nc in ncmeans + [ncout]:
     nc.close()
-ncout.close()
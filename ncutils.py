@@ -0,0 +1,42 @@
+from __future__ import print_function
+
+# netcdf output encoding (compression, chunking, lossy precision) shared by
+# scripts that write netcdf files.
+
+def parse_lsd(spec):
+    """
+ lsd = parse_lsd(spec)
+
+ parse least_significant_digit spec of the form 'family=digits,...'
+ (e.g. 'h=0,t=2,u=2,v=2,q=7') into a dict.  a family matches every
+ variable whose name starts with it.
+    """
+    lsd = {}
+    if spec:
+        for item in spec.split(','):
+            family, digits = item.split('=')
+            lsd[family.strip()] = int(digits)
+    return lsd
+
+def varencoding(varname, shape, complevel=4, shuffle=True, chunking='field', lsd=None):
+    """
+ kwargs = varencoding(varname, shape, complevel=4, shuffle=True, chunking='field', lsd=None)
+
+ return keyword args for Dataset.createVariable given variable name and
+ shape.  complevel=0 turns compression off.  chunking='field' uses one
+ chunk per 2d (lat/lon) field, i.e. one time and level, matching how
+ verification reads the data; 'auto' uses the netcdf library default.
+ lsd is a dict from parse_lsd, the longest matching family is used.
+    """
+    kwargs = dict(zlib=complevel > 0)
+    if complevel > 0:
+        kwargs['complevel'] = complevel
+        kwargs['shuffle'] = shuffle
+    if chunking == 'field':
+        kwargs['chunksizes'] = (1,)*(len(shape)-2) + tuple(shape[-2:])
+    elif chunking != 'auto':
+        raise ValueError('chunking must be field or auto')
+    families = [family for family in (lsd or {}) if varname.startswith(family)]
+    if families:
+        kwargs['least_significant_digit'] = lsd[max(families,key=len)]
+    return kwargs
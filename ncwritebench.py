@@ -0,0 +1,73 @@
+from __future__ import print_function
+from netCDF4 import Dataset
+import numpy as np
+import time, os, argparse, itertools, tempfile
+from ncutils import parse_lsd, varencoding
+
+# benchmark netcdf write throughput, file size and single field read time
+# for different compression/chunking settings, using the data in an
+# interpolated history file (fv3*_historyp_*_latlon.nc written by ncinterp.py).
+
+parser = argparse.ArgumentParser(description='benchmark ncinterp.py output encoding settings')
+parser.add_argument('filename', help='fv3*_historyp_<date>_latlon.nc file to rewrite')
+parser.add_argument('--complevels', default='0,1,4,6',
+    help='comma separated zlib compression levels to test (default 0,1,4,6)')
+parser.add_argument('--lsd', default=None,
+    help="also test lossy compression with this least significant digit spec, e.g. 'h=0,t=2,u=2,v=2,q=7'")
+parser.add_argument('--tmpdir', default=None,
+    help='directory for temporary output files (default: same as filename)')
+args = parser.parse_args()
+
+# read everything into memory first, so only writes are timed.
+nc = Dataset(args.filename)
+coords = ['latitude','longitude','time','plev']
+data = {}; dims = {}
+for varname in nc.variables:
+    data[varname] = nc[varname][:]
+    dims[varname] = nc[varname].dimensions
+dimsizes = dict((dimname,len(dim)) for dimname,dim in nc.dimensions.items())
+nc.close()
+nbytes = sum(data[varname].nbytes for varname in data if varname not in coords)
+
+complevels = [int(complevel) for complevel in args.complevels.split(',')]
+lsds = [None]
+if args.lsd: lsds.append(args.lsd)
+settings = []
+for complevel, shuffle, chunking, lsd in itertools.product(complevels,[True,False],['field','auto'],lsds):
+    if complevel == 0 and (not shuffle or lsd is not None): continue
+    settings.append((complevel,shuffle,chunking,lsd))
+
+tmpdir = args.tmpdir or os.path.dirname(os.path.abspath(args.filename))
+print('%8s %7s %8s %-24s %10s %10s %10s %12s' %\
+      ('complevel','shuffle','chunking','lsd','write(s)','MB/s','size(MB)','read(ms/fld)'))
+for complevel, shuffle, chunking, lsd in settings:
+    fd, fileout = tempfile.mkstemp(suffix='.nc',dir=tmpdir); os.close(fd)
+    t1 = time.time()
+    ncout = Dataset(fileout,'w',format='NETCDF4_CLASSIC')
+    for dimname, size in dimsizes.items():
+        ncout.createDimension(dimname,size)
+    for varname in data:
+        if varname in coords:
+            varout = ncout.createVariable(varname,np.float32,dims[varname])
+        else:
+            varout = ncout.createVariable(varname,np.float32,dims[varname],
+                     **varencoding(varname,data[varname].shape,complevel,shuffle,chunking,parse_lsd(lsd)))
+        varout[:] = data[varname]
+    ncout.close()
+    twrite = time.time()-t1
+    size = os.path.getsize(fileout)
+    # read one 2d field per variable (time and level chosen at random), the
+    # way the verification scripts access the data.
+    nc = Dataset(fileout)
+    nfields = 0
+    t1 = time.time()
+    for varname in data:
+        if varname in coords: continue
+        index = tuple(np.random.randint(n) for n in data[varname].shape[:-2])
+        nc[varname][index]
+        nfields += 1
+    tread = time.time()-t1
+    nc.close()
+    os.remove(fileout)
+    print('%8s %7s %8s %-24s %10.2f %10.1f %10.1f %12.2f' %\
+          (complevel,shuffle,chunking,lsd,twrite,1.e-6*nbytes/twrite,1.e-6*size,1.e3*tread/nfields))
@@ -1,11 +1,15 @@
+from __future__ import print_function
 import matplotlib
 #matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import numpy as np
-import sys, os
-import dateutils, pygrib
+import sys, os, argparse
+import dateutils
+from verifstore import VerifStore
 from netCDF4 import Dataset
-from spharm import Spharmt, getspecindx
+from spectutils import getgridspectra
+from runningstats import RunningStats
+from diagstore import openstores
 from matplotlib.ticker import FormatStrFormatter,FuncFormatter,LogLocator
 from matplotlib import rcParams
 
@@ -15,113 +19,154 @@ def getrms(diff,coslats):
     meancoslats = coslats.mean()
     return np.sqrt((coslats*diff**2).mean()/meancoslats)
 
-def getvarspectrum(dataspec,indxm,indxn,ntrunc):
-    varspect = np.zeros(ntrunc+1,np.float)
-    nlm = (ntrunc+1)*(ntrunc+2)/2
-    for n in range(nlm):
-        if indxm[n] == 0:
-            varspect[indxn[n]] += (0.5*dataspec[n]*np.conj(dataspec[n])).real
-        else:
-            varspect[indxn[n]] += (dataspec[n]*np.conj(dataspec[n])).real
-    return varspect
+# forecast error spectra for two experiments, for every requested
+# (var, level, fhour) combination in one pass (each forecast file
+# opened once per date).
 
+parser = argparse.ArgumentParser(description='forecast error spectra vs EC analyses')
+parser.add_argument('expt1'); parser.add_argument('expt2')
+parser.add_argument('date1'); parser.add_argument('date2')
+parser.add_argument('--vars', default='t', help='comma separated variables (default t)')
+parser.add_argument('--levels', default='500', help='comma separated pressure levels (default 500)')
+parser.add_argument('--fhours', default='120', help='comma separated forecast hours (default 120)')
+parser.add_argument('--statsdir', default=None,
+    help='directory keeping accumulated spectra for each (var, level, fhour), dates already in them are skipped')
+parser.add_argument('--verifcache', default='verifcache',
+    help="directory caching decoded analysis grib fields ('none' to disable)")
+parser.add_argument('--store', default=None,
+    help='diagnostics store to append error spectra to (%%s is replaced by the experiment name)')
+args = parser.parse_args()
 
-expt1 = sys.argv[1]
-expt2 = sys.argv[2]
-date1 = sys.argv[3]
-date2 = sys.argv[4]
+expt1 = args.expt1
+expt2 = args.expt2
+date1 = args.date1
+date2 = args.date2
 
-fhour = 120
-var = 't'
-level = 500
-vargrb = var
-varnc = '%s_plev' % var
-if var == 'z': 
-    vargrb = 'gh'
-    varnc = 'h_plev'
+combos = [(var,int(level),int(fhour)) for var in args.vars.split(',')\
+          for level in args.levels.split(',') for fhour in args.fhours.split(',')]
+def getvarnames(var):
+    # grib shortName, netcdf variable name.
+    if var == 'z':
+        return 'gh', 'h_plev'
+    else:
+        return var, '%s_plev' % var
 
 datapath1 = '/scratch3/BMC/gsienkf/whitaker/%s' % expt1
 datapath2 = '/scratch3/BMC/gsienkf/whitaker/%s' % expt2
 analpath = '/scratch3/BMC/gsienkf/whitaker/ecanl'
+verifstore = VerifStore(None if args.verifcache == 'none' else args.verifcache)
 
-if fhour > 9:
-    dates = dateutils.daterange(date1,date2,24)
-else:
-    dates = dateutils.daterange(date1,date2,6)
-ntime = None; fcsterrspect1 = None; fcsterrspect2 = None
-for date in dates:
-    datev = dateutils.dateshift(date,fhour)
-    # read analysis
-    analfile = os.path.join(analpath,'pgbanl.ecm.%s' % datev)
-    grbs = pygrib.open(analfile)
-    grb = grbs.select(shortName=vargrb,level=level)[0]
-    verif_data = grb.values[::-1,:]
-    grbs.close()
-    if fhour > 9:
-        fcstfile = '%s/%s/fv3longcontrol2_historyp_%s_latlon.nc'% (datapath1,date,date)
-    else:
-        fcstfile = '%s/%s/fv3control2_historyp_%s_latlon.nc'% (datapath1,date,date)
-    nc = Dataset(fcstfile)
-    if ntime is None:
-        times = nc['time'][:].tolist()
-        levels = nc['plev'][:].tolist()
-        ntime = times.index(fhour)
-        nlev = levels.index(level)
-        lons = nc['longitude'][:]; lats = nc['latitude'][:]
-        nlons = len(lons); nlats = len(lats)
-        re = 6.3712e6; ntrunc=nlats-1
-        spec = Spharmt(nlons,nlats,rsphere=re,gridtype='regular',legfunc='computed')
-        indxm, indxn = getspecindx(ntrunc)
-        degree = indxn.astype(np.float)
-    if int(nc['time'][ntime]) != fhour:
-       raise ValueError('incorrect forecast time')
-    fcst_data1 = nc[varnc][ntime,nlev,...]
-    nc.close()
+datesfhr = {}
+for var,level,fhour in combos:
     if fhour > 9:
-        fcstfile = '%s/%s/fv3longcontrol2_historyp_%s_latlon.nc'% (datapath2,date,date)
+        datesfhr[fhour] = dateutils.daterange(date1,date2,24)
     else:
-        fcstfile = '%s/%s/fv3control2_historyp_%s_latlon.nc'% (datapath2,date,date)
-    nc = Dataset(fcstfile)
-    if int(nc['time'][ntime]) != fhour:
-       raise ValueError('incorrect forecast time')
-    fcst_data2 = nc[varnc][ntime,nlev,...]
-    nc.close()
+        datesfhr[fhour] = dateutils.daterange(date1,date2,6)
+dates = sorted(set(date for fhour in datesfhr for date in datesfhr[fhour]))
+gridspectra = None
+def getstatsfile(combo):
+    return os.path.join(args.statsdir,'errspect_%s_%s_%s%s_f%03i.npz' % ((expt1,expt2)+combo))
+# running mean of error spectra (both experiments) for each combo.
+if args.statsdir is None:
+    fcsterrspect = dict((combo,RunningStats()) for combo in combos)
+else:
+    if not os.path.isdir(args.statsdir): os.makedirs(args.statsdir)
+    fcsterrspect = dict((combo,RunningStats.load(getstatsfile(combo),missing_ok=True)) for combo in combos)
+storerows = [[],[]] # (date, records) for each experiment's diagnostics store
+for date in dates:
+    combosdate = [combo for combo in combos if date in datesfhr[combo[2]] and date not in fcsterrspect[combo]]
+    if not combosdate: continue
+    # read analyses (all vars and levels valid at the same time at once)
+    verif_data = {}
+    for fhour in sorted(set(combo[2] for combo in combosdate)):
+        datev = dateutils.dateshift(date,fhour)
+        analfile = os.path.join(analpath,'pgbanl.ecm.%s' % datev)
+        fcombos = [combo for combo in combosdate if combo[2] == fhour]
+        analdata = verifstore.get_many(analfile,[(getvarnames(var)[0],level,None) for var,level,fhour in fcombos])
+        for combo, anal in zip(fcombos,analdata):
+            verif_data[combo] = anal[::-1,:]
+    # read forecasts, opening each file once.
+    fcst_data = {}
+    for nexp, datapath in enumerate([datapath1,datapath2]):
+        fcstfiles = {}
+        for combo in combosdate:
+            if combo[2] > 9:
+                fcstfile = '%s/%s/fv3longcontrol2_historyp_%s_latlon.nc'% (datapath,date,date)
+            else:
+                fcstfile = '%s/%s/fv3control2_historyp_%s_latlon.nc'% (datapath,date,date)
+            fcstfiles.setdefault(fcstfile,[]).append(combo)
+        for fcstfile in fcstfiles:
+            nc = Dataset(fcstfile)
+            if gridspectra is None:
+                lons = nc['longitude'][:]; lats = nc['latitude'][:]
+                nlons = len(lons); nlats = len(lats)
+                re = 6.3712e6; ntrunc=nlats-1
+                gridspectra = getgridspectra(nlons,nlats,rsphere=re)
+            times = nc['time'][:].tolist()
+            levels = nc['plev'][:].tolist()
+            for combo in fcstfiles[fcstfile]:
+                var, level, fhour = combo
+                ntime = times.index(fhour)
+                nlev = levels.index(level)
+                if int(nc['time'][ntime]) != fhour:
+                   raise ValueError('incorrect forecast time')
+                fcst_data[nexp,combo] = nc[getvarnames(var)[1]][ntime,nlev,...]
+            nc.close()
     #print date,verif_data.shape,verif_data.min(),verif_data.max(),\
     #           fcst_data1.shape,fcst_data1.min(),fcst_data1.max(),\
     #           fcst_data2.shape,fcst_data2.min(),fcst_data2.max()
-    fcsterr = fcst_data1 - verif_data
-    fcsterrspec = spec.grdtospec(fcsterr)
-    varspec = getvarspectrum(fcsterrspec,indxm,indxn,ntrunc)
-    rms1 = varspec.sum()
-    if fcsterrspect1 is None:
-        fcsterrspect1 = varspec/len(dates)
+    # spectra of all errors for this date from one batched transform.
+    fcsterr = np.array([[fcst_data[nexp,combo] - verif_data[combo] for nexp in range(2)]\
+                        for combo in combosdate])
+    varspecs = gridspectra(fcsterr)
+    for ncombo, combo in enumerate(combosdate):
+        fcsterrspect[combo].add(varspecs[ncombo],key=date)
+        for nexp in range(2):
+            storerows[nexp].append((date,[('errspect_%s_%s_f%03i' % combo,varspecs[ncombo,nexp],\
+                dict(diag='errspect',var=combo[0],level=combo[1],fhour=combo[2],region='gl'))]))
+        rms = varspecs[ncombo].sum(axis=-1)
+        if len(combos) > 1:
+            print(date,'%s %s %sh' % combo,np.sqrt(rms[0]),np.sqrt(rms[1]))
+        else:
+            print(date,np.sqrt(rms[0]),np.sqrt(rms[1]))
+
+if args.store is not None:
+    for nexp, store in enumerate(openstores(args.store,[expt1,expt2])):
+        store.extend(storerows[nexp])
+
+for combo in combos:
+    var, level, fhour = combo
+    if args.statsdir is not None:
+        fcsterrspect[combo].save(getstatsfile(combo))
+    if fcsterrspect[combo].mean is None:
+        print('no dates for %s %s %sh, skipping' % combo)
+        continue
+    fcsterrspect1, fcsterrspect2 = fcsterrspect[combo].mean
+    ntrunc = len(fcsterrspect1)-1
+    mean1 = np.sqrt(fcsterrspect1.sum())
+    mean2 = np.sqrt(fcsterrspect2.sum())
+    if len(combos) > 1:
+        print('global RMS spectra %s %s %sh' % combo,expt1,expt2,mean1,mean2)
     else:
-        fcsterrspect1 += varspec/len(dates)
-    fcsterr = fcst_data2 - verif_data
-    fcsterrspec = spec.grdtospec(fcsterr)
-    varspec = getvarspectrum(fcsterrspec,indxm,indxn,ntrunc)
-    rms2 = varspec.sum()
-    if fcsterrspect2 is None:
-        fcsterrspect2 = varspec/len(dates)
+        print('global RMS spectra',expt1,expt2,mean1,mean2)
+    plt.figure()
+    plt.semilogy(np.arange(ntrunc+1),fcsterrspect1,color='b',linewidth=2,\
+            label='%s Global RMS %4.2f' % (expt1,mean1))
+    plt.semilogy(np.arange(ntrunc+1),fcsterrspect2,color='r',linewidth=2,\
+            label='%s Global RMS %4.2f' % (expt2,mean2))
+    plt.legend(loc=0)
+    #if var == 'z':
+    #    plt.ylim(1.e-3,10.)
+    #elif var == 't':
+    #    plt.ylim(6.e-4,1.e-2)
+    plt.xlim(0,ntrunc-1)
+    plt.xlabel('total wavenumber')
+    plt.ylabel('error variance (fcst vs EC analysis)')
+    # (stored stats in --statsdir may cover dates outside date1-date2)
+    plt.title('%s-h forecast error spectrum %s %s (%s-%s, %s dates)' %\
+              ((fhour,var,level)+fcsterrspect[combo].keyrange()+(fcsterrspect[combo].count,)))
+    if len(combos) > 1:
+        plt.savefig('spectrum_%s%s_f%03i.png' % (var,level,fhour))
     else:
-        fcsterrspect2 += varspec/len(dates)
-    print date,np.sqrt(rms1),np.sqrt(rms2)
-
-mean1 = np.sqrt(fcsterrspect1.sum())
-mean2 = np.sqrt(fcsterrspect2.sum())
-print 'global RMS spectra',expt1,expt2,mean1,mean2
-plt.semilogy(np.arange(ntrunc+1),fcsterrspect1,color='b',linewidth=2,\
-        label='%s Global RMS %4.2f' % (expt1,mean1))
-plt.semilogy(np.arange(ntrunc+1),fcsterrspect2,color='r',linewidth=2,\
-        label='%s Global RMS %4.2f' % (expt2,mean2))
-plt.legend(loc=0)
-#if var == 'z':
-#    plt.ylim(1.e-3,10.)
-#elif var == 't':
-#    plt.ylim(6.e-4,1.e-2)
-plt.xlim(0,ntrunc-1)
-plt.xlabel('total wavenumber')
-plt.ylabel('error variance (fcst vs EC analysis)')
-plt.title('6-h forecast error spectrum %s %s (%s-%s)' % (var,level,date1,date2))
-plt.savefig('spectrum_test.png')
+        plt.savefig('spectrum_test.png')
 plt.show()
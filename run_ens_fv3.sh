@@ -1,5 +1,6 @@
 #!/bin/sh
 export VERBOSE=YES
+source ${enkfscripts}/timing.sh
 
 date
 # run model
@@ -45,7 +46,9 @@ while [ $nanal -le $nanals ]; do
  node_end=$((node_end+${countproc}-1))
  if [ $filemissing == 'yes' ]; then
    echo "nanal = ${nanal}, nhost = ${nhost}, node = ${node}, node_end = ${node_end}"
-   sh ${enkfscripts}/${rungfs} > ${current_logdir}/run_fg_${charnanal}.iter${niter}.out 2>&1 &
+   (timing_event fg_member start "" ${charnanal}
+    sh ${enkfscripts}/${rungfs} > ${current_logdir}/run_fg_${charnanal}.iter${niter}.out 2>&1
+    timing_event fg_member end $? ${charnanal}) &
    nhost=$((nhost+countproc))
  else
    echo "skipping nanal = ${nanal}, output files already created"
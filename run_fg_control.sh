@@ -118,7 +118,8 @@ done
 cd ${enkfscripts}
 echo "interpolate pressure level history files from ${charnanal} forecast to 1x1 deg grid `date`"
 if [ -s ${datapathp1}/${charnanal}/fv3_historyp.tile1.nc ]; then
-  $python ncinterp.py ${datapathp1}/${charnanal} ${datapath2}/fv3${charnanal}_historyp_${analdate}_latlon.nc $RES_CTL $analdate
+  # data held by all workers together is limited to about 4 GB (--maxmem).
+  $python ncinterp.py ${datapathp1}/${charnanal} ${datapath2}/fv3${charnanal}_historyp_${analdate}_latlon.nc $RES_CTL $analdate --weights --workers $corespernode --maxmem 4000
   echo "all done `date`"
 fi
 
@@ -0,0 +1,92 @@
+from __future__ import print_function
+import numpy as np
+import os
+
+# streaming (Welford) mean and variance of a sequence of arrays, so time
+# means can be accumulated one cycle at a time without knowing the number
+# of samples in advance.  accumulators from different workers (or
+# different runs) can be merged, and saved to / loaded from npz files.
+
+class RunningStats(object):
+    """
+ stats = RunningStats()
+
+ stats.add(x, key=None)   # add one sample (scalar or array)
+ stats.merge(other)       # combine with another accumulator
+ stats.save(filename); stats = RunningStats.load(filename)
+
+ stats.count, stats.mean, stats.var(ddof=0), stats.std(ddof=0)
+ stats.keyrange()         # first and last key, e.g. dates covered
+
+ if a sample is added with a key (e.g. the date), the key is remembered
+ (stats.keys) so a restarted run can skip samples already included.
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self.keys = []
+    def __contains__(self, key):
+        return key in self.keys
+    def add(self, x, key=None):
+        """add sample x (all samples must have the same shape)"""
+        if key is not None:
+            if key in self.keys:
+                raise ValueError('sample %s already added' % key)
+            self.keys.append(key)
+        x = np.asarray(x, np.float64)
+        self.count += 1
+        if self.mean is None:
+            self.mean = x.copy(); self.m2 = np.zeros_like(x)
+        else:
+            delta = x - self.mean
+            self.mean += delta/self.count
+            self.m2 += delta*(x - self.mean)
+    def merge(self, other):
+        """add all samples accumulated in other (Chan et al. pairwise update)"""
+        if other.count == 0: return self
+        if set(self.keys) & set(other.keys):
+            raise ValueError('accumulators have samples in common')
+        if self.count == 0:
+            self.mean = other.mean.copy(); self.m2 = other.m2.copy()
+        else:
+            count = self.count + other.count
+            delta = other.mean - self.mean
+            self.mean = self.mean + delta*other.count/count
+            self.m2 = self.m2 + other.m2 + delta**2*self.count*other.count/count
+        self.count += other.count
+        self.keys = self.keys + other.keys
+        return self
+    def keyrange(self):
+        """(first, last) of the sample keys (None if no keys were given)"""
+        if not self.keys: return None
+        return min(self.keys), max(self.keys)
+    def var(self, ddof=0):
+        """variance of samples (ddof=1 for unbiased estimate)"""
+        if self.count - ddof <= 0: return None
+        return self.m2/(self.count - ddof)
+    def std(self, ddof=0):
+        var = self.var(ddof)
+        return None if var is None else np.sqrt(var)
+    def save(self, filename):
+        """write to npz file (via temporary file and rename)"""
+        tmpfile = '%s.%s.tmp.npz' % (filename, os.getpid())
+        if self.count == 0:
+            np.savez(tmpfile, count=0, keys=np.array([],str))
+        else:
+            np.savez(tmpfile, count=self.count, mean=self.mean, m2=self.m2,
+                     keys=np.array(self.keys,str))
+        os.rename(tmpfile, filename)
+    @classmethod
+    def load(cls, filename, missing_ok=False):
+        """read from npz file (empty accumulator if missing_ok and filename does not exist)"""
+        stats = cls()
+        if missing_ok and not os.path.exists(filename):
+            return stats
+        f = np.load(filename)
+        stats.count = int(f['count'])
+        stats.keys = [str(key) for key in f['keys']]
+        if stats.count > 0:
+            stats.mean = f['mean']; stats.m2 = f['m2']
+        f.close()
+        return stats
@@ -0,0 +1,76 @@
+from __future__ import print_function
+import numpy as np
+
+# degree (total wavenumber) variance spectra of spherical harmonic
+# coefficients, computed with np.bincount instead of a python loop over
+# coefficients.  works for a single field or a stack of fields (the
+# output of Spharmt.grdtospec for a (nlat,nlon,nt) array).
+
+class VarSpectrum(object):
+    """
+ varspectrum = VarSpectrum(indxm, indxn, ntrunc)
+
+ varspect = varspectrum(dataspec)
+
+ indxm, indxn are the zonal and total wavenumbers of each coefficient
+ (from spharm.getspecindx(ntrunc)).  dataspec is a complex array of
+ spectral coefficients with shape (nlm,...), varspect has shape
+ (ntrunc+1,...).  m=0 coefficients are weighted by 0.5.
+    """
+    def __init__(self, indxm, indxn, ntrunc):
+        self.indxn = np.asarray(indxn,np.intp)
+        self.weights = np.where(np.asarray(indxm) == 0, 0.5, 1.0)
+        self.ntrunc = ntrunc
+    def __call__(self, dataspec):
+        dataspec = np.asarray(dataspec)
+        nlm = dataspec.shape[0]; shape = dataspec.shape[1:]
+        power = self.weights*(dataspec.real**2+dataspec.imag**2).reshape(nlm,-1).T
+        nfields = power.shape[0]; nn = self.ntrunc+1
+        # offset degree index of each field so one bincount does all fields.
+        indx = self.indxn + nn*np.arange(nfields)[:,np.newaxis]
+        varspect = np.bincount(indx.ravel(),weights=power.ravel(),minlength=nn*nfields)
+        return varspect.reshape(nfields,nn).T.reshape((nn,)+shape)
+
+class GridSpectra(object):
+    """
+ gridspectra = GridSpectra(nlons, nlats, gridtype='regular', rsphere=6.3712e6)
+
+ varspect = gridspectra(data)
+
+ degree variance spectra for a stack of grids data (...,nlats,nlons),
+ returned with shape (...,ntrunc+1) (ntrunc = nlats-1).  all fields are
+ transformed with one Spharmt.grdtospec call (in chunks of at most
+ maxfields fields).  gridspectra.spec is the Spharmt instance.
+    """
+    def __init__(self, nlons, nlats, gridtype='regular', rsphere=6.3712e6, maxfields=256):
+        from spharm import Spharmt, getspecindx
+        self.ntrunc = nlats-1
+        self.spec = Spharmt(nlons,nlats,rsphere=rsphere,gridtype=gridtype,legfunc='computed')
+        self.indxm, self.indxn = getspecindx(self.ntrunc)
+        self.varspectrum = VarSpectrum(self.indxm,self.indxn,self.ntrunc)
+        self.maxfields = maxfields
+    def __call__(self, data):
+        data = np.asarray(data)
+        shape = data.shape[:-2]; nlats, nlons = data.shape[-2:]
+        # grdtospec wants (nlats,nlons,nt).
+        fields = np.moveaxis(data.reshape((-1,nlats,nlons)),0,-1)
+        nfields = fields.shape[-1]
+        varspect = np.empty((nfields,self.ntrunc+1),np.float64)
+        for n1 in range(0,nfields,self.maxfields):
+            n2 = min(n1+self.maxfields,nfields)
+            dataspec = self.spec.grdtospec(np.ascontiguousarray(fields[...,n1:n2]))
+            varspect[n1:n2] = self.varspectrum(dataspec.reshape((dataspec.shape[0],-1))).T
+        return varspect.reshape(shape+(self.ntrunc+1,))
+
+_gridspectra = {}
+def getgridspectra(nlons, nlats, gridtype='regular', rsphere=6.3712e6):
+    """
+ gridspectra = getgridspectra(nlons, nlats, gridtype='regular', rsphere=6.3712e6)
+
+ return GridSpectra instance for this grid, created on first use and
+ shared by later calls.
+    """
+    key = (nlons, nlats, gridtype, rsphere)
+    if key not in _gridspectra:
+        _gridspectra[key] = GridSpectra(nlons, nlats, gridtype=gridtype, rsphere=rsphere)
+    return _gridspectra[key]
@@ -0,0 +1,11 @@
+# append a stage start/end event to ${current_logdir}/timing.jsonl (one json
+# object per line, read by cycletiming.py).
+# usage: timing_event <stage> <start|end> [status] [member] [fhour]
+# a step inside a stage is named <stage>/<step> (e.g. ensmean_fcst/restart).
+timing_event () {
+   local _status=${3:-null}
+   local _member=null
+   if [ -n "$4" ]; then _member="\"$4\""; fi
+   local _fhour=${5:-null}
+   echo "{\"analdate\": \"${analdate}\", \"event\": \"$2\", \"fhour\": ${_fhour}, \"member\": ${_member}, \"stage\": \"$1\", \"status\": ${_status}, \"time\": `date +%s`}" >> ${current_logdir}/timing.jsonl
+}
@@ -2,31 +2,111 @@
 #matplotlib.use('Agg')
 #import matplotlib.pyplot as plt
 import numpy as np
-import sys, os
+import sys, os, argparse
 import dateutils
 from dateutils import daterange
 from netCDF4 import Dataset
+from diagstore import openstores
+from filecache import ResultCache
 
 def getmean(field,coslats):
-    meancoslats = coslats.mean()
-    return (coslats*field).mean()/meancoslats
+    # coslats is a 1d (latitude) weight vector, same result as using
+    # 2d weights since they are constant along a latitude circle.
+    return (coslats*np.asarray(field,np.float64).mean(axis=-1)).sum()/coslats.sum()
 
-expt = sys.argv[1]
-date1 = sys.argv[2]
-date2 = sys.argv[3]
+parser = argparse.ArgumentParser(description='global mean surface pressure of ens mean first guess')
+parser.add_argument('expt'); parser.add_argument('date1'); parser.add_argument('date2')
+parser.add_argument('--store', default=None,
+    help='diagnostics store to append mean ps to (%%s is replaced by the experiment name)')
+parser.add_argument('--fhr', type=int, default=3,
+    help='forecast hour of first guess (and analysis) files (default 3)')
+parser.add_argument('--workers', type=int, default=1,
+    help='number of processes used to read files in parallel (default 1)')
+parser.add_argument('--cache', default='getmeanps_cache.pickle',
+    help="file with cached mean ps per file, reused if the file is unchanged ('none' to disable)")
+parser.add_argument('--analysis', action='store_true',
+    help='also compute mean ps of ens mean analysis (sanl) and analysis minus first guess')
+parser.add_argument('--nanals', type=int, default=0,
+    help='also compute mean ps of members 1 to nanals (drift of each member relative to the ens mean)')
+args = parser.parse_args()
+expt = args.expt
+date1 = args.date1
+date2 = args.date2
 dates = dateutils.daterange(date1,date2,6)
-coslats = None
+datapath = '/scratch2/BMC/gsienkf/whitaker/%s' % expt
 
-for date in dates:
-    datapath = '/scratch2/BMC/gsienkf/whitaker/%s/%s/sfg_%s_fhr03_ensmean' % (expt,date,date)
-    nc = Dataset(datapath)
-    if coslats is None:
-        lons2d = nc['lon'][:]
-        lats2d = nc['lat'][:]
-        lons1d = lons2d[0,:]
-        lats1d = lats2d[:,0]
-        nlats = len(lats1d); nlons = len(lons1d)
-        coslats = np.cos(np.radians(lats2d))
+def getfiles(date):
+    # first guess ens mean, analysis ens mean and member files for date.
+    datapath2 = os.path.join(datapath,date)
+    fgfile = os.path.join(datapath2,'sfg_%s_fhr%02i_ensmean' % (date,args.fhr))
+    anlfile = None; memfiles = []
+    if args.analysis:
+        anlfile = os.path.join(datapath2,'sanl_%s_fhr%02i_ensmean' % (date,args.fhr))
+    for nanal in range(1,args.nanals+1):
+        memfile = 'sfg_%s_fhr%02i_mem%03i' % (date,args.fhr,nanal)
+        # member files are moved to fgens2 by clean.sh
+        if not os.path.exists(os.path.join(datapath2,memfile)) and\
+           os.path.exists(os.path.join(datapath2,'fgens2',memfile)):
+            memfiles.append(os.path.join(datapath2,'fgens2',memfile))
+        else:
+            memfiles.append(os.path.join(datapath2,memfile))
+    return fgfile, anlfile, memfiles
+
+def getmeanps(filename):
+    nc = Dataset(filename)
     meanps = getmean(nc['pressfc'][0,...],coslats)
-    print(date, meanps)
     nc.close()
+    return meanps
+
+# cos(lat) weights computed once from first file (inherited by workers).
+nc = Dataset(getfiles(dates[0])[0])
+lats2d = nc['lat'][:]
+coslats = np.cos(np.radians(lats2d[:,0] if lats2d.ndim == 2 else lats2d))
+nc.close()
+
+files = []
+for date in dates:
+    fgfile, anlfile, memfiles = getfiles(date)
+    files.append(fgfile)
+    files += [filename for filename in [anlfile]+memfiles if filename is not None and os.path.exists(filename)]
+
+# read files not in the cache, in parallel if requested.
+cache = ResultCache(None if args.cache == 'none' else args.cache)
+meanps = {}
+for filename in files:
+    meanps[filename] = cache.get(filename,[filename])
+todo = [filename for filename in files if meanps[filename] is None]
+if args.workers > 1 and len(todo) > 1:
+    from multiprocessing import Pool
+    pool = Pool(args.workers)
+    results = pool.imap(getmeanps,todo,chunksize=max(1,len(todo)//(4*args.workers)))
+else:
+    results = (getmeanps(filename) for filename in todo)
+for filename, result in zip(todo,results):
+    meanps[filename] = result
+    cache.put(filename,[filename],result)
+if args.workers > 1 and len(todo) > 1:
+    pool.close(); pool.join()
+cache.save()
+
+storerows = []
+for date in dates:
+    fgfile, anlfile, memfiles = getfiles(date)
+    meanpsfg = meanps[fgfile]
+    records = [('meanps_fg_f%03i_gl' % args.fhr,meanpsfg,dict(diag='meanps_fg',var='pressfc',fhour=args.fhr,region='gl'))]
+    line = '%s %s' % (date, meanpsfg)
+    if anlfile is not None and anlfile in meanps:
+        line += ' anl %s anl-fg %s' % (meanps[anlfile],meanps[anlfile]-meanpsfg)
+        records.append(('meanps_anl_f%03i_gl' % args.fhr,meanps[anlfile],dict(diag='meanps_anl',var='pressfc',fhour=args.fhr,region='gl')))
+    memfiles = [filename for filename in memfiles if filename in meanps]
+    if memfiles:
+        meanpsmem = np.array([meanps[filename] for filename in memfiles])
+        # drift of members relative to ens mean.
+        drift = meanpsmem - meanpsfg
+        line += ' nmem %s mem-ensmean min %s max %s' % (len(memfiles),drift.min(),drift.max())
+        if len(memfiles) == args.nanals:
+            records.append(('meanps_mem_f%03i_gl' % args.fhr,meanpsmem,dict(diag='meanps_mem',var='pressfc',fhour=args.fhr,region='gl')))
+    print(line)
+    storerows.append((date,records))
+if args.store is not None:
+    openstores(args.store,[expt])[0].extend(storerows)
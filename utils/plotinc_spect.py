@@ -2,57 +2,64 @@ import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import numpy as np
-import sys, os
+import sys, os, argparse
 import dateutils
 from dateutils import daterange
 from netCDF4 import Dataset
-from spharm import Spharmt, getspecindx
+from spectutils import getgridspectra
+from runningstats import RunningStats
+from diagstore import openstores
 from matplotlib.ticker import FormatStrFormatter,FuncFormatter,LogLocator
 
 def getrms(diff,coslats):
     meancoslats = coslats.mean()
     return np.sqrt((coslats*diff**2).mean()/meancoslats)
 
-def getvarspectrum(dataspec,indxm,indxn,ntrunc):
-    varspect = np.zeros(ntrunc+1,np.float)
-    nlm = (ntrunc+1)*(ntrunc+2)/2
-    for n in range(nlm):
-        if indxm[n] == 0:
-            varspect[indxn[n]] += (0.5*dataspec[n]*np.conj(dataspec[n])).real
-        else:
-            varspect[indxn[n]] += (dataspec[n]*np.conj(dataspec[n])).real
-    return varspect
 
-
-expt1 = sys.argv[1]
-expt2 = sys.argv[2]
-date1 = sys.argv[3]
-date2 = sys.argv[4]
+parser = argparse.ArgumentParser(description='analysis increment spectra for hybrid gain (expt1) and hybrid cov (expt2)')
+parser.add_argument('expt1'); parser.add_argument('expt2')
+parser.add_argument('date1'); parser.add_argument('date2')
+# optional file with accumulated spectra (dates already in it are skipped,
+# new dates are added to it).
+parser.add_argument('statsfile', nargs='?', default=None)
+parser.add_argument('--store', default=None,
+    help='diagnostics store to append increment spectra to (%%s is replaced by the experiment name)')
+args = parser.parse_args()
+expt1 = args.expt1
+expt2 = args.expt2
+date1 = args.date1
+date2 = args.date2
+statsfile = args.statsfile
 dates = dateutils.daterange(date1,date2,6)
 var = 'tmp'
 #var = 'pressfc'
 nlev = 64-25
 alpha = 0.5
 
-spec1 = None; spec2 = None; spec3 = None; spec4 = None
+gridspectra = None
+if statsfile is None:
+    stats = RunningStats()
+else:
+    stats = RunningStats.load(statsfile,missing_ok=True)
+storerows = [[],[]] # (date, records) for each experiment's diagnostics store
 for date in dates:
+    if date in stats: continue
 
+    incs = [] # hybrid gain, hybrid cov, enkf and 3dvar increments
     # get first guess for expt 1 (hybrid gain)
     datapath = '/scratch2/BMC/gsienkf/whitaker/%s' % expt1
     print datapath
     print date
     filename = os.path.join(os.path.join(datapath,date),'sfg_%s_fhr06_ensmean' % date)
     nc = Dataset(filename)
-    if spec1 is None:
+    if gridspectra is None:
         lons2d = nc['lon'][:]
         lats2d = nc['lat'][:]
         lons1d = lons2d[0,:]
         lats1d = lats2d[:,0]
         nlats = len(lats1d); nlons = len(lons1d)
         re = 6.3712e6; ntrunc=nlats-1
-        spec = Spharmt(nlons,nlats,rsphere=re,gridtype='regular',legfunc='computed')
-        indxm, indxn = getspecindx(ntrunc)
-        degree = indxn.astype(np.float)
+        gridspectra = getgridspectra(nlons,nlats,rsphere=re)
     if var == 'pressfc':
         fg1 = nc[var][0,::-1,...]
     else:
@@ -94,11 +101,7 @@ for date in dates:
     print inc.min(), inc.max(), inc.min(), inc.max()
     print 'global RMS',expt1,getrms(inc,np.cos(np.radians(lats2d)))
     
-    incspec = spec.grdtospec(inc)
-    if spec1 is None:
-        spec1 = getvarspectrum(incspec,indxm,indxn,ntrunc)/len(dates)
-    else:
-        spec1 += getvarspectrum(incspec,indxm,indxn,ntrunc)/len(dates)
+    incs.append(inc)
     
     # get hybrid cov increment (expt2)
     datapath = '/scratch2/BMC/gsienkf/whitaker/%s' % expt2
@@ -113,33 +116,38 @@ for date in dates:
     print inc.min(), inc.max(), inc.min(), inc.max()
     print 'global RMS',expt2,getrms(inc,np.cos(np.radians(lats2d)))
     
-    incspec = spec.grdtospec(inc)
-    if spec2 is None:
-        spec2 = getvarspectrum(incspec,indxm,indxn,ntrunc)/len(dates)
-    else:
-        spec2 += getvarspectrum(incspec,indxm,indxn,ntrunc)/len(dates)
+    incs.append(inc)
     
     # enkf increment expt1
     inc = enkfinc
     print inc.min(), inc.max(), inc.min(), inc.max()
     print 'global RMS EnKF',expt1,getrms(inc,np.cos(np.radians(lats2d)))
     
-    incspec = spec.grdtospec(inc)
-    if spec3 is None:
-        spec3 = getvarspectrum(incspec,indxm,indxn,ntrunc)/len(dates)
-    else:
-        spec3 += getvarspectrum(incspec,indxm,indxn,ntrunc)/len(dates)
+    incs.append(inc)
     
     # 3dvar increment expt2
     inc = varinc
     print inc.min(), inc.max(), inc.min(), inc.max()
     print 'global RMS 3DVar',expt1,getrms(inc,np.cos(np.radians(lats2d)))
     
-    incspec = spec.grdtospec(inc)
-    if spec4 is None:
-        spec4 = getvarspectrum(incspec,indxm,indxn,ntrunc)/len(dates)
-    else:
-        spec4 += getvarspectrum(incspec,indxm,indxn,ntrunc)/len(dates)
+    incs.append(inc)
+
+    # spectra of all four increments from one batched transform.
+    varspecs = gridspectra(np.array(incs))
+    stats.add(varspecs,key=date)
+    # nlev is a model level index (not a pressure level), stored as modellev.
+    attrs = dict(var=var,modellev=nlev,region='gl')
+    storerows[0].append((date,[('incspec_%s_%s_k%s' % (name,var,nlev),varspecs[n],dict(diag='incspec_%s' % name,**attrs))\
+                              for n,name in [(0,'hybgain'),(2,'enkf'),(3,'3dvar')]]))
+    storerows[1].append((date,[('incspec_control_%s_k%s' % (var,nlev),varspecs[1],dict(diag='incspec_control',**attrs))]))
+
+if args.store is not None:
+    for nexp, store in enumerate(openstores(args.store,[expt1,expt2])):
+        store.extend(storerows[nexp])
+if statsfile is not None:
+    stats.save(statsfile)
+spec1, spec2, spec3, spec4 = stats.mean
+ntrunc = spec1.shape[0]-1
 
 fout = open('spectrum_test.txt','w')
 for n in xrange(ntrunc+1):
@@ -161,6 +169,7 @@ plt.ylim(1.e-5,1.e-2)
 plt.xlim(0,180)
 plt.xlabel('total wavenumber')
 plt.ylabel('increment variance')
-plt.title('Increment spectrum %s nlev=%s (%s-%s)' % (var,nlev,date1,date2))
+# (stored stats in statsfile may cover dates outside date1-date2)
+plt.title('Increment spectrum %s nlev=%s (%s-%s, %s dates)' % ((var,nlev)+stats.keyrange()+(stats.count,)))
 plt.savefig('spectrum_test.png')
 plt.show()
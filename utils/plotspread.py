@@ -1,41 +1,86 @@
+from __future__ import print_function
 import matplotlib.pyplot as plt
 import numpy as np
-import sys, os
+import sys, os, argparse
 from dateutils import daterange
 from netCDF4 import Dataset
-expt = sys.argv[1]
-date1 = sys.argv[2]
-date2 = sys.argv[3]
+from runningstats import RunningStats
+from diagstore import openstores
+parser = argparse.ArgumentParser(description='zonal mean ensemble spread')
+parser.add_argument('expt'); parser.add_argument('date1'); parser.add_argument('date2')
+# optional file with accumulated spread (dates already in it are skipped,
+# new dates are added to it).  must have been created with the same --vars.
+parser.add_argument('statsfile', nargs='?', default=None)
+parser.add_argument('--vars', default='ugrd,vgrd,tmp,spfh',
+    help='comma separated variables (default ugrd,vgrd,tmp,spfh)')
+parser.add_argument('--levchunk', type=int, default=16,
+    help='number of levels read at a time (default 16)')
+parser.add_argument('--store', default=None,
+    help='diagnostics store to append zonal mean spread to (%%s is replaced by the experiment name)')
+args = parser.parse_args()
+expt = args.expt
+date1 = args.date1
+date2 = args.date2
+statsfile = args.statsfile
 dates = daterange(date1,date2,6)
 datapath = '/scratch2/BMC/gsienkf/whitaker/%s' % expt
-lats = None
-var = 'ugrd'
+varnames = args.vars.split(',')
+filename = os.path.join(os.path.join(datapath,dates[0]),'sfg_%s_fhr06_enssprd' % dates[0])
+nc = Dataset(filename)
+lats = nc['lat'][::-1,0]
+levs = nc['pfull'][::-1]
+nlats = len(lats); nlevs = len(levs)
+nc.close()
+
+def zonalmeans(nc, varnames, levchunk):
+    # zonal means (nvars,nlevs,nlats) of all variables, reducing levchunk
+    # levels at a time as they are read (so memory use is bounded).
+    # levels and latitudes are flipped as in nc[var][0,::-1,::-1,...].
+    zm = np.empty((len(varnames),nlevs,nlats),np.float64)
+    for nvar, var in enumerate(varnames):
+        for k1 in range(0,nlevs,levchunk):
+            k2 = min(k1+levchunk,nlevs)
+            zm[nvar,k1:k2] = nc[var][0,k1:k2,...].mean(axis=-1,dtype=np.float64)
+    return zm[:,::-1,::-1]
+
+if statsfile is None:
+    stats = RunningStats()
+else:
+    stats = RunningStats.load(statsfile,missing_ok=True)
+storerows = []
 for date in dates:
-    print date
+    if date in stats: continue
+    print(date)
     filenamec = os.path.join(os.path.join(datapath,date),'sfg_%s_fhr06_enssprd' % date)
     nc = Dataset(filenamec)
-    if lats is None:
-       lats = nc['lat'][::-1,0]
-       levs = nc['pfull'][::-1]
-       nlats = len(lats); nlevs = len(levs)
-       spread = np.zeros((nlevs,nlats),np.float32)
-    spread1 = nc[var][0,::-1,::-1,...]
-    for k in range(nlevs):
-        print k,spread1[k].min(), spread1[k].max()
-    spread = spread  + spread1.mean(axis=-1)/len(dates)
+    zmspread = zonalmeans(nc,varnames,args.levchunk)
     nc.close()
-print spread.min(), spread.max()
-if var in ['ugrd','vgrd']:
-   clevs = np.arange(0,4.1,0.2)
-   #clevs = np.arange(-0.5,0.51,0.05)
-elif var == 'tmp':
-   clevs = np.arange(0.,2.05,0.1)
+    stats.add(zmspread,key=date)
+    storerows.append((date,[('spreadzm_%s' % var,zmspread[nvar],dict(diag='spread_zonalmean',var=var,region='gl'))\
+                            for nvar,var in enumerate(varnames)]))
+if args.store is not None:
+    openstores(args.store,[expt])[0].extend(storerows)
+if statsfile is not None:
+    stats.save(statsfile)
 lats, levs = np.meshgrid(lats, levs)
-plt.contourf(lats, levs, spread, clevs, cmap=plt.cm.hot_r, extend='both')
-plt.colorbar()
-plt.ylabel('latitude (degrees)')
-plt.xlabel('model level')
-plt.title('%s 6-h forecast spread %s-%s (max value %4.2f)' % (var,date1,date2,spread.max()))
-plt.ylim(1000,0)
-plt.savefig('spread_%s_%s.png' % (expt,var))
+for nvar, var in enumerate(varnames):
+    spread = stats.mean[nvar]
+    print(var, spread.min(), spread.max())
+    if var in ['ugrd','vgrd']:
+       clevs = np.arange(0,4.1,0.2)
+       #clevs = np.arange(-0.5,0.51,0.05)
+    elif var == 'tmp':
+       clevs = np.arange(0.,2.05,0.1)
+    else:
+       clevs = 20
+    plt.figure()
+    plt.contourf(lats, levs, spread, clevs, cmap=plt.cm.hot_r, extend='both')
+    plt.colorbar()
+    plt.ylabel('latitude (degrees)')
+    plt.xlabel('model level')
+    # (stored stats in statsfile may cover dates outside date1-date2)
+    plt.title('%s 6-h forecast spread %s-%s (%s dates, max value %4.2f)' %\
+              ((var,)+stats.keyrange()+(stats.count,spread.max())))
+    plt.ylim(1000,0)
+    plt.savefig('spread_%s_%s.png' % (expt,var))
 plt.show()
@@ -0,0 +1,72 @@
+from __future__ import print_function
+import numpy as np
+
+# area (cos(lat)) weighted rms error and anomaly correlation over several
+# latitude bands at once, for arbitrary stacks of forecasts
+# (e.g. experiments x dates).
+
+regions = ['nh','tr','sh','gl']
+
+def region_masks(lats, latbound=20):
+    """
+ masks = region_masks(lats, latbound=20)
+
+ return (4,nlats) array of 0/1 latitude masks for NH (lat > latbound),
+ tropics (-latbound <= lat <= latbound), SH (lat < -latbound) and globe,
+ in the order of verifstats.regions.
+    """
+    lats = np.asarray(lats)
+    return np.array([lats > latbound, np.abs(lats) <= latbound, lats < -latbound,
+                     np.ones(lats.shape,np.bool_)], np.float64)
+
+class RegionMeans(object):
+    """
+ computes cos(lat) weighted means over all regions with a few reductions.
+
+ the mean of x over region r, ignoring points where valid is False, is
+
+ (sum_r(valid*coslat*x)/sum_r(valid)) / (sum_r(coslat)/sum_r(1))
+
+ i.e. the same as getmean(x,coslats) in the original calcrms.py applied to
+ a masked array.
+    """
+    def __init__(self, lats, nlons, latbound=20):
+        self.masks = region_masks(lats, latbound)
+        self.coslats = np.cos(np.radians(np.asarray(lats,np.float64)))
+        self.nlons = nlons
+        # mean of cos(lat) over each region.
+        self.meancoslats = np.dot(self.masks,self.coslats)/self.masks.sum(axis=1)
+    def __call__(self, x, valid=None):
+        """return region means of x (...,nlats,nlons) as array (...,nregions)"""
+        if valid is None:
+            sumx = np.asarray(x,np.float64).sum(axis=-1)
+            count = self.nlons*np.ones(sumx.shape[-1])
+        else:
+            sumx = np.where(valid,x,0.).sum(axis=-1)
+            count = valid.sum(axis=-1)
+        return np.dot(self.coslats*sumx,self.masks.T)/np.dot(count,self.masks.T)/self.meancoslats
+
+def scores(fcst, verif, climo, valid=None, latbound=20, lats=None, regionmeans=None):
+    """
+ rms, ac = scores(fcst, verif, climo, valid=None, lats=lats)
+
+ compute rms error and anomaly correlation for every region in
+ verifstats.regions given a stack of forecasts fcst (...,nlats,nlons),
+ verification and climatology (broadcastable to fcst) and a mask of
+ valid forecast points (e.g. not underground).  returns two arrays
+ with shape (...,nregions).  either lats or a RegionMeans instance
+ (to reuse the region weights) must be given.
+    """
+    if regionmeans is None:
+        regionmeans = RegionMeans(lats, fcst.shape[-1], latbound)
+    fcst = np.asarray(fcst,np.float64)
+    verif = np.asarray(verif,np.float64); climo = np.asarray(climo,np.float64)
+    if valid is not None:
+        valid = np.broadcast_to(valid,fcst.shape)
+    rms = np.sqrt(regionmeans((fcst-verif)**2,valid))
+    fanom = fcst-climo; vanom = verif-climo
+    cov = regionmeans(fanom*vanom,valid)
+    fvar = regionmeans(fanom**2,valid)
+    vvar = regionmeans(vanom**2) # verifying analysis is never masked
+    ac = cov/(np.sqrt(fvar)*np.sqrt(vvar))
+    return rms, ac
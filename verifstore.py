@@ -0,0 +1,65 @@
+from __future__ import print_function
+import numpy as np
+import os, hashlib
+
+# cache of verification fields (EC analyses, climatology) decoded from grib.
+# each (grib file, shortName, level, dataTime) field is decoded once and
+# saved as a .npy file in the cache directory; later reads are memory-mapped.
+# the cache file name encodes the key (it is the index), and an entry older
+# than its grib file is decoded again.
+
+class VerifStore(object):
+    """
+ store = VerifStore(cachedir)
+
+ data = store.get(gribfile, shortName, level, dataTime=None)
+
+ data = store.get_many(gribfile, [(shortName, level, dataTime), ...])
+
+ if cachedir is None, fields are decoded every time (no cache).
+    """
+    def __init__(self, cachedir):
+        self.cachedir = cachedir
+        if cachedir is not None and not os.path.isdir(cachedir):
+            try:
+                os.makedirs(cachedir)
+            except OSError: # created by another process
+                pass
+    def _cachefile(self, gribfile, shortName, level, dataTime):
+        gribfile = os.path.abspath(gribfile)
+        pathhash = hashlib.md5(os.path.dirname(gribfile).encode('utf-8')).hexdigest()[:8]
+        return os.path.join(self.cachedir,'%s_%s_%s_%s_%s.npy' %\
+               (os.path.basename(gribfile),pathhash,shortName,level,dataTime))
+    def get(self, gribfile, shortName, level, dataTime=None):
+        """return 2d field from gribfile (dataTime=None matches first message with any time)"""
+        return self.get_many(gribfile,[(shortName,level,dataTime)])[0]
+    def get_many(self, gribfile, fields):
+        """return list of 2d fields for (shortName, level, dataTime) tuples, decoding missing ones in one pass"""
+        data = [None]*len(fields)
+        if self.cachedir is not None:
+            gribmtime = os.path.getmtime(gribfile)
+            for n, (shortName, level, dataTime) in enumerate(fields):
+                cachefile = self._cachefile(gribfile,shortName,level,dataTime)
+                if os.path.exists(cachefile) and os.path.getmtime(cachefile) >= gribmtime:
+                    data[n] = np.load(cachefile,mmap_mode='r')
+        missing = [n for n in range(len(fields)) if data[n] is None]
+        if missing:
+            import pygrib
+            grbs = pygrib.open(gribfile)
+            for grb in grbs:
+                for n in missing:
+                    shortName, level, dataTime = fields[n]
+                    if data[n] is None and grb.shortName == shortName and grb.level == level and\
+                       (dataTime is None or grb.dataTime == dataTime):
+                        data[n] = grb.values
+                if all(data[n] is not None for n in missing): break
+            grbs.close()
+            for n in missing:
+                if data[n] is None:
+                    raise ValueError('%s level %s dataTime %s not found in %s' % (fields[n]+(gribfile,)))
+                if self.cachedir is not None:
+                    cachefile = self._cachefile(gribfile,*fields[n])
+                    tmpfile = '%s.%s.tmp.npy' % (cachefile,os.getpid())
+                    np.save(tmpfile,data[n])
+                    os.rename(tmpfile,cachefile)
+        return data